@@ -1,6 +1,33 @@
 import autocomplete_light.shortcuts as al
 from .models import Address
 from firecares.firestation.models import FireDepartment
+from firecares.utils import LRUCache
+
+
+class FireDepartmentAutocomplete(al.AutocompleteModelBase):
+    """
+    Department name autocomplete, names starting with the query are suggested first.
+
+    The ids of hot queries are kept in a small in-process LRU cache.
+    """
+    hot_queries = LRUCache(maxsize=512, timeout=60 * 5)
+
+    def choices_for_request(self):
+        q = self.request.GET.get('q', '').strip()
+
+        if not q:
+            return super(FireDepartmentAutocomplete, self).choices_for_request()
+
+        key = (q.lower(), self.limit_choices)
+        ids = self.hot_queries.get(key)
+
+        if ids is None:
+            ids = list(self.choices.name_search(q, limit=self.limit_choices).values_list('id', flat=True))
+            self.hot_queries.set(key, ids)
+
+        departments = self.choices.in_bulk(ids)
+        return [departments[pk] for pk in ids if pk in departments]
+
 
 al.register(Address,
             # Just like in ModelAdmin.search_fields
@@ -22,7 +49,7 @@ al.register(Address,
                 'class': 'modern-style',
             },)
 
-al.register(FireDepartment,
+al.register(FireDepartment, FireDepartmentAutocomplete,
             # Just like in ModelAdmin.search_fields
             search_fields=['name'],
             attrs={
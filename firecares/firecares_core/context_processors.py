@@ -1,6 +1,7 @@
 from django.conf import settings
 from django.core.cache import cache
-from firecares.firestation.models import FireDepartment, Max, Min
+from django.db.models import Max, Min
+from firecares.firestation.models import FireDepartment
 
 
 def third_party_tracking_ids(request):
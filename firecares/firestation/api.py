@@ -1,14 +1,19 @@
+import hashlib
 import json
 import logging
 from .forms import StaffingForm
-from .models import FireStation, Staffing, FireDepartment
+from .models import FireStation, Staffing, FireDepartment, PopulationClassBreaks, population_class_breaks
+from django.core.cache import cache
 from django.core.serializers.json import DjangoJSONEncoder
 from tastypie import fields
 from tastypie.authentication import SessionAuthentication, ApiKeyAuthentication, MultiAuthentication
-from tastypie.authorization import DjangoAuthorization
+from tastypie.authorization import DjangoAuthorization, ReadOnlyAuthorization
+from tastypie.bundle import Bundle
 from tastypie.cache import SimpleCache
 from tastypie.constants import ALL
 from tastypie.contrib.gis.resources import ModelResource
+from tastypie.exceptions import NotFound
+from tastypie.resources import Resource
 from tastypie.serializers import Serializer
 from tastypie.validation import FormValidation
 
@@ -66,10 +71,32 @@ class FireDepartmentResource(ModelResource):
         cache = SimpleCache()
         list_allowed_methods = ['get']
         detail_allowed_methods = ['get', 'put']
-        filtering = {'state': ALL, 'featured': ALL}
+        filtering = {'state': ALL, 'featured': ALL, 'geom_area': ALL}
+        ordering = ['name', 'state', 'population', 'dist_model_score', 'geom_area']
         serializer = PrettyJSONSerializer()
         limit = 120
 
+    # GET parameters which do not change the filtered set of departments
+    pagination_params = ['limit', 'offset', 'format', 'order_by', 'facets', 'username', 'api_key']
+
+    def alter_list_data_to_serialize(self, request, data):
+        """
+        Adds facet counts of the filtered departments to the list meta when requested with facets=true.
+        """
+        if request.GET.get('facets') == 'true':
+            filters = sorted((key, value) for key, value in request.GET.items() if key not in self.pagination_params)
+            cache_key = 'fire_departments_api_facets_{0}'.format(hashlib.md5(json.dumps(filters)).hexdigest())
+            facets = cache.get(cache_key)
+
+            if facets is None:
+                bundle = self.build_bundle(request=request)
+                facets = self.obj_get_list(bundle).facet_counts()
+                cache.set(cache_key, facets, timeout=60 * 5)
+
+            data['meta']['facets'] = facets
+
+        return data
+
 
 class FireStationResource(JSONDefaultModelResourceMixin, ModelResource):
     """
@@ -85,7 +112,8 @@ class FireStationResource(JSONDefaultModelResourceMixin, ModelResource):
         authentication = MultiAuthentication(SessionAuthentication(), ApiKeyAuthentication())
         list_allowed_methods = ['get']
         detail_allowed_methods = ['get', 'put']
-        filtering = {'department': ('exact',), 'state': ('exact',), 'id': ('exact',)}
+        filtering = {'department': ('exact',), 'state': ('exact',), 'id': ('exact',), 'district_area': ALL}
+        ordering = ['district_area']
         excludes = ['addressbuildingname', 'complex_id', 'data_security', 'distribution_policy', 'fcode', 'foot_id',
                     'ftype', 'globalid', 'gnis_id', 'islandmark', 'loaddate', 'objectid', 'permanent_identifier',
                     'pointlocationtype', 'source_datadesc', 'source_datasetid', 'source_featureid', 'source_originator',
@@ -113,3 +141,43 @@ class StaffingResource(JSONDefaultModelResourceMixin, ModelResource):
         detail_allowed_methods = ['get', 'put', 'delete']
         serializer = PrettyJSONSerializer()
         always_return_data = True
+
+
+class PopulationClassBreaksResource(JSONDefaultModelResourceMixin, Resource):
+    """
+    The population class bullet chart breaks API, served from the cached breaks.
+    """
+
+    population_class = fields.IntegerField(attribute='population_class')
+    residential_fires_avg_3_years_breaks = fields.ListField(attribute='residential_fires_avg_3_years_breaks',
+                                                            null=True)
+    risk_model_size1_percent_size2_percent_sum_breaks = fields.ListField(
+        attribute='risk_model_size1_percent_size2_percent_sum_breaks', null=True)
+    risk_model_deaths_injuries_sum_breaks = fields.ListField(attribute='risk_model_deaths_injuries_sum_breaks',
+                                                             null=True)
+
+    class Meta:
+        resource_name = 'population-class-breaks'
+        object_class = PopulationClassBreaks
+        authorization = ReadOnlyAuthorization()
+        authentication = MultiAuthentication(SessionAuthentication(), ApiKeyAuthentication())
+        list_allowed_methods = ['get']
+        detail_allowed_methods = ['get']
+        serializer = PrettyJSONSerializer()
+
+    def detail_uri_kwargs(self, bundle_or_obj):
+        obj = bundle_or_obj.obj if isinstance(bundle_or_obj, Bundle) else bundle_or_obj
+        return {'pk': obj.population_class}
+
+    def get_object_list(self, request):
+        breaks = population_class_breaks()
+        return [breaks[population_class] for population_class in sorted(breaks)]
+
+    def obj_get_list(self, bundle, **kwargs):
+        return self.get_object_list(bundle.request)
+
+    def obj_get(self, bundle, **kwargs):
+        try:
+            return population_class_breaks()[int(kwargs.get('pk'))]
+        except (KeyError, TypeError, ValueError):
+            raise NotFound('Population class breaks not found.')
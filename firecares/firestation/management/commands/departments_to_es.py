@@ -1,44 +1,135 @@
 import json
-import elasticsearch
-from django.core.management.base import BaseCommand
-from firecares.firestation.models import FireDepartment
-from elasticsearch import Elasticsearch, RequestsHttpConnection
-from requests_aws4auth import AWS4Auth
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
+from django.utils import timezone
+from firecares.firestation.models import FireDepartment, SearchIndexSync
+
 
 class Command(BaseCommand):
-    help = 'Loads all departments in ElasticSearch.'
+    help = 'Loads departments in ElasticSearch using the bulk API.'
 
     def add_arguments(self, parser):
         parser.add_argument('--host', dest='host', default='localhost:9200')
         parser.add_argument('--region', dest='region', default='us-east-1')
+        parser.add_argument('--index', dest='index', default='firecares')
+        parser.add_argument('--batch-size', dest='batch_size', type=int, default=500,
+                            help='Number of departments sent per bulk request.')
+        parser.add_argument('--workers', dest='workers', type=int, default=4,
+                            help='Number of bulk requests sent in parallel.')
+        parser.add_argument('--incremental', dest='incremental', action='store_true', default=False,
+                            help='Only index departments modified since the last successful sync.')
+        parser.add_argument('--local', dest='local', action='store_true', default=False,
+                            help='Connect over plain HTTP without AWS auth (ie: a local Elasticsearch).')
 
-    def handle(self, *args, **options):
+    def get_client(self, **options):
+        from elasticsearch import Elasticsearch, RequestsHttpConnection
+
+        if options.get('local'):
+            return Elasticsearch(hosts=[options.get('host')])
 
-        host = options.get('host')
-        region = options.get('region')
-        awsauth = AWS4Auth(settings.AWS_ACCESS_KEY_ID, settings.AWS_SECRET_ACCESS_KEY, region, 'es')
+        from requests_aws4auth import AWS4Auth
+        awsauth = AWS4Auth(settings.AWS_ACCESS_KEY_ID, settings.AWS_SECRET_ACCESS_KEY, options.get('region'), 'es')
 
-        es = Elasticsearch(
-            hosts=[{'host': host, 'port': 443}],
+        return Elasticsearch(
+            hosts=[{'host': options.get('host'), 'port': 443}],
             http_auth=awsauth,
             use_ssl=True,
             verify_certs=True,
             connection_class=RequestsHttpConnection
         )
 
-        for fd in FireDepartment.objects.all():
-
-            out = dict(id=fd.id,
-                       fd_id=fd.fdid,
-                       name=fd.name,
-                       address_line1=fd.headquarters_address.address_line1,
-                       address_line2=fd.headquarters_address.address_line2,
-                       city=fd.headquarters_address.city,
-                       state=fd.headquarters_address.state_province,
-                       postal_code=fd.headquarters_address.postal_code,
-                       country=fd.headquarters_address.country.iso_code,
-                       modifed=fd.modified.isoformat())
-            res = es.index(index='firecares', doc_type='department', id=fd.id, body=json.dumps(out))
-            print res
-            print 'Wrote {} to ES'.format(fd.name)
+    @staticmethod
+    def document(fd):
+        address = fd.headquarters_address
+
+        return dict(id=fd.id,
+                    fd_id=fd.fdid,
+                    name=fd.name,
+                    address_line1=getattr(address, 'address_line1', None),
+                    address_line2=getattr(address, 'address_line2', None),
+                    city=getattr(address, 'city', None),
+                    state=getattr(address, 'state_province', None),
+                    postal_code=getattr(address, 'postal_code', None),
+                    country=getattr(address, 'country', None) and address.country.iso_code,
+                    modifed=fd.modified.isoformat())
+
+    @staticmethod
+    def get_checkpoint(host, index):
+        """
+        Returns the time of the last successful sync to the index.
+        """
+        return SearchIndexSync.objects.filter(host=host, index=index).values_list('synced', flat=True).first()
+
+    @staticmethod
+    def set_checkpoint(host, index, modified):
+        SearchIndexSync.objects.update_or_create(host=host, index=index, defaults=dict(synced=modified))
+
+    def batches(self, departments, index, batch_size):
+        """
+        Streams bulk request bodies of batch_size departments.
+        """
+        lines = []
+
+        for fd in departments:
+            lines.append(json.dumps({'index': {'_index': index, '_type': 'department', '_id': fd.id}}))
+            lines.append(json.dumps(self.document(fd)))
+
+            if len(lines) == batch_size * 2:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def errors(res):
+        return [item['index'] for item in res.get('items', []) if item['index'].get('status', 500) >= 300]
+
+    def handle(self, *args, **options):
+        index = options.get('index', 'firecares')
+        batch_size = options.get('batch_size') or 500
+        workers = options.get('workers') or 1
+        es = self.get_client(**options)
+
+        # departments modified while this sync runs are picked up by the next one
+        started = timezone.now()
+        departments = FireDepartment.objects.select_related('headquarters_address__country').order_by('id')
+
+        if options.get('incremental'):
+            checkpoint = self.get_checkpoint(options.get('host'), index)
+
+            if checkpoint:
+                departments = departments.filter(modified__gt=checkpoint)
+
+        pool = ThreadPool(workers)
+        pending = deque()
+        indexed = 0
+        errors = []
+
+        def collect(result):
+            res = result.get()
+            errors.extend(self.errors(res))
+            return len(res.get('items', []))
+
+        try:
+            for body in self.batches(departments.iterator(), index, batch_size):
+                # keep at most two requests per worker in flight so the departments are streamed
+                if len(pending) >= workers * 2:
+                    indexed += collect(pending.popleft())
+
+                pending.append(pool.apply_async(es.bulk, kwds=dict(body=body)))
+
+            while pending:
+                indexed += collect(pending.popleft())
+        finally:
+            pool.close()
+            pool.join()
+
+        if errors:
+            raise CommandError('{0} of {1} departments failed to index, first error: {2}'.format(
+                len(errors), indexed, errors[0]))
+
+        self.set_checkpoint(options.get('host'), index, started)
+        self.stdout.write('Wrote {0} departments to ES.'.format(indexed))
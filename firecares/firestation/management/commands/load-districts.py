@@ -1,9 +1,12 @@
 import json
-from django.contrib.gis.geos import GEOSGeometry, MultiPolygon
+from contextlib import contextmanager
+from django.contrib.gis.geos import GEOSGeometry, MultiPolygon, Polygon
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from optparse import make_option
-from pymongo import MongoClient
 from firecares.firestation.models import FireStation
+from firecares.firestation.tiles import invalidate_vector_tiles, vector_tile_extents
+from firecares.utils import bulk_update
 
 
 class Command(BaseCommand):
@@ -16,47 +19,106 @@ class Command(BaseCommand):
                     help='MongoDB client.'),
         make_option('-d', '--department',
                     dest='department',
-                    help='The FireCARES department id.'),
+                    action='append',
+                    default=[],
+                    help='The FireCARES department id, may be repeated.'),
+        make_option('--all-departments',
+                    dest='all_departments',
+                    action='store_true',
+                    default=False,
+                    help='Load districts for every department with stations missing a district.'),
     )
 
+    # padding (in degrees) around a department's stations when fetching candidate districts
+    bbox_padding = 0.01
+
+    @contextmanager
+    def fire_districts(self, **options):
+        """
+        Yields the MongoDB collection of fire district features.
+        """
+        from pymongo import MongoClient
+
+        with MongoClient(options.get('client'), 27017) as client:
+            yield client.harvester['fire_districts']
+
+    def candidate_districts(self, districts, stations):
+        """
+        Fetches the districts intersecting the bounding box of the stations with one query.
+
+        Returns (extent, prepared geometry, geometry) of each district.
+        """
+        xs = [station.geom.x for station in stations]
+        ys = [station.geom.y for station in stations]
+        bbox = Polygon.from_bbox((min(xs) - self.bbox_padding, min(ys) - self.bbox_padding,
+                                  max(xs) + self.bbox_padding, max(ys) + self.bbox_padding))
+
+        candidates = []
+
+        for district in districts.find({"feature.geometry": {"$geoIntersects": {"$geometry": json.loads(bbox.json)}}},
+                                       {"feature.geometry": 1}):
+            geom = GEOSGeometry(json.dumps(district['feature']['geometry']))
+            candidates.append((geom.extent, geom.prepared, geom))
+
+        return candidates
+
+    def match_stations(self, stations, candidates):
+        """
+        Resolves each station to the district it intersects in memory, returns (station id, district) updates.
+        """
+        updates = []
+
+        for station in stations:
+            x, y = station.geom.x, station.geom.y
+            matches = [geom for (xmin, ymin, xmax, ymax), prepared, geom in candidates
+                       if xmin <= x <= xmax and ymin <= y <= ymax and prepared.intersects(station.geom)]
+
+            if len(matches) == 1:
+                self.stdout.write('Exactly one match found for station id: {0}.  Updating.'.format(station.id))
+                geom = matches[0]
+
+                if geom.geom_type == 'Polygon':
+                    geom = MultiPolygon([geom])
+                elif geom.geom_type == 'MultiPolygon':
+                    pass
+                else:
+                    raise CommandError('Unhandled geometry type: {0}'.format(geom.geom_type))
+
+                geom.srid = geom.srid or 4326
+                updates.append((station.id, str(geom.hexewkb)))
+
+            elif not matches:
+                self.stdout.write('No matches!')
+
+        return updates
+
     def handle(self, *args, **options):
 
-        department = options.get('department')
-        mongo_client = options.get('client')
-        port = 27017
-        stations = FireStation.objects.filter(department=department,
-                                              district__isnull=True,
-                                              geom__isnull=False)
+        departments = options.get('department') or []
 
-        if not department:
+        if not departments and not options.get('all_departments'):
             raise CommandError('A department id must be provided.')
 
-        with MongoClient(mongo_client, port) as client:
-            db = client.harvester
-            districts = db['fire_districts']
-
-            for station in stations:
-                matches = districts.find({
-                    "feature.geometry": {
-                        "$geoIntersects": {
-                            "$geometry": json.loads(station.geom.json)
-                        }
-                    },
-                })
-                if matches.count() == 1:
-                    self.stdout.write('Exactly one match found for station id: {0}.  Updating.'.format(station.id))
-                    match = matches.next()
-                    geom = GEOSGeometry(json.dumps(match['feature']['geometry']))
-
-                    if geom.geom_type == 'Polygon':
-                        geom = MultiPolygon([geom])
-                    elif geom.geom_type == 'MultiPolygon':
-                        pass
-                    else:
-                        raise CommandError('Unhandled geometry type: {0}'.format(geom.geom_type))
-
-                    station.district = geom
-                    station.save()
-
-                elif matches.count() == 0:
-                    self.stdout.write('No matches!')
+        stations = FireStation.objects.filter(district__isnull=True, geom__isnull=False, department__isnull=False)
+
+        if departments:
+            stations = stations.filter(department__in=departments)
+
+        stations_by_department = {}
+
+        for station in stations.only('id', 'geom', 'department').order_by('id'):
+            stations_by_department.setdefault(station.department_id, []).append(station)
+
+        with self.fire_districts(**options) as districts:
+            for department, department_stations in sorted(stations_by_department.items()):
+                candidates = self.candidate_districts(districts, department_stations)
+                updates = self.match_stations(department_stations, candidates)
+
+                with transaction.atomic():
+                    updated = bulk_update(FireStation, updates, ['district'])
+
+                # bulk updates do not send the signals which mark cached tiles stale, the stations had no district before
+                invalidate_vector_tiles(vector_tile_extents(FireStation, [row[0] for row in updates]))
+
+                self.stdout.write('Updated {0}/{1} stations of department {2}.'.format(
+                    updated, len(department_stations), department))
@@ -1,9 +1,46 @@
 from django.contrib.gis.gdal import DataSource
 from django.contrib.gis.geos import MultiPolygon, Polygon
-from firecares.firestation.models import FireStation
+from django.db import connections, transaction
+from firecares.firestation.models import FireStation, USGSStructureData
+from firecares.firestation.tiles import invalidate_vector_tiles, vector_tile_extents
+from firecares.utils import bulk_update
 
 from django.core.management.base import BaseCommand
 
+MATCH_DISTRICTS_QUERY = """
+WITH districts AS (
+    SELECT n, ST_Multi(ST_SetSRID(hex::geometry, 4326)) AS geom
+    FROM unnest(%s::text[]) WITH ORDINALITY AS district(hex, n)
+)
+SELECT DISTINCT ON (districts.n) districts.n, station.{pk}, station.district IS NOT NULL
+FROM districts
+JOIN {structures} structure ON ST_Intersects(districts.geom, structure.geom)
+JOIN {stations} station ON station.{pk} = structure.id
+WHERE station.{pk} IN ({candidates})
+ORDER BY districts.n, ST_Distance(ST_Transform(ST_Centroid(districts.geom), 3857), ST_Transform(structure.geom, 3857))
+"""
+
+
+def match_districts(geoms, queryset):
+    """
+    Matches each district to the nearest (by centroid) station of the queryset within it.
+
+    Every district is resolved with one probe of the station geometry index in a single query.  Returns
+    (district number, station id, station already has a district) for the matched districts, in district order.
+    """
+    if not geoms:
+        return []
+
+    candidates, params = queryset.order_by().values('pk').query.sql_with_params()
+    query = MATCH_DISTRICTS_QUERY.format(pk=FireStation._meta.pk.column,
+                                         structures=USGSStructureData._meta.db_table,
+                                         stations=FireStation._meta.db_table,
+                                         candidates=candidates)
+
+    cursor = connections['default'].cursor()
+    cursor.execute(query, [[str(geom.hexewkb) for geom in geoms]] + list(params))
+    return [(n - 1, station_id, has_district) for n, station_id, has_district in cursor.fetchall()]
+
 
 class Command(BaseCommand):
     help = 'Matches district geometry within GeoJSON files with appropriate fire station.'
@@ -22,46 +59,41 @@ class Command(BaseCommand):
         print 'Extracted State code: {0}'.format(state_filter.upper())
         filter_stations = options.get('queryset', FireStation.objects.filter(state=state_filter.upper()))
         print filter_stations.count()
+        num_updated = num_geoms = 0
+
         for layer in ds:
-            geom_list = layer.get_geoms(geos=True)
-            num_geoms = len(geom_list)
-            num_updated = 0
+            geom_list = []
+            updates = []
+            matched = set()
 
+            for geom in layer.get_geoms(geos=True):
+                if isinstance(geom, Polygon):
+                    geom = MultiPolygon(geom, srid=geom.srid)
+
+                if isinstance(geom, MultiPolygon):
+                    geom.srid = geom.srid or 4326
+                    geom_list.append(geom)
+
+            num_geoms = len(geom_list)
             print 'Number of Districts: {0}'.format(num_geoms)
 
-            for geom in geom_list:
-                match_stations = list()
-
-                for station in filter_stations:
-                    if geom.intersects(station.geom) is True:
-                        match_stations.append(station)
-
-                matched_station = None
-                num_match_stations = len(match_stations)
-                if num_match_stations == 1:
-                    matched_station = match_stations[0]
-                elif num_match_stations > 1:
-                    geom.set_srid(4326)
-                    meter_geom = geom.centroid.transform(3857, clone=True)
-                    shortest_dist = meter_geom.distance(match_stations[0].geom.centroid.transform(3857, clone=True))
-                    matched_station = match_stations[0]
-                    for station in match_stations:
-                        station_dist = meter_geom.distance(station.geom.centroid.transform(3857, clone=True))
-                        if station_dist < shortest_dist:
-                            shortest_dist = station_dist
-                            matched_station = station
-
-                if matched_station is not None and matched_station.district is None:
-                    if verbose:
-                        print 'Updated district for {0}'.format(matched_station.name)
-                    if isinstance(geom, MultiPolygon):
-                        matched_station.district = geom
-                    elif isinstance(geom, Polygon):
-                        matched_station.district = MultiPolygon(geom)
-                    matched_station.save()
-                    num_updated += 1
-                elif matched_station is not None and matched_station.district is not None:
+            for n, station_id, has_district in match_districts(geom_list, filter_stations):
+                # the first district matched to a station wins, like saving stations one by one did
+                if has_district or station_id in matched:
                     if verbose:
                         print 'District already set: No Update'
+                    continue
+
+                if verbose:
+                    print 'Updated district for station {0}'.format(station_id)
+
+                matched.add(station_id)
+                updates.append((station_id, str(geom_list[n].hexewkb)))
+
+            with transaction.atomic():
+                num_updated = bulk_update(FireStation, updates, ['district'])
+
+            # bulk updates do not send the signals which mark cached tiles stale, the stations had no district before
+            invalidate_vector_tiles(vector_tile_extents(FireStation, matched))
 
         print 'Successfully Updated {0}/{1} Stations'.format(num_updated, num_geoms)
@@ -0,0 +1,18 @@
+from firecares.tasks.update import refresh_nfirs_summary
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Summarizes newly loaded NFIRS years into the per department summary table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', dest='years', type=int, action='append', default=[],
+                            help='Year to (re)summarize, may be repeated.  Defaults to years not yet summarized.')
+        parser.add_argument('--all', dest='all_years', action='store_true', default=False,
+                            help='Summarize every loaded year again.')
+
+    def handle(self, *args, **options):
+        years = refresh_nfirs_summary(years=options.get('years'), all_years=options.get('all_years'))
+
+        if not years:
+            self.stdout.write('No NFIRS years to summarize.')
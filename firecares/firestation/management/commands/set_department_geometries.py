@@ -0,0 +1,14 @@
+from firecares.firestation.models import set_geometries_from_government_units
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds department boundaries from their government units (ie: after a USGS reload) in one statement'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--department', dest='departments', type=int, action='append', default=[],
+                            help='Department id to rebuild, may be repeated.  Defaults to every department.')
+
+    def handle(self, *args, **options):
+        updated = set_geometries_from_government_units(department_ids=options.get('departments') or None)
+        self.stdout.write('Updated the geometry of {0} departments.'.format(updated))
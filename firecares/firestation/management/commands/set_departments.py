@@ -1,5 +1,9 @@
-from firecares.firestation.models import FireStation
-from django.db import transaction
+import csv
+from firecares.firestation.models import FireStation, suggest_departments
+from firecares.firestation.tiles import invalidate_vector_tiles, vector_tile_extents
+from firecares.utils import bulk_update
+from multiprocessing.pool import ThreadPool
+from django.db import connection, transaction
 from django.core.management.base import BaseCommand
 
 
@@ -15,10 +19,47 @@ def batch_qs(qs, batch_size=1000):
         yield (start, end, total, qs[start:end])
 
 
+def assign_stations(station_ids, min_score, min_margin):
+    """
+    Suggests departments for a batch of stations, returns the (station, best, runner up, reason) of each station.
+
+    The reason is None when the best suggestion is confident enough to assign.
+    """
+    stations = list(FireStation.objects.filter(id__in=station_ids).order_by('id'))
+    suggestions = suggest_departments(stations, limit=2)
+    results = []
+
+    for station in stations:
+        best, runner_up = (suggestions[station.id] + [None, None])[:2]
+        reason = None
+
+        if best is None:
+            reason = 'no suggestions'
+        elif best.department_score < min_score:
+            reason = 'low score'
+        elif runner_up and best.department_score - runner_up.department_score < min_margin:
+            reason = 'low margin'
+
+        results.append((station, best, runner_up, reason))
+
+    return results
+
+
+def assign_stations_worker(args):
+    try:
+        return assign_stations(*args)
+    finally:
+        # workers are threads, each one opens its own database connection
+        connection.close()
+
+
 class Command(BaseCommand):
     help = 'Sets departments for unmatched Fire Stations'
     queryset = None
 
+    review_header = ['station_id', 'station_name', 'state', 'reason', 'department_id', 'department_name', 'score',
+                     'runner_up_id', 'runner_up_name', 'runner_up_score']
+
     def add_arguments(self, parser):
         parser.add_argument('--state', '-s',
                             dest='state',
@@ -37,46 +78,138 @@ class Command(BaseCommand):
                             help='Total number of records',
                             type=int)
 
+        parser.add_argument('--auto',
+                            dest='auto',
+                            action='store_true',
+                            default=False,
+                            help='Assign confident suggestions without prompting, write the rest to the review CSV.')
+
+        parser.add_argument('--min-score',
+                            dest='min_score',
+                            default=110,
+                            help='Lowest suggestion score assigned in auto mode (the maximum score is 165).',
+                            type=float)
+
+        parser.add_argument('--min-margin',
+                            dest='min_margin',
+                            default=10,
+                            help='Lowest score margin of the suggestion over the runner up assigned in auto mode.',
+                            type=float)
+
+        parser.add_argument('--workers', '-w',
+                            dest='workers',
+                            default=4,
+                            help='Number of batches matched in parallel in auto mode.',
+                            type=int)
+
+        parser.add_argument('--review-csv',
+                            dest='review_csv',
+                            default='set_departments_review.csv',
+                            help='Path of the CSV stations which were not assigned in auto mode are written to.')
+
     def handle(self, *args, **options):
         params = {'department__isnull': True}
 
         if options.get('state'):
             params['state'] = options.get('state')
 
-        queryset = FireStation.objects.filter(**params)
+        queryset = FireStation.objects.filter(**params).order_by('id')
 
         if options.get('limit'):
             queryset = queryset[:options.get('limit')]
 
+        if options.get('auto'):
+            return self.auto_assign(queryset, **options)
+
         batches = batch_qs(queryset, options.get('batch'))
 
         for start, end, total, qs in batches:
-            with transaction.atomic():
-                to_commit = []
+            to_commit = []
+            stations = list(qs)
+            suggestions = suggest_departments(stations, limit=1)
 
-                for station in qs:
+            for station in stations:
 
-                    if not station.suggested_departments():
-                        continue
+                if not suggestions[station.id]:
+                    continue
 
-                    print "Station:    {0}".format(station.name)
-                    print "Department: {0}".format(station.suggested_departments()[0].name)
-                    print "Dept Id   : {0}".format(station.suggested_departments()[0].id)
-                    print
+                department = suggestions[station.id][0]
 
-                    to_commit.append((station.id, station.suggested_departments()[0]))
+                print "Station:    {0}".format(station.name)
+                print "Department: {0}".format(department.name)
+                print "Dept Id   : {0}".format(department.id)
+                print
 
-                resp = raw_input('Look Ok? (y/n/q) ')
+                to_commit.append((station.id, department.id))
 
-                if resp == 'y':
-                    for id, dept in to_commit:
-                        FireStation.objects.filter(id=id).update(department=dept)
+            resp = raw_input('Look Ok? (y/n/q) ')
 
-                    print 'Committed'
-                    print
+            if resp == 'y':
+                with transaction.atomic():
+                    bulk_update(FireStation, to_commit, ['department'])
 
-                if resp == 'n':
-                    continue
+                invalidate_vector_tiles(vector_tile_extents(FireStation, [row[0] for row in to_commit]))
+
+                print 'Committed'
+                print
+
+            if resp == 'n':
+                continue
+
+            if resp == 'q':
+                break
+
+    def auto_assign(self, queryset, **options):
+        """
+        Matches batches of stations in parallel, bulk assigns the confident matches and writes the others to a CSV.
+        """
+        station_ids = list(queryset.values_list('id', flat=True))
+        # batches of at least 100 stations, each one is matched with a single query
+        batch_size = max(options.get('batch'), 100)
+        batches = [station_ids[start:start + batch_size] for start in range(0, len(station_ids), batch_size)]
+
+        workers = options.get('workers') or 1
+        pool = ThreadPool(workers) if workers > 1 else None
+        jobs = [(ids, options.get('min_score'), options.get('min_margin')) for ids in batches]
+        assigned = reviewed = 0
+
+        with open(options.get('review_csv'), 'wb') as review_file:
+            review = csv.writer(review_file)
+            review.writerow(self.review_header)
+
+            try:
+                if pool:
+                    matched = pool.imap_unordered(assign_stations_worker, jobs)
+                else:
+                    matched = (assign_stations(*job) for job in jobs)
+
+                for results in matched:
+                    assignments = []
+
+                    for station, best, runner_up, reason in results:
+                        if reason is None:
+                            assignments.append((station.id, best.id))
+                            continue
+
+                        columns = [station.id, (station.name or '').encode('utf-8'), station.state, reason]
+                        review.writerow(columns + self.review_columns(best) + self.review_columns(runner_up))
+
+                    # only the assignments are written, each batch in its own short transaction
+                    with transaction.atomic():
+                        assigned += bulk_update(FireStation, assignments, ['department'])
+
+                    invalidate_vector_tiles(vector_tile_extents(FireStation, [row[0] for row in assignments]))
+
+                    reviewed += len(results) - len(assignments)
+                    self.stdout.write('Assigned {0} stations, {1} left for review.'.format(assigned, reviewed))
+            finally:
+                if pool:
+                    pool.close()
+                    pool.join()
+
+    @staticmethod
+    def review_columns(department):
+        if department is None:
+            return ['', '', '']
 
-                if resp == 'q':
-                    break
+        return [department.id, department.name.encode('utf-8'), round(department.department_score, 2)]
@@ -1,4 +1,4 @@
-from firecares.tasks.update import update_nfirs_counts
+from firecares.tasks.update import update_nfirs_counts, update_nfirs_counts_batch
 from django.core.management.base import BaseCommand
 
 
@@ -7,7 +7,17 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('firedepartment_id', nargs='+', type=int)
+        parser.add_argument('--batch-size', dest='batch_size', type=int, default=0,
+                            help='If specified departments are updated in batches of this size.')
 
     def handle(self, *args, **options):
-        for department in options.get('firedepartment_id'):
+        departments = options.get('firedepartment_id')
+        batch_size = options.get('batch_size')
+
+        if batch_size:
+            for start in range(0, len(departments), batch_size):
+                update_nfirs_counts_batch.delay(departments[start:start + batch_size])
+            return
+
+        for department in departments:
             update_nfirs_counts.delay(department)
@@ -1,11 +1,13 @@
 import re
 import string
 from django.contrib.gis.db import models
+from django.db import connections
 from django.db.models import Func, Case, When, Q, Min, Max, Avg
 from django.db.models.expressions import RawSQL
 from django.db.models import Aggregate
 from django.db.models import FloatField
 from django.contrib.gis.db.models.query import GeoQuerySet
+from django.utils.lru_cache import lru_cache
 
 
 class PriorityDepartmentsManager(models.Manager):
@@ -43,6 +45,9 @@ class FilteredAvg(Aggregate):
 
 class CalculationsQuerySet(GeoQuerySet):
 
+    # width of the DIST score buckets departments are counted in by facet_counts
+    dist_model_score_facet_bucket = 50
+
     def as_quartiles(self):
         qs = self
 
@@ -63,10 +68,49 @@ class CalculationsQuerySet(GeoQuerySet):
 
         return qs
 
+    def facet_counts(self, dist_model_score_bucket=None):
+        """
+        Counts the departments per state, region, population class and DIST score bucket with a single grouped query.
+
+        Returns a dict of facet to a list of (value, count) tuples, DIST score buckets are keyed by their lower bound.
+        """
+        facets = ['state', 'region', 'population_class', 'dist_model_score']
+        dist_model_score_bucket = dist_model_score_bucket or self.dist_model_score_facet_bucket
+        sql, params = self.order_by().values('state', 'region', 'population_class', 'dist_model_score')\
+            .query.sql_with_params()
+
+        # GROUPING() sets a bit for every facet that is not part of the row's grouping set
+        groupings = dict((sum(1 << (len(facets) - 1 - other) for other in range(len(facets)) if other != index), facet)
+                         for index, facet in enumerate(facets))
+
+        cursor = connections[self.db].cursor()
+        cursor.execute("""
+            SELECT GROUPING({facets}), {facets}, COUNT(*)
+            FROM (
+                SELECT state, region, population_class, FLOOR(dist_model_score / {bucket}) * {bucket} AS dist_model_score
+                FROM ({sql}) filtered) departments
+            GROUP BY GROUPING SETS ({grouping_sets});
+            """.format(facets=', '.join(facets), bucket=int(dist_model_score_bucket), sql=sql,
+                       grouping_sets=', '.join('({0})'.format(facet) for facet in facets)), params)
+
+        counts = dict((facet, []) for facet in facets)
+
+        for row in cursor.fetchall():
+            facet = groupings[row[0]]
+            value = row[1 + facets.index(facet)]
+            counts[facet].append((int(value) if facet == 'dist_model_score' and value is not None else value, row[-1]))
+
+        for facet in facets:
+            # unknown values last
+            counts[facet].sort(key=lambda count: (count[0] is None, count[0]))
+
+        return counts
+
     @staticmethod
+    @lru_cache(maxsize=1024)
     def _sanitize_full_text_search(term):
         """
-        Sanitizes terms before sending to PostGRES FTS.
+        Sanitizes terms before sending to PostGRES FTS, compiled terms are memoized.
         """
         allowed_punctuation = set(['&', '|', '"', "'"])
         all_punctuation = set(string.punctuation)
@@ -120,6 +164,31 @@ class CalculationsQuerySet(GeoQuerySet):
         return self.extra(where=["firestation_firedepartment.fts_document @@ to_tsquery('simple', %s)"],
                           params=[self._sanitize_full_text_search(search_term)])
 
+    def ranked_full_text_search(self, search_term, limit=None):
+        """
+        Filters results based on PostGRES Full Text Search, best matches (by ts_rank) first.
+        """
+        term = self._sanitize_full_text_search(search_term)
+        queryset = self.full_text_search(search_term)\
+            .extra(select={'fts_rank': "ts_rank(firestation_firedepartment.fts_document, to_tsquery('simple', %s))"},
+                   select_params=[term])\
+            .order_by('-fts_rank', 'id')
+
+        return queryset[:limit] if limit else queryset
+
+    def name_search(self, search_term, limit=None):
+        """
+        Filters results on names containing the search term, names starting with the term first.
+
+        The name lookup is backed by a trigram index on UPPER(name).
+        """
+        queryset = self.filter(name__icontains=search_term)\
+            .extra(select={'name_prefix': 'UPPER(firestation_firedepartment.name::text) LIKE UPPER(%s)'},
+                   select_params=[search_term.replace('%', r'\%').replace('_', r'\_') + '%'])\
+            .order_by('-name_prefix', 'name', 'id')
+
+        return queryset[:limit] if limit else queryset
+
 
 class CalculationManager(models.GeoManager):
     """
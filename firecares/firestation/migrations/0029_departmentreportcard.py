@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.contrib.postgres.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firestation', '0028_merge'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DepartmentReportCard',
+            fields=[
+                ('id', models.OneToOneField(related_name='report_card', primary_key=True, db_column=b'id', serialize=False, to='firestation.FireDepartment')),
+                ('population_class', models.IntegerField(null=True, editable=False, blank=True)),
+                ('dist_model_score', models.FloatField(null=True, editable=False, blank=True)),
+                ('dist_model_residential_fires_quartile', models.IntegerField(null=True, editable=False, blank=True)),
+                ('dist_model_residential_fires_quartile_avg', models.FloatField(null=True, editable=False, blank=True)),
+                ('dist_model_residential_fires_quartile_breaks', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), size=None, null=True, editable=False, blank=True)),
+                ('dist_model_risk_model_greater_than_size_2_quartile', models.IntegerField(null=True, editable=False, blank=True)),
+                ('dist_model_risk_model_greater_than_size_2_quartile_avg', models.FloatField(null=True, editable=False, blank=True)),
+                ('dist_model_risk_model_greater_than_size_2_quartile_breaks', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), size=None, null=True, editable=False, blank=True)),
+                ('dist_model_risk_model_deaths_injuries_quartile', models.IntegerField(null=True, editable=False, blank=True)),
+                ('dist_model_risk_model_deaths_injuries_quartile_avg', models.FloatField(null=True, editable=False, blank=True)),
+                ('dist_model_risk_model_deaths_injuries_quartile_breaks', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), size=None, null=True, editable=False, blank=True)),
+            ],
+            options={
+                'db_table': 'department_report_cards',
+                'managed': False,
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firestation', '0029_departmentreportcard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NationalQuartile',
+            fields=[
+                ('id', models.OneToOneField(related_name='national_quartile', primary_key=True, db_column=b'id', serialize=False, to='firestation.FireDepartment')),
+                ('dist_model_score', models.FloatField(null=True, editable=False, blank=True)),
+                ('risk_model_size1_percent_size2_percent_sum_quartile', models.IntegerField(null=True, editable=False, blank=True)),
+                ('risk_model_deaths_injuries_sum_quartile', models.IntegerField(null=True, editable=False, blank=True)),
+                ('national_risk_model_size1_percent_size2_percent_sum_quartile', models.IntegerField(null=True, editable=False, blank=True)),
+                ('national_risk_model_deaths_injuries_sum_quartile', models.IntegerField(null=True, editable=False, blank=True)),
+            ],
+            options={
+                'db_table': 'national_quartiles',
+                'managed': False,
+            },
+        ),
+    ]
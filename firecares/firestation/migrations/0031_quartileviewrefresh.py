@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firestation', '0030_nationalquartile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuartileViewRefresh',
+            fields=[
+                ('population_class', models.IntegerField(serialize=False, primary_key=True, choices=[(0, b'Population less than 2,500.'), (1, b'Population between 2,500 and 4,999.'), (2, b'Population between 5,000 and 9,999.'), (3, b'Population between 10,000 and 24,999.'), (4, b'Population between 25,000 and 49,999.'), (5, b'Population between 50,000 and 99,999.'), (6, b'Population between 100,000 and 249,999.'), (7, b'Population between 250,000 and 499,999.'), (8, b'Population between 500,000 and 999,999.'), (9, b'Population greater than 1,000,000.')])),
+                ('refreshed', models.DateTimeField(null=True, blank=True)),
+                ('generation', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firestation', '0031_quartileviewrefresh'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='firedepartment',
+            name='dist_model_inputs_hash',
+            field=models.CharField(max_length=40, null=True, editable=False, blank=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.contrib.postgres.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firestation', '0032_firedepartment_dist_model_inputs_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PopulationClassBreaks',
+            fields=[
+                ('population_class', models.IntegerField(primary_key=True, db_column=b'id', serialize=False, editable=False, choices=[(0, b'Population less than 2,500.'), (1, b'Population between 2,500 and 4,999.'), (2, b'Population between 5,000 and 9,999.'), (3, b'Population between 10,000 and 24,999.'), (4, b'Population between 25,000 and 49,999.'), (5, b'Population between 50,000 and 99,999.'), (6, b'Population between 100,000 and 249,999.'), (7, b'Population between 250,000 and 499,999.'), (8, b'Population between 500,000 and 999,999.'), (9, b'Population greater than 1,000,000.')])),
+                ('residential_fires_avg_3_years_breaks', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), size=None, null=True, editable=False, blank=True)),
+                ('risk_model_size1_percent_size2_percent_sum_breaks', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), size=None, null=True, editable=False, blank=True)),
+                ('risk_model_deaths_injuries_sum_breaks', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), size=None, null=True, editable=False, blank=True)),
+            ],
+            options={
+                'db_table': 'population_class_breaks',
+                'managed': False,
+            },
+        ),
+    ]
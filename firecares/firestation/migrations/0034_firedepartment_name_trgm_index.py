@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firestation', '0033_populationclassbreaks'),
+    ]
+
+    operations = [
+        migrations.RunSQL("CREATE EXTENSION IF NOT EXISTS pg_trgm;"),
+        migrations.RunSQL("CREATE INDEX firestation_firedepartment_name_trgm_index ON firestation_firedepartment "
+                          "USING gin (UPPER(name::text) gin_trgm_ops);",
+                          reverse_sql="DROP INDEX IF EXISTS firestation_firedepartment_name_trgm_index;"),
+    ]
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firestation', '0035_fuzzystrmatch'),
+    ]
+
+    sql = """
+CREATE OR REPLACE FUNCTION firecares_area_sq_mi(geom geometry) RETURNS double precision AS $$
+BEGIN
+    -- square miles in US National Atlas Equal Area
+    RETURN ST_Area(ST_Transform(geom, 2163)) / 1000000 * 0.386102;
+EXCEPTION WHEN OTHERS THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION department_geom_area_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.geom_area=firecares_area_sq_mi(NEW.geom);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION station_district_area_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.district_area=firecares_area_sq_mi(NEW.district);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+    reverse_sql = """
+DROP FUNCTION IF EXISTS station_district_area_trigger();
+DROP FUNCTION IF EXISTS department_geom_area_trigger();
+DROP FUNCTION IF EXISTS firecares_area_sq_mi(geometry);
+"""
+
+    operations = [
+        migrations.AddField(
+            model_name='firedepartment',
+            name='geom_area',
+            field=models.FloatField(db_index=True, null=True, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='firestation',
+            name='district_area',
+            field=models.FloatField(db_index=True, null=True, editable=False, blank=True),
+        ),
+        migrations.RunSQL(sql, reverse_sql=reverse_sql),
+        migrations.RunSQL("UPDATE firestation_firedepartment SET geom_area=firecares_area_sq_mi(geom) WHERE geom IS NOT NULL",
+                          reverse_sql=migrations.RunSQL.noop),
+        migrations.RunSQL("UPDATE firestation_firestation SET district_area=firecares_area_sq_mi(district) WHERE district IS NOT NULL",
+                          reverse_sql=migrations.RunSQL.noop),
+        migrations.RunSQL("CREATE TRIGGER department_geom_area_trigger BEFORE INSERT OR UPDATE OF geom ON firestation_firedepartment FOR EACH ROW EXECUTE PROCEDURE department_geom_area_trigger()",
+                          reverse_sql="DROP TRIGGER IF EXISTS department_geom_area_trigger ON firestation_firedepartment"),
+        migrations.RunSQL("CREATE TRIGGER station_district_area_trigger BEFORE INSERT OR UPDATE OF district ON firestation_firestation FOR EACH ROW EXECUTE PROCEDURE station_district_area_trigger()",
+                          reverse_sql="DROP TRIGGER IF EXISTS station_district_area_trigger ON firestation_firestation"),
+    ]
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.contrib.gis.db.models.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firestation', '0036_geom_area'),
+    ]
+
+    sql = """
+CREATE OR REPLACE FUNCTION firecares_simplify_geometry(source_name varchar, source_id integer, source_geom geometry) RETURNS void AS $$
+BEGIN
+    DELETE FROM firestation_simplifiedgeometry WHERE source=source_name AND object_id=source_id;
+
+    -- coordinates are quantized to a tenth of the tolerance, levels which simplify away are skipped
+    INSERT INTO firestation_simplifiedgeometry (source, object_id, max_zoom, tolerance, geom)
+    SELECT source_name, source_id, level.max_zoom, level.tolerance, simplified.geom
+    FROM (VALUES (8, 0.01), (11, 0.001), (14, 0.0001)) AS level(max_zoom, tolerance),
+    LATERAL (
+        SELECT ST_Multi(ST_CollectionExtract(ST_MakeValid(
+            ST_SnapToGrid(ST_SimplifyPreserveTopology(source_geom, level.tolerance), level.tolerance / 10)), 3)) AS geom
+    ) simplified
+    WHERE source_geom IS NOT NULL AND NOT ST_IsEmpty(simplified.geom);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION department_simplified_geometry_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM firecares_simplify_geometry('department', OLD.id, NULL);
+    ELSE
+        PERFORM firecares_simplify_geometry('department', NEW.id, NEW.geom);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION station_simplified_geometry_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM firecares_simplify_geometry('district', OLD.usgsstructuredata_ptr_id, NULL);
+    ELSE
+        PERFORM firecares_simplify_geometry('district', NEW.usgsstructuredata_ptr_id, NEW.district);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+    reverse_sql = """
+DROP FUNCTION IF EXISTS station_simplified_geometry_trigger();
+DROP FUNCTION IF EXISTS department_simplified_geometry_trigger();
+DROP FUNCTION IF EXISTS firecares_simplify_geometry(varchar, integer, geometry);
+"""
+
+    # saving a model writes every column, geometries are only simplified again when they change
+    triggers = """
+CREATE TRIGGER department_simplified_geometry_trigger AFTER INSERT OR DELETE ON firestation_firedepartment
+    FOR EACH ROW EXECUTE PROCEDURE department_simplified_geometry_trigger();
+CREATE TRIGGER department_simplified_geometry_update_trigger AFTER UPDATE OF geom ON firestation_firedepartment
+    FOR EACH ROW WHEN (ST_AsEWKB(OLD.geom) IS DISTINCT FROM ST_AsEWKB(NEW.geom))
+    EXECUTE PROCEDURE department_simplified_geometry_trigger();
+CREATE TRIGGER station_simplified_geometry_trigger AFTER INSERT OR DELETE ON firestation_firestation
+    FOR EACH ROW EXECUTE PROCEDURE station_simplified_geometry_trigger();
+CREATE TRIGGER station_simplified_geometry_update_trigger AFTER UPDATE OF district ON firestation_firestation
+    FOR EACH ROW WHEN (ST_AsEWKB(OLD.district) IS DISTINCT FROM ST_AsEWKB(NEW.district))
+    EXECUTE PROCEDURE station_simplified_geometry_trigger();
+"""
+
+    reverse_triggers = """
+DROP TRIGGER IF EXISTS station_simplified_geometry_update_trigger ON firestation_firestation;
+DROP TRIGGER IF EXISTS station_simplified_geometry_trigger ON firestation_firestation;
+DROP TRIGGER IF EXISTS department_simplified_geometry_update_trigger ON firestation_firedepartment;
+DROP TRIGGER IF EXISTS department_simplified_geometry_trigger ON firestation_firedepartment;
+"""
+
+    operations = [
+        migrations.CreateModel(
+            name='SimplifiedGeometry',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('source', models.CharField(max_length=10, choices=[('department', 'Department boundary'), ('district', 'Station district')])),
+                ('object_id', models.IntegerField()),
+                ('max_zoom', models.PositiveSmallIntegerField(help_text='The highest map zoom level the geometry is rendered at.')),
+                ('tolerance', models.FloatField(help_text='The simplification tolerance (in degrees).')),
+                ('geom', django.contrib.gis.db.models.fields.MultiPolygonField(srid=4326)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='simplifiedgeometry',
+            unique_together=set([('source', 'object_id', 'max_zoom')]),
+        ),
+        migrations.RunSQL(sql, reverse_sql=reverse_sql),
+        migrations.RunSQL("SELECT firecares_simplify_geometry('department', id, geom) FROM firestation_firedepartment WHERE geom IS NOT NULL",
+                          reverse_sql=migrations.RunSQL.noop),
+        migrations.RunSQL("SELECT firecares_simplify_geometry('district', usgsstructuredata_ptr_id, district) FROM firestation_firestation WHERE district IS NOT NULL",
+                          reverse_sql=migrations.RunSQL.noop),
+        migrations.RunSQL(triggers, reverse_sql=reverse_triggers),
+    ]
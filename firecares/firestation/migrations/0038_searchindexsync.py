@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firestation', '0037_simplifiedgeometry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchIndexSync',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('host', models.CharField(max_length=255)),
+                ('index', models.CharField(max_length=255)),
+                ('synced', models.DateTimeField(help_text='When the last successful sync started.')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchindexsync',
+            unique_together=set([('host', 'index')]),
+        ),
+    ]
@@ -1,34 +1,43 @@
+import copy
 import datetime
+import hashlib
 import json
+import math
 import requests
 import sys
 import csv
 import os
 import re
-from .managers import PriorityDepartmentsManager, CalculationManager
+from collections import defaultdict
+from .managers import PriorityDepartmentsManager, CalculationManager, CalculationsQuerySet
+from .peers import (department_features_index, invalidate_department_features, invalidate_similar_departments,
+                    peer_statistics, peer_statistics_version, population_class_for, population_class_range,
+                    similar_departments_index)
+from .tiles import invalidate_vector_tiles
 from django.conf import settings
 from django.contrib.gis.db import models
+from django.contrib.postgres.fields import ArrayField
 from django.contrib.gis.geos import Point, MultiPolygon
-from django.contrib.gis.measure import D
 from django.core.validators import MaxValueValidator
 from django.core.cache import cache
 from django.db import connections
-from django.db.models import Avg, Max, Min, Q
+from django.db.models import Avg, F, Max, Q
 from django.db.models.loading import get_model
-from django.db.models.signals import post_migrate, post_save
+from django.db.models.signals import post_delete, post_init, post_migrate, post_save
+from django.utils import timezone
 from django.utils.text import slugify
 from firecares.firecares_core.models import RecentlyUpdatedMixin, Archivable
 from django.core.urlresolvers import reverse
 from django.db.transaction import rollback
-from django.db.utils import IntegrityError, ProgrammingError
+from django.db.utils import IntegrityError
 from django.utils.functional import cached_property
 from django.utils.deconstruct import deconstructible
+from django.utils.encoding import force_bytes
 from firecares.firecares_core.models import Address
 from firecares.firecares_core.validators import validate_choice
-from numpy import histogram
 from phonenumber_field.modelfields import PhoneNumberField
 from firecares.firecares_core.models import Country
-from genericm2m.models import RelatedObjectsDescriptor
+from genericm2m.models import RelatedObject, RelatedObjectsDescriptor
 from reversion import revisions as reversion
 from storages.backends.s3boto import S3BotoStorage
 
@@ -264,9 +273,14 @@ class FireDepartment(RecentlyUpdatedMixin, Archivable, models.Model):
     state = models.CharField(max_length=2)
     region = models.CharField(max_length=20, choices=REGION_CHOICES, null=True, blank=True)
     geom = models.MultiPolygonField(null=True, blank=True)
+    # square miles of geom in US National Atlas Equal Area, maintained by a database trigger
+    geom_area = models.FloatField(null=True, blank=True, editable=False, db_index=True)
     objects = CalculationManager()
+    # geometries drawn in the vector tiles
+    vector_tile_fields = ['geom']
     priority_departments = PriorityDepartmentsManager()
     dist_model_score = models.FloatField(null=True, blank=True, editable=False, db_index=True)
+    dist_model_inputs_hash = models.CharField(max_length=40, null=True, blank=True, editable=False)
 
     risk_model_deaths = models.FloatField(null=True, blank=True, db_index=True,
                                           verbose_name='Predicted deaths per year.')
@@ -362,23 +376,13 @@ class FireDepartment(RecentlyUpdatedMixin, Archivable, models.Model):
         if not self.population_class or self.archived:
             return []
 
-        cache_key = 'population_class_{0}_stats'.format(self.population_class)
-        cached = cache.get(cache_key)
+        peers = peer_statistics()
+        results = {}
 
-        if cached:
-            return cached
+        for field in ['dist_model_score', 'risk_model_fires', 'risk_model_deaths_injuries_sum',
+                      'risk_model_size1_percent_size2_percent_sum', 'residential_fires_avg_3_years']:
+            results.update(peers.stats(field, population_class=self.population_class))
 
-        fields = ['dist_model_score', 'risk_model_fires', 'risk_model_deaths_injuries_sum',
-                  'risk_model_size1_percent_size2_percent_sum', 'residential_fires_avg_3_years']
-        aggs = []
-
-        for field in fields:
-            aggs.append(Min(field))
-            aggs.append(Max(field))
-            aggs.append(Avg(field))
-
-        results = self.population_metrics_table.objects.filter(population_class=self.population_class).aggregate(*aggs)
-        cache.set(cache_key, results, timeout=60 * 60 * 24)
         return results
 
     def report_card_scores(self):
@@ -441,17 +445,17 @@ class FireDepartment(RecentlyUpdatedMixin, Archivable, models.Model):
 
         return []
 
-    @property
-    def geom_area(self):
+    @cached_property
+    def page_cache_version(self):
         """
-        Project the department's geometry into US National Atlas Equal Area
-        Returns mi2
+        Returns the version of the cached department page, it changes whenever the department, its NFIRS statistics or
+        the quartile views change.
         """
-        if self.geom:
-            try:
-                return (self.geom.transform(2163, clone=True).area / 1000000) * 0.386102
-            except:
-                return
+        nfirs_modified = self.nfirsstatistic_set.aggregate(Max('modified'))['modified__max']
+        version = '{0}-{1}-{2}'.format(self.modified.isoformat() if self.modified else None,
+                                       nfirs_modified.isoformat() if nfirs_modified else None,
+                                       peer_statistics_version())
+        return hashlib.md5(version).hexdigest()
 
     @cached_property
     def nfirs_deaths_and_injuries_sum(self):
@@ -484,70 +488,51 @@ class FireDepartment(RecentlyUpdatedMixin, Archivable, models.Model):
         1: (2500, 4999)
         0: < 2500
         """
-        if self.population is None:
-            return
-
-        if self.population < 2500:
-            return 0
-
-        if self.population >= 1000000:
-            return 9
-
-        community_sizes = [
-            (500000, 999999),
-            (250000, 499999),
-            (100000, 249999),
-            (50000, 99999),
-            (25000, 49999),
-            (10000, 24999),
-            (5000, 9999),
-            (2500, 4999)]
-
-        for clazz, min_max in zip(reversed(range(1, 9)), community_sizes):
-            if min_max[0] <= self.population <= min_max[1]:
-                return clazz
+        return population_class_for(self.population)
 
     @property
     def similar_departments(self, ignore_regions_min=1000000):
         """
         Identifies similar departments based on the protected population size and region.
         """
+        lower, upper = population_class_range(self.get_population_class() or 0)
+        similar = FireDepartment.objects.filter(archived=self.archived).exclude(id=self.id)
 
-        params = {'archived': self.archived}
-
-        if self.population >= 1000000:
-            params['population__gte'] = 1000000
+        if lower is not None:
+            similar = similar.filter(population__gte=lower)
 
-        elif self.population < 2500:
-            params['population__lt'] = 2500
-
-        else:
-            community_sizes = [
-                (500000, 999999),
-                (250000, 499999),
-                (100000, 249999),
-                (50000, 99999),
-                (25000, 49999),
-                (10000, 24999),
-                (5000, 9999),
-                (2500, 4999)]
-
-            for lower_bound, upper_bound in community_sizes:
-                if lower_bound <= self.population <= upper_bound:
-                    params['population__lte'] = upper_bound
-                    params['population__gte'] = lower_bound
-
-        similar = FireDepartment.objects.filter(**params)\
-            .exclude(id=self.id)\
-            .extra(select={'difference': "abs(population - %s)"}, select_params=[self.population])\
-            .extra(order_by=['difference'])
+        if upper is not None:
+            similar = similar.filter(population__lte=upper)
 
         # Large departments may not have similar departments in their region.
-        if self.population < ignore_regions_min:
+        if (self.population or 0) < ignore_regions_min:
             similar = similar.filter(region=self.region)
 
         return similar
 
+    def nearest_departments(self, limit=15):
+        """
+        Returns the similar departments nearest in population first, looked up in the similar departments index.
+        """
+        ids = similar_departments_index().nearest(self, limit=limit)
+        departments = FireDepartment.objects.in_bulk(ids)
+        return [departments[pk] for pk in ids if pk in departments]
+
+    def similar_departments_by_features(self, k=10):
+        """
+        Returns the k departments most similar in population, area, fire risk, DIST score, station count and
+        department type, most similar first.
+        """
+        index = department_features_index()
+        ids = index.nearest(self, k=k)
+        departments = FireDepartment.objects.in_bulk(ids)
+
+        # departments deleted since the index was built
+        for pk in set(ids) - set(departments):
+            index.remove(pk)
+
+        return [departments[pk] for pk in ids if pk in departments]
+
     @property
     def thumbnail_name(self):
         return slugify(' '.join(['us', self.state, self.name])) + '.jpg'
@@ -584,19 +569,22 @@ class FireDepartment(RecentlyUpdatedMixin, Archivable, models.Model):
                                                                                     access_token=getattr(settings, 'MAPBOX_ACCESS_TOKEN', ''))
 
     def set_geometry_from_government_unit(self):
-        def _first(arr):
-            if arr and len(arr):
-                return arr[0]
-            else:
-                return None
+        """
+        Sets the department's geometry to the cascaded union of its own and its government units' geometries.
+        """
+        polygons = []
 
-        geom_containers = self.government_unit_objects + [self]
-        objs = [x.geom.buffer(0) for x in geom_containers if getattr(x, 'geom', None)]
+        for container in self.government_unit_objects + [self]:
+            geom = getattr(container, 'geom', None)
 
-        if objs:
-            geom = objs.pop()
-            for g in objs:
-                geom = geom.union(g)
+            if geom:
+                geom = geom.buffer(0)
+
+                if not geom.empty:
+                    polygons.extend(geom if geom.geom_type == 'MultiPolygon' else [geom])
+
+        if polygons:
+            geom = MultiPolygon(polygons, srid=polygons[0].srid).cascaded_union
             self.geom = MultiPolygon(geom) if geom.geom_type == 'Polygon' else geom
             self.save()
 
@@ -624,8 +612,7 @@ class FireDepartment(RecentlyUpdatedMixin, Archivable, models.Model):
 
     @classmethod
     def get_histogram(cls, field, bins=400):
-        hist = histogram(list(cls.objects.filter(**{'{0}__isnull'.format(field): False})
-                         .values_list(field, flat=True)), bins=bins)
+        hist = peer_statistics().histogram(field, bins=bins)
         return json.dumps(zip(hist[1], hist[0]), separators=(',', ':'))
 
     def set_region(self, region):
@@ -766,7 +753,11 @@ class FireStation(USGSStructureData, Archivable):
     station_number = models.IntegerField(null=True, blank=True)
     station_address = models.ForeignKey(Address, null=True, blank=True)
     district = models.MultiPolygonField(null=True, blank=True)
+    # square miles of district in US National Atlas Equal Area, maintained by a database trigger
+    district_area = models.FloatField(null=True, blank=True, editable=False, db_index=True)
     objects = models.GeoManager()
+    # geometries drawn in the vector tiles
+    vector_tile_fields = ['geom', 'district']
 
     @classmethod
     def create_station(cls, address_string, department, **kwargs):
@@ -881,123 +872,14 @@ class FireStation(USGSStructureData, Archivable):
                 print url.format(object)
                 print sys.exc_info()
 
-    @property
-    def district_area(self):
-        """
-        Project the district's geometry into US National Atlas Equal Area
-        Returns mi2
-        """
-        if self.district:
-            try:
-                return (self.district.transform(102009, clone=True).area / 1000000) * 0.38610
-            except:
-                return
-
     def suggested_departments(self):
         """
-        Helper functions
+        Returns the departments most likely to operate this station, best match first.
         """
-        def filter_words_from_name(name, words_to_filter):
-            removed_dict = dict((re.escape(k), v) for k, v in words_to_filter.iteritems())
-            removed_pattern = re.compile("|".join(removed_dict.keys()))
-            name = removed_pattern.sub(lambda m: removed_dict[re.escape(m.group(0))], name)
-            name = re.sub("^\d+\s|\s\d+\s|\s\d+$", " ", name)
-            name = re.sub(' +', ' ', name)
-            name = name.strip()
-            return name
-
-        def determine_insertion_index(suggested_departments, department_count, score):
-            index = 1
-            while index < department_count:
-                if score > suggested_departments[index].department_score:
-                    break
-                index += 1
-            return index
-
-        always_removed_words = {
-            "Station": "",
-            " Engine": "",
-            " Truck": "",
-            " Ladder": "",
-            " Quint": "",
-            " Squirt": "",
-            " Ambulance": "",
-            " Service": "",
-            " District": "",
-            " Headquarters": "",
-            " City": ""}
-        lev_removed_words = {
-            " Rescue": "",
-            " Service": "",
-            " and": "",
-            " Emergency": "",
-            " Medical": "",
-            " Services": ""}
-
-        filtered_name = self.name
-        filtered_name = filter_words_from_name(filtered_name, always_removed_words)
-        lev_filtered_name = filter_words_from_name(filtered_name, lev_removed_words)
-
-        nearby_departments = FireDepartment.objects.filter(headquarters_address__geom__distance_lte=(self.geom, D(mi=40)))\
-            .distance(self.geom)\
-            .extra(select={'dis_name': "select levenshtein(firestation_firedepartment.name, %s)", 'dis_sound': "select similarity(firestation_firedepartment.name, %s)"},
-                   select_params=(lev_filtered_name, filtered_name,))\
-            .order_by('distance', 'dis_name')
-
-        best_department_score = 0
-        max_suggested_departments = 10
-        suggested_departments = list()
-
-        for n, fireDepartment in enumerate(nearby_departments):
-
-            if n == 100:
-                break
-
-            department_distance = 40
-
-            if fireDepartment.distance is not None:
-                department_distance = fireDepartment.distance.mi
-            else:
-                meterStation = self.geom.transform(3857, True)
-                meterDepartment = self.geom.transform(3857, True)
-                department_distance = meterDepartment.distance(meterStation) * 0.000621371
-
-            #  The maximum return from levenshtein will be the length of the longer string
-            #  so to create a true 0-1 ratio find the longer string name
-
-            station_name_length = len(lev_filtered_name)
-            department_name_length = len(fireDepartment.name)
-            minimum_name_length = min(station_name_length, department_name_length)
-            longest_name_length = max(station_name_length, department_name_length)
-            minimum_lev_distance = longest_name_length - minimum_name_length
-
-            #  lower bound of levenshtein is at least difference of strings
-            #  to create zero to one ratio must subtract minimum distances
-
-            fireDepartment.dis_name = max(fireDepartment.dis_name - minimum_lev_distance, 0)
-
-            department_score = ((1 - department_distance / 40) * 55) + (1 - fireDepartment.dis_name / longest_name_length) * 80 + (fireDepartment.dis_sound * 30)
-
-            fireDepartment.distance = department_distance
-            fireDepartment.department_score = department_score
-
-            if department_score > best_department_score:
-                best_department_score = department_score
-                suggested_departments.insert(0, fireDepartment)
-            else:
-                num_departments = len(suggested_departments)
-                if num_departments < max_suggested_departments or (num_departments >= max_suggested_departments and department_score > suggested_departments[max_suggested_departments - 1].department_score):
-                    department_index = determine_insertion_index(suggested_departments, num_departments, department_score)
-                    suggested_departments.insert(department_index, fireDepartment)
-
-        #  Trim list down to max count
-
-        num_departments = len(suggested_departments)
-        while num_departments > max_suggested_departments:
-            suggested_departments.pop()
-            num_departments -= 1
-
-        return suggested_departments
+        if not hasattr(self, '_suggested_departments'):
+            suggest_departments([self])
+
+        return self._suggested_departments
 
     @cached_property
     def slug(self):
@@ -1010,6 +892,166 @@ class FireStation(USGSStructureData, Archivable):
         verbose_name = 'Fire Station'
 
 
+SUGGESTION_ALWAYS_REMOVED_WORDS = ["Station", " Engine", " Truck", " Ladder", " Quint", " Squirt", " Ambulance",
+                                   " Service", " District", " Headquarters", " City"]
+
+SUGGESTION_LEVENSHTEIN_REMOVED_WORDS = [" Rescue", " Service", " and", " Emergency", " Medical", " Services"]
+
+SUGGESTION_QUERY = """
+SELECT station.id, candidate.id, candidate.distance, candidate.name_length, candidate.dis_name, candidate.dis_sound
+FROM unnest(%(ids)s::integer[], %(names)s::text[], %(lev_names)s::text[]) AS station(id, name, lev_name)
+JOIN {structures} structure ON structure.id = station.id AND structure.geom IS NOT NULL
+CROSS JOIN LATERAL (
+    SELECT department.id,
+           ST_Distance(address.geom::geography, structure.geom::geography) / 1609.344 AS distance,
+           char_length(department.name) AS name_length,
+           levenshtein(department.name, station.lev_name) AS dis_name,
+           similarity(department.name, station.name) AS dis_sound
+    FROM {departments} department
+    JOIN {addresses} address ON address.id = department.headquarters_address_id
+    -- the bounding box lets the KNN scan use the address index, a degree of longitude is shortest at high latitudes
+    WHERE address.geom && ST_Expand(structure.geom, %(radius)s / 69.0 / GREATEST(cos(radians(ST_Y(structure.geom))), 0.1))
+    AND ST_DWithin(address.geom::geography, structure.geom::geography, %(radius)s * 1609.344)
+    ORDER BY address.geom <-> structure.geom
+    -- a NULL limit scores every headquarters within the radius
+    LIMIT %(candidates)s
+) candidate
+"""
+
+
+def filter_words_from_name(name, words_to_filter):
+    """
+    Removes words and numbers which do not help matching from a station name.
+    """
+    name = re.compile("|".join(re.escape(word) for word in words_to_filter)).sub("", name)
+    name = re.sub("^\d+\s|\s\d+\s|\s\d+$", " ", name)
+    name = re.sub(' +', ' ', name)
+    return name.strip()
+
+
+def suggest_departments(stations, limit=10, radius=40, candidates=None, batch_size=500):
+    """
+    Suggests departments for many stations at once, returns each station's top scoring departments keyed by station id.
+
+    Every headquarters within radius miles of the stations in a batch (or only the nearest candidates of them) is found
+    with one lateral KNN query and scored on distance, levenshtein distance and trigram similarity of the names.
+    Suggestions are memoized on the stations so suggested_departments() does not query again.
+    """
+    query = SUGGESTION_QUERY.format(structures=USGSStructureData._meta.db_table,
+                                    departments=FireDepartment._meta.db_table,
+                                    addresses=Address._meta.db_table)
+    suggestions = {}
+
+    for start in range(0, len(stations), batch_size):
+        batch = stations[start:start + batch_size]
+        names = [filter_words_from_name(station.name or '', SUGGESTION_ALWAYS_REMOVED_WORDS) for station in batch]
+        lev_names = [filter_words_from_name(name, SUGGESTION_LEVENSHTEIN_REMOVED_WORDS) for name in names]
+
+        cursor = connections['default'].cursor()
+        cursor.execute(query, dict(ids=[station.id for station in batch], names=names, lev_names=lev_names,
+                                   radius=radius, candidates=candidates))
+        rows = cursor.fetchall()
+        departments = FireDepartment.objects.in_bulk(set(row[1] for row in rows))
+        lev_name_lengths = dict((station.id, len(name)) for station, name in zip(batch, lev_names))
+        scored = defaultdict(list)
+
+        for station_id, department_id, distance, name_length, dis_name, dis_sound in rows:
+            #  The maximum return from levenshtein will be the length of the longer string, its lower bound is the
+            #  difference of the strings' lengths, subtract it to create a true 0-1 ratio
+            longest_name_length = max(lev_name_lengths[station_id], name_length, 1)
+            dis_name = max(dis_name - abs(lev_name_lengths[station_id] - name_length), 0)
+
+            department = copy.copy(departments[department_id])
+            department.distance = distance
+            department.dis_name = dis_name
+            department.dis_sound = dis_sound
+            department.department_score = ((1 - distance / radius) * 55) + \
+                (1 - dis_name / longest_name_length) * 80 + (dis_sound * 30)
+            scored[station_id].append(department)
+
+        for station in batch:
+            station._suggested_departments = sorted(scored[station.id], key=lambda department: (
+                -department.department_score, department.distance, department.id))[:limit]
+            suggestions[station.id] = station._suggested_departments
+
+    return suggestions
+
+
+class SimplifiedGeometry(models.Model):
+    """
+    Simplified department boundaries and station districts for rendering on maps.
+
+    Every geometry has one row per simplification level, the rows are maintained by database triggers.
+    """
+    SOURCE_CHOICES = [
+        ('department', 'Department boundary'),
+        ('district', 'Station district'),
+    ]
+
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    object_id = models.IntegerField()
+    max_zoom = models.PositiveSmallIntegerField(help_text='The highest map zoom level the geometry is rendered at.')
+    tolerance = models.FloatField(help_text='The simplification tolerance (in degrees).')
+    geom = models.MultiPolygonField()
+    objects = models.GeoManager()
+
+    class Meta:
+        unique_together = ('source', 'object_id', 'max_zoom')
+
+    def __unicode__(self):
+        return u'{0} {1} (zoom <= {2})'.format(self.source, self.object_id, self.max_zoom)
+
+    @property
+    def precision(self):
+        """
+        Decimal digits of the coordinates which are significant at the simplification tolerance.
+        """
+        return int(math.ceil(-math.log10(self.tolerance))) + 1
+
+
+def simplified_geometry(source, object_id, zoom):
+    """
+    Returns the (GeoJSON, lowest zoom, highest zoom) of the level of a department boundary or station district which
+    is rendered at a map zoom, or None when the object has no geometry.
+
+    Zooms past the most detailed level get the full resolution geometry, its highest zoom is None.
+    """
+    min_zoom = 0
+
+    for level in SimplifiedGeometry.objects.filter(source=source, object_id=object_id).order_by('max_zoom')\
+            .only('id', 'max_zoom', 'tolerance'):
+        if zoom <= level.max_zoom:
+            geojson = SimplifiedGeometry.objects.filter(id=level.id).only('id').geojson(precision=level.precision)
+            return geojson[0].geojson, min_zoom, level.max_zoom
+
+        min_zoom = level.max_zoom + 1
+
+    model, field = (FireDepartment, 'geom') if source == 'department' else (FireStation, 'district')
+    full = model.objects.filter(**{'id': object_id, field + '__isnull': False}).only('id')\
+        .geojson(field_name=field, precision=6).first()
+
+    if full is None:
+        return None
+
+    return full.geojson, min_zoom, None
+
+
+class SearchIndexSync(models.Model):
+    """
+    The time of the last successful sync of departments to an Elasticsearch index, incremental syncs only index the
+    departments modified since.
+    """
+    host = models.CharField(max_length=255)
+    index = models.CharField(max_length=255)
+    synced = models.DateTimeField(help_text='When the last successful sync started.')
+
+    class Meta:
+        unique_together = ('host', 'index')
+
+    def __unicode__(self):
+        return u'{0}/{1} ({2})'.format(self.host, self.index, self.synced)
+
+
 class Staffing(models.Model):
     """
     Models response capabilities (apparatus and responders).
@@ -1194,6 +1236,117 @@ class PopulationClass9Quartile(PopulationClassQuartile):
     class Meta(PopulationClassQuartile.Meta):
         db_table = 'population_class_9_quartiles'
 
+
+class DepartmentReportCard(models.Model):
+    """
+    Report card view, holds each department's performance score quartiles within its population class and risk
+    category along with the peer group averages and bullet chart breaks.
+    """
+
+    id = models.OneToOneField(FireDepartment, db_column='id', primary_key=True, related_name='report_card')
+    population_class = models.IntegerField(null=True, blank=True, editable=False)
+    dist_model_score = models.FloatField(null=True, blank=True, editable=False)
+    dist_model_residential_fires_quartile = models.IntegerField(null=True, blank=True, editable=False)
+    dist_model_residential_fires_quartile_avg = models.FloatField(null=True, blank=True, editable=False)
+    dist_model_residential_fires_quartile_breaks = ArrayField(models.FloatField(), null=True, blank=True, editable=False)
+    dist_model_risk_model_greater_than_size_2_quartile = models.IntegerField(null=True, blank=True, editable=False)
+    dist_model_risk_model_greater_than_size_2_quartile_avg = models.FloatField(null=True, blank=True, editable=False)
+    dist_model_risk_model_greater_than_size_2_quartile_breaks = ArrayField(models.FloatField(), null=True, blank=True,
+                                                                           editable=False)
+    dist_model_risk_model_deaths_injuries_quartile = models.IntegerField(null=True, blank=True, editable=False)
+    dist_model_risk_model_deaths_injuries_quartile_avg = models.FloatField(null=True, blank=True, editable=False)
+    dist_model_risk_model_deaths_injuries_quartile_breaks = ArrayField(models.FloatField(), null=True, blank=True,
+                                                                       editable=False)
+
+    # (report card field, population quartile field the peer group is partitioned by)
+    METRICS = [
+        ('dist_model_residential_fires_quartile', 'residential_fires_avg_3_years_quartile'),
+        ('dist_model_risk_model_greater_than_size_2_quartile', 'risk_model_size1_percent_size2_percent_sum_quartile'),
+        ('dist_model_risk_model_deaths_injuries_quartile', 'risk_model_deaths_injuries_sum_quartile'),
+    ]
+
+    class Meta:
+        managed = False
+        db_table = 'department_report_cards'
+
+    def as_context(self):
+        """
+        Returns the report card values keyed by the names used in the department detail template.
+        """
+        context = {}
+
+        for field, _ in self.METRICS:
+            for suffix in ['', '_avg', '_breaks']:
+                context[field + suffix] = getattr(self, field + suffix)
+
+        return context
+
+
+class QuartileViewRefresh(models.Model):
+    """
+    Keeps track of when each population class quartile view was last refreshed.
+    """
+    population_class = models.IntegerField(primary_key=True, choices=FireDepartment.POPULATION_CLASSES)
+    refreshed = models.DateTimeField(null=True, blank=True)
+    generation = models.PositiveIntegerField(default=0)
+
+    def __unicode__(self):
+        return u'Population class {0} quartiles refreshed at {1}.'.format(self.population_class, self.refreshed)
+
+
+class NationalQuartile(models.Model):
+    """
+    National risk band view, ranks each department's performance score against departments across the nation in the
+    same risk quartile.
+    """
+
+    id = models.OneToOneField(FireDepartment, db_column='id', primary_key=True, related_name='national_quartile')
+    dist_model_score = models.FloatField(null=True, blank=True, editable=False)
+    risk_model_size1_percent_size2_percent_sum_quartile = models.IntegerField(null=True, blank=True, editable=False)
+    risk_model_deaths_injuries_sum_quartile = models.IntegerField(null=True, blank=True, editable=False)
+    national_risk_model_size1_percent_size2_percent_sum_quartile = models.IntegerField(null=True, blank=True,
+                                                                                       editable=False)
+    national_risk_model_deaths_injuries_sum_quartile = models.IntegerField(null=True, blank=True, editable=False)
+
+    class Meta:
+        managed = False
+        db_table = 'national_quartiles'
+
+
+class PopulationClassBreaks(models.Model):
+    """
+    Bullet chart breaks view, holds the largest value of each risk quartile of the risk metrics within a population
+    class.
+    """
+
+    population_class = models.IntegerField(primary_key=True, db_column='id', editable=False,
+                                           choices=FireDepartment.POPULATION_CLASSES)
+    residential_fires_avg_3_years_breaks = ArrayField(models.FloatField(), null=True, blank=True, editable=False)
+    risk_model_size1_percent_size2_percent_sum_breaks = ArrayField(models.FloatField(), null=True, blank=True,
+                                                                   editable=False)
+    risk_model_deaths_injuries_sum_breaks = ArrayField(models.FloatField(), null=True, blank=True, editable=False)
+
+    # (population quartile field, field the breaks are grouped by, department detail template name)
+    METRICS = [
+        ('residential_fires_avg_3_years', 'residential_fires_avg_3_years_quartile',
+         'residential_fires_avg_3_years_breaks'),
+        ('risk_model_size1_percent_size2_percent_sum', 'risk_model_size1_percent_size2_percent_sum_quartile',
+         'risk_model_greater_than_size_2_breaks'),
+        ('risk_model_deaths_injuries_sum', 'risk_model_deaths_injuries_sum_quartile',
+         'risk_model_deaths_injuries_breaks'),
+    ]
+
+    class Meta:
+        managed = False
+        db_table = 'population_class_breaks'
+
+    def as_context(self):
+        """
+        Returns the breaks keyed by the names used in the department detail template.
+        """
+        return dict((name, getattr(self, field + '_breaks') or []) for field, _, name in self.METRICS)
+
+
 def set_department_region(sender, instance, **kwargs):
     """
     Sets a department's region when it is instantiated with a state.
@@ -1221,12 +1374,55 @@ def update_department(sender, instance, **kwargs):
     update.update_performance_score.delay(instance.id, dry_run=False)
     update.update_nfirs_counts.delay(instance.id)
 
-def create_quartile_views(sender, **kwargs):
+def track_similar_departments_key(sender, instance, **kwargs):
+    """
+    Remembers the fields a department's similar departments depend on as it was loaded.
     """
-    Creates DB views based on quartile queries.
+    instance._similar_departments_key = (instance.population, instance.region, instance.archived)
+
+
+def update_similar_departments(sender, instance, **kwargs):
+    """
+    Rebuilds the similar departments index when a department's population, region or archived flag changed.
+    """
+    if kwargs.get('created') or kwargs.get('signal') is post_delete or \
+            getattr(instance, '_similar_departments_key', None) != (instance.population, instance.region,
+                                                                    instance.archived):
+        invalidate_similar_departments()
+
+    track_similar_departments_key(sender, instance)
+
+
+def update_department_features(sender, instance, **kwargs):
     """
-    for population_class in [choice[0] for choice in FireDepartment.POPULATION_CLASSES]:
-        query = """
+    Applies a saved or deleted department to the department features index.
+    """
+    invalidate_department_features()
+
+
+def track_vector_tile_geometries(sender, instance, **kwargs):
+    """
+    Remembers the geometries a department or station is drawn with in the vector tiles as it was loaded.
+    """
+    # deferred geometries are not loaded
+    instance._vector_tile_geometries = [instance.__dict__.get(field) for field in sender.vector_tile_fields]
+
+
+def update_vector_tiles(sender, instance, **kwargs):
+    """
+    Marks the cached vector tiles covering a saved or deleted department or station, as loaded and as saved, stale.
+    """
+    geometries = getattr(instance, '_vector_tile_geometries', []) + \
+        [getattr(instance, field) for field in sender.vector_tile_fields]
+    invalidate_vector_tiles(set(geom.extent for geom in geometries if geom))
+    track_vector_tile_geometries(sender, instance)
+
+
+def population_class_quartile_query(population_class):
+    """
+    Returns the query behind a population class quartile view.
+    """
+    return """
             SELECT
                 (SELECT COALESCE(risk_model_fires_size1_percentage,0)+COALESCE(risk_model_fires_size2_percentage,0)) AS "risk_model_size1_percent_size2_percent_sum",
                 (SELECT COALESCE(risk_model_deaths,0)+COALESCE(risk_model_injuries,0)) AS "risk_model_deaths_injuries_sum",
@@ -1279,13 +1475,308 @@ def create_quartile_views(sender, **kwargs):
                 on ("firestation_firedepartment".id=nfirs.fire_department_id)
                 WHERE population_class={0} and archived=False
             """.format(population_class)
-        cursor = connections['default'].cursor()
 
-        # CREATE OR REPLACE does not
-        try:
-            cursor.execute("REFRESH MATERIALIZED VIEW population_class_%s_quartiles;", [population_class])
-        except ProgrammingError:
-            cursor.execute("CREATE MATERIALIZED VIEW population_class_%s_quartiles AS ({0});".format(query), [population_class])
+
+def refresh_materialized_view(name, query):
+    """
+    Refreshes a materialized view keyed by department id without locking out readers.
+
+    The view (and the unique index REFRESH ... CONCURRENTLY requires) is created when it does not exist yet.
+    """
+    cursor = connections['default'].cursor()
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_matviews WHERE matviewname=%s);", [name])
+
+    if not cursor.fetchone()[0]:
+        cursor.execute("CREATE MATERIALIZED VIEW {0} AS ({1});".format(name, query))
+        cursor.execute("CREATE UNIQUE INDEX {0}_id ON {0} (id);".format(name))
+        return
+
+    # views created before concurrent refreshes were supported do not have the unique index
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS {0}_id ON {0} (id);".format(name))
+    cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY {0};".format(name))
+
+
+def dirty_population_classes():
+    """
+    Returns the population classes with departments (or their NFIRS statistics) modified since the class' quartile
+    view was last refreshed.  Departments that moved out of a class are caught through the view's existing rows.
+    """
+    refreshed = dict(QuartileViewRefresh.objects.values_list('population_class', 'refreshed'))
+    cursor = connections['default'].cursor()
+    dirty = []
+
+    for population_class, _ in FireDepartment.POPULATION_CLASSES:
+        last_refresh = refreshed.get(population_class)
+
+        if last_refresh is None:
+            dirty.append(population_class)
+            continue
+
+        cursor.execute("""
+            SELECT EXISTS (
+                SELECT 1 FROM firestation_firedepartment
+                WHERE modified > %(refreshed)s
+                AND (population_class = %(population_class)s
+                     OR id IN (SELECT id FROM population_class_{0}_quartiles))
+            ) OR EXISTS (
+                SELECT 1 FROM firestation_nfirsstatistic
+                INNER JOIN firestation_firedepartment ON (firestation_firedepartment.id=firestation_nfirsstatistic.fire_department_id)
+                WHERE firestation_nfirsstatistic.modified > %(refreshed)s
+                AND firestation_firedepartment.population_class = %(population_class)s
+            );
+            """.format(population_class), dict(refreshed=last_refresh, population_class=population_class))
+
+        if cursor.fetchone()[0]:
+            dirty.append(population_class)
+
+    return dirty
+
+
+def refresh_quartile_views(population_classes=None):
+    """
+    Concurrently refreshes the quartile views of the given population classes (defaults to the dirty ones), followed
+    by the views derived from them.
+
+    Returns the list of refreshed population classes.
+    """
+    if population_classes is None:
+        population_classes = dirty_population_classes()
+
+    for population_class in population_classes:
+        # changes made while the view refreshes are picked up by the next refresh
+        started = timezone.now()
+        refresh_materialized_view('population_class_{0}_quartiles'.format(population_class),
+                                  population_class_quartile_query(population_class))
+        QuartileViewRefresh.objects.update_or_create(population_class=population_class,
+                                                     defaults={'refreshed': started})
+
+    if population_classes:
+        create_report_card_view()
+        create_national_quartile_view()
+        create_population_class_breaks_view()
+
+        # bumped once the derived views are refreshed so nothing is cached from a partially refreshed set of views
+        QuartileViewRefresh.objects.filter(population_class__in=population_classes)\
+            .update(generation=F('generation') + 1)
+
+    return population_classes
+
+
+def create_quartile_views(sender, **kwargs):
+    """
+    Creates (or refreshes) all of the quartile views.
+    """
+    return refresh_quartile_views([choice[0] for choice in FireDepartment.POPULATION_CLASSES])
+
+
+def create_report_card_view():
+    """
+    Creates (or refreshes) the department report card view in a single pass over the population quartile views.
+
+    Each department's performance score is ranked against the departments in the same population class and risk
+    quartile, which is the same peer group the department detail page used to build on every request.
+    """
+    union = ' UNION ALL '.join(['SELECT * FROM population_class_{0}_quartiles'.format(population_class)
+                                for population_class, _ in FireDepartment.POPULATION_CLASSES])
+
+    ntiles, groups, columns, joins = [], [], [], []
+
+    for field, group_by in DepartmentReportCard.METRICS:
+        ntiles.append('CASE WHEN dist_model_score IS NOT NULL THEN ntile(4) over (partition by population_class, '
+                      'dist_model_score is not null, {group_by} order by dist_model_score) ELSE NULL END AS {field}'
+                      .format(field=field, group_by=group_by))
+
+        groups.append("""
+            {field}_groups AS (
+                SELECT population_class, {group_by},
+                    SUM(total)::float / NULLIF(SUM(n), 0) AS avg,
+                    array_agg(max_score ORDER BY {field}) FILTER (WHERE {field} IS NOT NULL) AS breaks
+                FROM (
+                    SELECT population_class, {group_by}, {field}, MAX(dist_model_score) AS max_score,
+                        SUM({field}) AS total, COUNT({field}) AS n
+                    FROM peers
+                    GROUP BY population_class, {group_by}, {field}) buckets
+                GROUP BY population_class, {group_by})""".format(field=field, group_by=group_by))
+
+        columns.append('peers.{field}, {field}_groups.avg AS {field}_avg, {field}_groups.breaks AS {field}_breaks'
+                       .format(field=field))
+
+        joins.append('LEFT JOIN {field}_groups ON ({field}_groups.population_class=peers.population_class AND '
+                     '{field}_groups.{group_by} IS NOT DISTINCT FROM peers.{group_by})'
+                     .format(field=field, group_by=group_by))
+
+    query = """
+        WITH peers AS (
+            SELECT id, population_class, dist_model_score, {group_columns},
+                {ntiles}
+            FROM ({union}) population_class_quartiles),
+        {groups}
+        SELECT peers.id, peers.population_class, peers.dist_model_score,
+            {columns}
+        FROM peers
+        {joins}
+        """.format(group_columns=', '.join([group_by for _, group_by in DepartmentReportCard.METRICS]),
+                   ntiles=',\n'.join(ntiles),
+                   union=union,
+                   groups=',\n'.join(groups),
+                   columns=',\n'.join(columns),
+                   joins='\n'.join(joins))
+
+    refresh_materialized_view('department_report_cards', query)
+
+
+def create_national_quartile_view():
+    """
+    Creates (or refreshes) the national risk band view.
+    """
+    query = """
+        WITH results AS (
+            SELECT id, dist_model_score,
+                CASE WHEN (risk_model_fires_size1_percentage IS NOT NULL OR risk_model_fires_size2_percentage IS NOT NULL) THEN ntile(4) over (partition by COALESCE(risk_model_fires_size1_percentage,0)+COALESCE(risk_model_fires_size2_percentage,0) != 0 order by COALESCE(risk_model_fires_size1_percentage,0)+COALESCE(risk_model_fires_size2_percentage,0)) ELSE NULL END AS "risk_model_size1_percent_size2_percent_sum_quartile",
+                CASE WHEN (risk_model_deaths IS NOT NULL OR risk_model_injuries IS NOT NULL) THEN ntile(4) over (partition by COALESCE(risk_model_deaths,0)+COALESCE(risk_model_injuries,0) != 0 order by COALESCE(risk_model_deaths,0)+COALESCE(risk_model_injuries,0)) ELSE NULL END AS "risk_model_deaths_injuries_sum_quartile"
+            FROM firestation_firedepartment
+            WHERE dist_model_score IS NOT NULL and archived=False)
+        SELECT id, dist_model_score, risk_model_size1_percent_size2_percent_sum_quartile, risk_model_deaths_injuries_sum_quartile,
+            CASE WHEN risk_model_size1_percent_size2_percent_sum_quartile IS NOT NULL THEN ntile(4) over (partition by risk_model_size1_percent_size2_percent_sum_quartile order by dist_model_score) ELSE NULL END AS "national_risk_model_size1_percent_size2_percent_sum_quartile",
+            CASE WHEN risk_model_deaths_injuries_sum_quartile IS NOT NULL THEN ntile(4) over (partition by risk_model_deaths_injuries_sum_quartile order by dist_model_score) ELSE NULL END AS "national_risk_model_deaths_injuries_sum_quartile"
+        FROM results
+        """
+
+    refresh_materialized_view('national_quartiles', query)
+
+
+def create_population_class_breaks_view():
+    """
+    Creates (or refreshes) the bullet chart breaks of all population classes in a single pass over the population
+    quartile views.
+    """
+    union = ' UNION ALL '.join(['SELECT * FROM population_class_{0}_quartiles'.format(population_class)
+                                for population_class, _ in FireDepartment.POPULATION_CLASSES])
+
+    grouping_sets, columns, breaks = [], [], []
+
+    for index, (field, group_by, _) in enumerate(PopulationClassBreaks.METRICS):
+        grouping_sets.append('(population_class, {0})'.format(group_by))
+        columns.append('{group_by}, MAX({field})::float AS {field}'.format(field=field, group_by=group_by))
+
+        # GROUPING() sets a bit for every group by column that is not part of the row's grouping set
+        grouping = sum(1 << (len(PopulationClassBreaks.METRICS) - 1 - other)
+                       for other in range(len(PopulationClassBreaks.METRICS)) if other != index)
+
+        breaks.append('array_agg({field} ORDER BY {group_by}) FILTER (WHERE grouping_set={grouping} AND {group_by} IS NOT '
+                      'NULL) AS {field}_breaks'.format(field=field, group_by=group_by, grouping=grouping))
+
+    query = """
+        WITH quartiles AS (
+            SELECT population_class, {columns},
+                GROUPING({group_columns}) AS grouping_set
+            FROM ({union}) population_class_quartiles
+            GROUP BY GROUPING SETS ({grouping_sets}))
+        SELECT population_class AS id,
+            {breaks}
+        FROM quartiles
+        GROUP BY population_class
+        """.format(columns=', '.join(columns),
+                   group_columns=', '.join([group_by for _, group_by, _ in PopulationClassBreaks.METRICS]),
+                   union=union,
+                   grouping_sets=', '.join(grouping_sets),
+                   breaks=',\n'.join(breaks))
+
+    refresh_materialized_view('population_class_breaks', query)
+
+
+def population_class_breaks():
+    """
+    Returns the bullet chart breaks keyed by population class, cached until the quartile views are refreshed.
+    """
+    cache_key = 'population_class_breaks_{0}'.format(peer_statistics_version())
+    breaks = cache.get(cache_key)
+
+    if breaks is None:
+        breaks = dict((row.population_class, row) for row in PopulationClassBreaks.objects.all())
+        cache.set(cache_key, breaks, timeout=60 * 60 * 24)
+
+    return breaks
+
+
+def set_geometries_from_government_units(department_ids=None):
+    """
+    Sets departments' geometries to the union of their own and their government units' geometries with a single
+    statement, returns the number of updated departments.
+    """
+    from django.contrib.contenttypes.models import ContentType
+
+    department_type = ContentType.objects.get_for_model(FireDepartment)
+    relations = RelatedObject.objects.filter(parent_type=department_type)
+    departments = FireDepartment._meta.db_table
+    related = RelatedObject._meta.db_table
+
+    if department_ids is not None:
+        relations = relations.filter(parent_id__in=department_ids)
+
+    geometries = ['SELECT id AS department_id, geom FROM {departments} WHERE geom IS NOT NULL AND id IN '
+                  '(SELECT parent_id FROM {related} WHERE parent_type_id = %s)'.format(departments=departments,
+                                                                                       related=related)]
+    params = [department_type.id]
+
+    for object_type in relations.order_by().values_list('object_type', flat=True).distinct():
+        model = ContentType.objects.get_for_id(object_type).model_class()
+
+        if model is None or 'geom' not in [field.name for field in model._meta.concrete_fields]:
+            continue
+
+        geometries.append('SELECT related.parent_id, unit.{geom} FROM {related} related '
+                          'JOIN {units} unit ON unit.{pk} = related.object_id '
+                          'WHERE related.parent_type_id = %s AND related.object_type_id = %s'
+                          .format(geom=model._meta.get_field('geom').column, related=related,
+                                  units=model._meta.db_table, pk=model._meta.pk.column))
+        params += [department_type.id, object_type]
+
+    # the departments' own rows in the FROM list hold their boundaries as they were before the update
+    query = """
+    UPDATE {departments} department SET geom = unions.geom, modified = now()
+    FROM {departments} previous, (
+        SELECT department_id, ST_Multi(ST_CollectionExtract(ST_Union(ST_Buffer(geom, 0)), 3)) AS geom
+        FROM ({geometries}) geometries
+        GROUP BY department_id
+    ) unions
+    WHERE department.id = unions.department_id AND previous.id = department.id AND NOT ST_IsEmpty(unions.geom)
+    """.format(departments=departments, geometries=' UNION ALL '.join(geometries))
+
+    if department_ids is not None:
+        query += ' AND department.id = ANY(%s)'
+        params.append(list(department_ids))
+
+    query += """
+    RETURNING ST_XMin(previous.geom), ST_YMin(previous.geom), ST_XMax(previous.geom), ST_YMax(previous.geom),
+              ST_XMin(department.geom), ST_YMin(department.geom), ST_XMax(department.geom), ST_YMax(department.geom)
+    """
+
+    cursor = connections['default'].cursor()
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+    invalidate_department_features()
+    invalidate_vector_tiles(set(extent for row in rows for extent in (row[:4], row[4:]) if extent[0] is not None))
+    return len(rows)
+
+
+def search_departments(search_term, limit=10):
+    """
+    Returns the best full text search matches (by ts_rank) of non-archived departments, the ranked ids of a search
+    are cached for five minutes.
+    """
+    term = CalculationsQuerySet._sanitize_full_text_search(search_term)
+    cache_key = 'department_search_{0}_{1}'.format(hashlib.md5(force_bytes(term)).hexdigest(), limit)
+    ids = cache.get(cache_key)
+
+    if ids is None:
+        ids = list(FireDepartment.objects.filter(archived=False)
+                   .ranked_full_text_search(search_term, limit=limit)
+                   .values_list('id', flat=True))
+        cache.set(cache_key, ids, timeout=60 * 5)
+
+    departments = FireDepartment.objects.in_bulk(ids)
+    return [departments[pk] for pk in ids if pk in departments]
 
 
 @deconstructible
@@ -1319,6 +1810,17 @@ class Document(models.Model):
 
 post_save.connect(set_department_region, sender=FireDepartment)
 post_save.connect(update_department, sender=FireDepartment)
+post_init.connect(track_similar_departments_key, sender=FireDepartment)
+post_save.connect(update_similar_departments, sender=FireDepartment)
+post_delete.connect(update_similar_departments, sender=FireDepartment)
+post_save.connect(update_department_features, sender=FireDepartment)
+post_delete.connect(update_department_features, sender=FireDepartment)
+post_init.connect(track_vector_tile_geometries, sender=FireDepartment)
+post_save.connect(update_vector_tiles, sender=FireDepartment)
+post_delete.connect(update_vector_tiles, sender=FireDepartment)
+post_init.connect(track_vector_tile_geometries, sender=FireStation)
+post_save.connect(update_vector_tiles, sender=FireStation)
+post_delete.connect(update_vector_tiles, sender=FireStation)
 post_migrate.connect(create_quartile_views)
 reversion.register(FireStation)
 reversion.register(FireDepartment)
@@ -0,0 +1,574 @@
+import numpy
+import uuid
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import timedelta
+from heapq import heappush, heapreplace
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Sum
+from django.utils import timezone
+
+PEER_FIELDS = ['dist_model_score', 'risk_model_fires', 'risk_model_deaths', 'risk_model_injuries',
+               'risk_model_fires_size0', 'risk_model_fires_size1', 'risk_model_fires_size2',
+               'risk_model_deaths_injuries_sum', 'risk_model_size1_percent_size2_percent_sum',
+               'residential_fires_avg_3_years']
+
+PEER_QUARTILE_FIELDS = ['dist_model_score_quartile', 'risk_model_fires_quartile',
+                        'risk_model_deaths_injuries_sum_quartile',
+                        'risk_model_size1_percent_size2_percent_sum_quartile',
+                        'residential_fires_avg_3_years_quartile']
+
+# lower population bound of population classes 1 through 9, class 0 is everything below 2,500
+POPULATION_CLASS_BOUNDS = [2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000, 1000000]
+
+SIMILAR_DEPARTMENTS_VERSION_KEY = 'similar_departments_version'
+
+# features compared by the multi-metric similarity search and whether they are log scaled before being normalized
+SIMILARITY_FEATURES = [('population', True), ('geom_area', True), ('risk_model_fires', True),
+                       ('dist_model_score', False), ('station_count', True), ('department_type', False)]
+
+# department types from mostly volunteer to mostly career
+DEPARTMENT_TYPE_SCALE = {'Volunteer': 0.0, 'Mostly Volunteer': 1 / 3.0, 'Mostly Career': 2 / 3.0, 'Career': 1.0}
+
+DEPARTMENT_FEATURES_VERSION_KEY = 'department_features_version'
+
+_peer_statistics = None
+_similar_departments_index = None
+_department_features_index = None
+
+
+class PeerStatistics(object):
+    """
+    In-memory snapshot of the scoring columns of the population class quartile views.
+
+    Every non-archived department with a population class is loaded into NumPy arrays (NULLs become NaN) so ntiles,
+    percent ranks, breaks and histograms of any population class or region are answered without querying the
+    database.  Snapshots are tied to the quartile view refresh generation they were loaded at.
+    """
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.ids = numpy.array([row[0] for row in rows], dtype=numpy.int64)
+        self.population_class = numpy.array([row[1] for row in rows], dtype=numpy.int64)
+        self.region = numpy.array([row[2] or '' for row in rows], dtype=object)
+        self.columns = {}
+        self._sorted = {}
+
+        for index, field in enumerate(PEER_FIELDS + PEER_QUARTILE_FIELDS, start=3):
+            self.columns[field] = numpy.array([numpy.nan if row[index] is None else row[index] for row in rows],
+                                              dtype=numpy.float64)
+
+    @classmethod
+    def load(cls, version=None):
+        """
+        Loads the quartile views of all population classes with a single query.
+        """
+        from .models import FireDepartment
+
+        if version is None:
+            version = peer_statistics_version()
+
+        query = ' UNION ALL '.join('SELECT id, population_class, region, {fields} FROM population_class_{0}_quartiles'
+                                   .format(population_class, fields=', '.join(PEER_FIELDS + PEER_QUARTILE_FIELDS))
+                                   for population_class, _ in FireDepartment.POPULATION_CLASSES)
+
+        cursor = connections['default'].cursor()
+        cursor.execute(query)
+        return cls(version, cursor.fetchall())
+
+    def _mask(self, field, population_class=None, region=None):
+        mask = ~numpy.isnan(self.columns[field])
+
+        if population_class is not None:
+            mask &= self.population_class == population_class
+
+        if region is not None:
+            mask &= self.region == region
+
+        return mask
+
+    def values(self, field, population_class=None, region=None):
+        """
+        Returns the sorted non-null values of a field for the matching departments.
+        """
+        key = (field, population_class, region)
+
+        if key not in self._sorted:
+            self._sorted[key] = numpy.sort(self.columns[field][self._mask(field, population_class, region)])
+
+        return self._sorted[key]
+
+    def stats(self, field, population_class=None, region=None):
+        """
+        Returns the min, max and avg of a field keyed like Django aggregates (ie: dist_model_score__min).
+        """
+        values = self.values(field, population_class, region)
+        empty = not len(values)
+
+        return {'{0}__min'.format(field): None if empty else float(values[0]),
+                '{0}__max'.format(field): None if empty else float(values[-1]),
+                '{0}__avg'.format(field): None if empty else float(values.mean())}
+
+    def ntile(self, field, value, n=4, population_class=None, region=None):
+        """
+        Returns the bucket (1 through n) Postgres' ntile(n) assigns to value, ties go to the lowest bucket.
+        """
+        values = self.values(field, population_class, region)
+
+        if value is None or not len(values):
+            return
+
+        index = min(numpy.searchsorted(values, value, side='left'), len(values) - 1)
+        size, extra = divmod(len(values), n)
+
+        if index < extra * (size + 1):
+            return int(index // (size + 1)) + 1
+
+        return int(extra + (index - extra * (size + 1)) // size) + 1
+
+    def percent_rank(self, field, value, population_class=None, region=None):
+        """
+        Returns Postgres' percent_rank of value, the fraction of the other departments with lower values.
+        """
+        values = self.values(field, population_class, region)
+
+        if value is None or not len(values):
+            return
+
+        if len(values) == 1:
+            return 0.0
+
+        return float(numpy.searchsorted(values, value, side='left')) / (len(values) - 1)
+
+    def breaks(self, field, n=4, group_by=None, population_class=None, region=None):
+        """
+        Returns the max value of each of a field's ntile(n) buckets.
+
+        When group_by names a loaded quartile column, buckets are the departments' quartiles from the views instead.
+        """
+        if group_by:
+            mask = self._mask(field, population_class, region) & ~numpy.isnan(self.columns[group_by])
+            groups = self.columns[group_by][mask]
+            values = self.columns[field][mask]
+            return [float(values[groups == group].max()) for group in numpy.unique(groups)]
+
+        values = self.values(field, population_class, region)
+
+        if not len(values):
+            return []
+
+        size, extra = divmod(len(values), n)
+        return [float(values[(bucket + 1) * size + min(bucket + 1, extra) - 1])
+                for bucket in range(min(n, len(values)))]
+
+    def histogram(self, field, bins=400, population_class=None, region=None):
+        """
+        Returns NumPy's histogram (counts, bin edges) of a field.
+        """
+        return numpy.histogram(self.values(field, population_class, region), bins=bins)
+
+
+def peer_statistics_version():
+    """
+    Returns the quartile view refresh counter, it changes whenever any population class quartile view is refreshed.
+    """
+    from .models import QuartileViewRefresh
+    return QuartileViewRefresh.objects.aggregate(version=Sum('generation'))['version'] or 0
+
+
+def peer_statistics():
+    """
+    Returns this process' peer statistics, reloading them when the quartile views were refreshed since they loaded.
+    """
+    global _peer_statistics
+    version = peer_statistics_version()
+
+    if _peer_statistics is None or _peer_statistics.version != version:
+        _peer_statistics = PeerStatistics.load(version)
+
+    return _peer_statistics
+
+
+def population_class_for(population):
+    """
+    Returns the NFPA community size (population class) of a population.
+    """
+    if population is None:
+        return
+
+    return bisect_right(POPULATION_CLASS_BOUNDS, population)
+
+
+def population_class_range(population_class):
+    """
+    Returns the (lower, upper) population bounds of a population class, None when it is unbounded.
+    """
+    lower = POPULATION_CLASS_BOUNDS[population_class - 1] if population_class else None
+    upper = POPULATION_CLASS_BOUNDS[population_class] - 1 if population_class < len(POPULATION_CLASS_BOUNDS) else None
+    return lower, upper
+
+
+class SimilarDepartmentsIndex(object):
+    """
+    Departments' ids sorted by population per (population class, region, archived) and (population class, archived).
+
+    The departments nearest in population to a department are found with a bisect of its population and a window
+    expanding towards whichever neighbour is closer.
+    """
+
+    def __init__(self, version, rows):
+        self.version = version
+        groups = defaultdict(list)
+
+        for pk, population, region, archived in rows:
+            group = population_class_for(population)
+            groups[(group, archived, region)].append((population, pk))
+            groups[(group, archived)].append((population, pk))
+
+        self.populations = {}
+        self.ids = {}
+
+        for key, departments in groups.items():
+            departments.sort()
+            self.populations[key] = [population for population, pk in departments]
+            self.ids[key] = [pk for population, pk in departments]
+
+    @classmethod
+    def load(cls, version=None):
+        """
+        Loads every department with a population with a single query.
+        """
+        from .models import FireDepartment
+
+        if version is None:
+            version = similar_departments_version()
+
+        rows = FireDepartment.objects.filter(population__isnull=False)\
+            .values_list('id', 'population', 'region', 'archived')
+        return cls(version, rows)
+
+    def nearest(self, department, limit=None, ignore_regions_min=1000000):
+        """
+        Returns the ids of the departments in the department's population class (and region for departments smaller
+        than ignore_regions_min) nearest in population first.
+        """
+        population = department.population or 0
+        key = (population_class_for(population), department.archived)
+
+        if population < ignore_regions_min:
+            key += (department.region,)
+
+        populations, ids = self.populations.get(key, []), self.ids.get(key, [])
+
+        right = bisect_left(populations, population)
+        left = right - 1
+        nearest = []
+
+        while left >= 0 or right < len(ids):
+            if limit is not None and len(nearest) >= limit:
+                break
+
+            if right >= len(ids) or (left >= 0 and population - populations[left] <= populations[right] - population):
+                pk = ids[left]
+                left -= 1
+            else:
+                pk = ids[right]
+                right += 1
+
+            if pk != department.id:
+                nearest.append(pk)
+
+        return nearest
+
+
+def similar_departments_version():
+    """
+    Returns a token which changes whenever a department's population, region or archived flag changes.
+    """
+    version = cache.get(SIMILAR_DEPARTMENTS_VERSION_KEY)
+
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.add(SIMILAR_DEPARTMENTS_VERSION_KEY, version, timeout=None)
+        version = cache.get(SIMILAR_DEPARTMENTS_VERSION_KEY, version)
+
+    return version
+
+
+def invalidate_similar_departments():
+    """
+    Marks every process' similar departments index stale.
+    """
+    cache.set(SIMILAR_DEPARTMENTS_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def similar_departments_index():
+    """
+    Returns this process' similar departments index, rebuilding it when departments changed since it was built.
+    """
+    global _similar_departments_index
+    version = similar_departments_version()
+
+    if _similar_departments_index is None or _similar_departments_index.version != version:
+        _similar_departments_index = SimilarDepartmentsIndex.load(version)
+
+    return _similar_departments_index
+
+
+class KDTree(object):
+    """
+    A static k-d tree over the rows of a NumPy array for k nearest neighbour queries.
+
+    Nodes split the widest dimension at its median, leaves of up to leaf_size rows are scanned with NumPy.
+    """
+
+    def __init__(self, points, leaf_size=32):
+        self.points = numpy.asarray(points, dtype=numpy.float64)
+        self.leaf_size = leaf_size
+        self.indices = numpy.arange(len(self.points))
+        self.nodes = []
+
+        if len(self.points):
+            self._build(0, len(self.points))
+
+    def _build(self, start, end):
+        node = len(self.nodes)
+        self.nodes.append(None)
+
+        if end - start <= self.leaf_size:
+            self.nodes[node] = (start, end, None, None, None, None)
+            return node
+
+        points = self.points[self.indices[start:end]]
+        dimension = int(numpy.argmax(points.max(axis=0) - points.min(axis=0)))
+        middle = (end - start) // 2
+        self.indices[start:end] = self.indices[start:end][numpy.argpartition(points[:, dimension], middle)]
+        split = self.points[self.indices[start + middle], dimension]
+
+        left = self._build(start, start + middle)
+        right = self._build(start + middle, end)
+        self.nodes[node] = (start, end, dimension, split, left, right)
+        return node
+
+    def query(self, point, k=1, exclude=None):
+        """
+        Returns (squared distance, row) pairs of the k rows nearest to point, nearest first.
+
+        Rows flagged in the exclude boolean array are skipped.
+        """
+        point = numpy.asarray(point, dtype=numpy.float64)
+        nearest = []
+        stack = [(0, 0.0)] if self.nodes else []
+
+        while stack:
+            node, bound = stack.pop()
+
+            if len(nearest) == k and bound >= -nearest[0][0]:
+                continue
+
+            start, end, dimension, split, left, right = self.nodes[node]
+
+            if dimension is None:
+                rows = self.indices[start:end]
+
+                for distance, row in zip(((self.points[rows] - point) ** 2).sum(axis=1), rows):
+                    if exclude is not None and exclude[row]:
+                        continue
+
+                    if len(nearest) < k:
+                        heappush(nearest, (-distance, row))
+                    elif distance < -nearest[0][0]:
+                        heapreplace(nearest, (-distance, row))
+                continue
+
+            difference = point[dimension] - split
+            near, far = (left, right) if difference < 0 else (right, left)
+            stack.append((far, max(bound, difference ** 2)))
+            stack.append((near, bound))
+
+        return sorted((-distance, int(row)) for distance, row in nearest)
+
+
+class DepartmentFeaturesIndex(object):
+    """
+    A k-d tree of non-archived departments' normalized similarity feature vectors.
+
+    Features are log scaled where skewed, missing values are imputed with the feature's median and every feature is
+    standardized so each weighs the same.  Departments changed after the tree was built are tombstoned in the tree
+    and kept in a small buffer which is scanned directly; the tree is rebuilt once the buffer grows past
+    rebuild_fraction of the tree or the tree is older than max_age.
+    """
+    rebuild_fraction = 0.05
+    max_age = timedelta(days=1)
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.built = timezone.now()
+        rows = [row for row in rows if not row[-1]]
+        self.watermark = max([row[-2] for row in rows]) if rows else None
+
+        raw = self.raw_features(rows)
+        self.medians = numpy.array([numpy.nanmedian(column) if (~numpy.isnan(column)).any() else 0.0
+                                    for column in raw.T]) if len(rows) else numpy.zeros(len(SIMILARITY_FEATURES))
+        filled = self.impute(raw)
+        self.center = filled.mean(axis=0) if len(rows) else numpy.zeros(len(SIMILARITY_FEATURES))
+        scale = filled.std(axis=0) if len(rows) else numpy.ones(len(SIMILARITY_FEATURES))
+        self.scale = numpy.where(scale > 0, scale, 1.0)
+
+        self.ids = numpy.array([row[0] for row in rows], dtype=numpy.int64)
+        self.rows = dict((pk, index) for index, pk in enumerate(self.ids))
+        self.dead = numpy.zeros(len(self.ids), dtype=bool)
+        self.tree = KDTree(self.normalize(filled))
+        self.changed = {}
+
+    @staticmethod
+    def query(where=''):
+        from .models import FireDepartment, FireStation
+
+        return """
+        SELECT fd.id, fd.population, fd.geom_area, fd.risk_model_fires, fd.dist_model_score,
+               COALESCE(stations.count, 0), fd.department_type, fd.modified, fd.archived
+        FROM {departments} fd
+        LEFT JOIN (SELECT department_id, count(*) FROM {stations} WHERE NOT archived GROUP BY department_id) stations
+            ON stations.department_id = fd.id
+        {where}
+        """.format(departments=FireDepartment._meta.db_table, stations=FireStation._meta.db_table, where=where)
+
+    @classmethod
+    def load(cls, version=None):
+        """
+        Loads the features of every department with a single query.
+        """
+        if version is None:
+            version = department_features_version()
+
+        cursor = connections['default'].cursor()
+        cursor.execute(cls.query())
+        return cls(version, cursor.fetchall())
+
+    @staticmethod
+    def raw_features(rows):
+        raw = numpy.empty((len(rows), len(SIMILARITY_FEATURES)), dtype=numpy.float64)
+
+        for index, row in enumerate(rows):
+            values = list(row[1:6]) + [DEPARTMENT_TYPE_SCALE.get(row[6])]
+            raw[index] = [numpy.nan if value is None else float(value) for value in values]
+
+        for column, (feature, log_scaled) in enumerate(SIMILARITY_FEATURES):
+            if log_scaled:
+                raw[:, column] = numpy.log1p(numpy.clip(raw[:, column], 0, None))
+
+        return raw
+
+    def impute(self, raw):
+        return numpy.where(numpy.isnan(raw), self.medians, raw)
+
+    def normalize(self, filled):
+        return (filled - self.center) / self.scale
+
+    def vectors(self, rows):
+        return self.normalize(self.impute(self.raw_features(rows)))
+
+    @property
+    def stale(self):
+        return len(self.changed) > self.rebuild_fraction * max(len(self.ids), 1) or \
+            timezone.now() - self.built > self.max_age
+
+    def refresh(self, version):
+        """
+        Applies the departments modified since the newest department the index has seen.
+        """
+        cursor = connections['default'].cursor()
+
+        if self.watermark is None:
+            cursor.execute(self.query())
+        else:
+            cursor.execute(self.query('WHERE fd.modified > %s'), [self.watermark])
+
+        rows = cursor.fetchall()
+
+        for row, vector in zip(rows, self.vectors(rows)):
+            self.remove(row[0])
+
+            if not row[-1]:
+                self.changed[row[0]] = vector
+
+            self.watermark = max(self.watermark, row[-2]) if self.watermark else row[-2]
+
+        self.version = version
+
+    def remove(self, pk):
+        """
+        Drops a department from the index, ie: when it was deleted.
+        """
+        if pk in self.rows:
+            self.dead[self.rows[pk]] = True
+
+        self.changed.pop(pk, None)
+
+    def vector(self, department):
+        if department.id in self.changed:
+            return self.changed[department.id]
+
+        if department.id in self.rows:
+            return self.tree.points[self.rows[department.id]]
+
+        cursor = connections['default'].cursor()
+        cursor.execute(self.query('WHERE fd.id = %s'), [department.id])
+        rows = cursor.fetchall()
+
+        if rows:
+            return self.vectors(rows)[0]
+
+    def nearest(self, department, k=10):
+        """
+        Returns the ids of the k departments with the most similar features, most similar first.
+        """
+        vector = self.vector(department)
+
+        if vector is None:
+            return []
+
+        nearest = [(distance, int(self.ids[row])) for distance, row in
+                   self.tree.query(vector, k=k + 1, exclude=self.dead)]
+
+        for pk, changed in self.changed.items():
+            nearest.append((float(((changed - vector) ** 2).sum()), pk))
+
+        return [pk for distance, pk in sorted(nearest) if pk != department.id][:k]
+
+
+def department_features_version():
+    """
+    Returns a token which changes whenever a department is saved or deleted.
+    """
+    version = cache.get(DEPARTMENT_FEATURES_VERSION_KEY)
+
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.add(DEPARTMENT_FEATURES_VERSION_KEY, version, timeout=None)
+        version = cache.get(DEPARTMENT_FEATURES_VERSION_KEY, version)
+
+    return version
+
+
+def invalidate_department_features():
+    cache.set(DEPARTMENT_FEATURES_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def department_features_index():
+    """
+    Returns this process' department features index, applying departments changed since it was built or rebuilding
+    it when too many changed.
+    """
+    global _department_features_index
+    version = department_features_version()
+
+    if _department_features_index is None or _department_features_index.stale:
+        _department_features_index = DepartmentFeaturesIndex.load(version)
+
+    elif _department_features_index.version != version:
+        _department_features_index.refresh(version)
+
+    return _department_features_index
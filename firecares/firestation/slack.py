@@ -3,12 +3,15 @@ from django.conf import settings
 from django.http import HttpResponseForbidden, HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View
+from django.utils import timezone
 from django.utils.decorators import method_decorator
 from firecares.tasks.cache import clear_cache as clear_cache_task
 from firecares.tasks.slack import send_slack_message
 from firecares.tasks.update import update_nfirs_counts, update_performance_score
 from firecares.firecares_core.models import AccountRequest
-from firecares.firestation.models import FireDepartment
+from firecares.firestation.models import FireDepartment, search_departments
+from firecares.firestation.peers import invalidate_department_features, invalidate_similar_departments
+from firecares.firestation.tiles import invalidate_vector_tiles, vector_tile_extents
 
 logger = logging.getLogger(__name__)
 
@@ -64,7 +67,7 @@ class FireCARESSlack(View):
         return HttpResponse()
 
     def q(self, request, *args, **kwargs):
-        departments = FireDepartment.objects.filter(archived=False).full_text_search(' '.join(self.command_args))
+        departments = search_departments(' '.join(self.command_args))
         msg = ['{index}. <https://firecares.org{url}|{name}>, {state}'.format(index=n + 1, name=department.name, url=department.get_absolute_url(), state=department.state) for n, department in enumerate(departments)]
         return JsonResponse({'text': '\n'.join(msg)})
 
@@ -74,7 +77,12 @@ class FireCARESSlack(View):
             return JsonResponse({'text': 'Missing argument.'}, status=400)
 
         departments = FireDepartment.objects.filter(id__in=self.command_args)
-        departments.update(archived=True)
+        # bump modified so the department is dropped from its quartile view on the next refresh
+        departments.update(archived=True, modified=timezone.now())
+        invalidate_similar_departments()
+        invalidate_department_features()
+        # the update does not send the signals which mark the cached tiles drawing the departments stale
+        invalidate_vector_tiles(vector_tile_extents(FireDepartment, [department.id for department in departments]))
         msg = ['{index}. <https://firecares.org{url}|{name}> has been archived.'.format(index=n + 1, name=department.name, url=department.get_absolute_url()) for n, department in enumerate(departments)]
         return JsonResponse({'text': '\n'.join(msg)})
 
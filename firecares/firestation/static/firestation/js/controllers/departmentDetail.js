@@ -42,7 +42,7 @@
 
                     layersControl.addOverlay(stationLayer, 'Fire Stations');
 
-                    if (config.geom === null) {
+                    if (config.bounds === null) {
                         departmentMap.fitBounds(stationLayer.getBounds(), fitBoundsOptions);
                     }
                 }
@@ -55,12 +55,12 @@
             layersControl.addOverlay(headquarters, 'Headquarters Location');
         }
 
-        if (config.geom != null) {
-            countyBoundary = L.geoJson(config.geom, {
+        if (config.bounds != null) {
+            departmentMap.fitBounds(config.bounds, fitBoundsOptions);
+            countyBoundary = map.simplifiedGeoJson(departmentMap, config.geomUrl, {
                 style: function(feature) { return {color: '#0074D9', fillOpacity: .05, opacity: .8, weight: 2}; }
             }).addTo(departmentMap);
             layersControl.addOverlay(countyBoundary, 'Jurisdiction Boundary');
-            departmentMap.fitBounds(countyBoundary.getBounds(), fitBoundsOptions);
         } else {
             departmentMap.setView(config.centroid, 13);
         }
@@ -41,7 +41,8 @@
       $scope.forms = data;
     });
 
-    var map = map.initMap('map', {scrollWheelZoom: false});
+    var mapService = map;
+    var map = mapService.initMap('map', {scrollWheelZoom: false});
     var stationIcon = L.FireCARESMarkers.firestationmarker();
     var headquartersIcon = L.FireCARESMarkers.headquartersmarker();
     var layersControl = L.control.layers().addTo(map);
@@ -84,15 +85,15 @@
 
     layersControl.addOverlay(serviceArea, 'Service area');
 
-    if (config.district) {
-      var district = L.geoJson(config.district, {
+    if (config.districtBounds) {
+      map.fitBounds(config.districtBounds);
+      map.setView(stationGeom);
+      var district = mapService.simplifiedGeoJson(map, config.districtUrl, {
         style: function (feature) {
           return {color: '#0074D9', fillOpacity: .05, opacity:.8, weight:2};
         }
       }).addTo(map);
       layersControl.addOverlay(district, 'District');
-      map.fitBounds(district.getBounds());
-      map.setView(stationGeom);
     }
     else {
       map.setView(stationGeom, 15);
@@ -4,7 +4,8 @@
     angular.module('fireStation.mapService', [])
 
     .provider('map', function() {
-        this.$get = function($rootScope) {
+        this.$get = function($rootScope, $http) {
+          this.$http = $http;
           return this;
         };
 
@@ -35,7 +36,50 @@
             this.addBaseLayers(map);
             return map;
 
-        }
+        };
+
+        // Returns a GeoJSON layer with the geometry at url simplified for the zoom of the map, the geometry is
+        // loaded again when the map is zoomed out of the levels it is rendered at.
+        this.simplifiedGeoJson = function(map, url, options) {
+            var $http = this.$http;
+            var layer = L.geoJson(null, options);
+            var minZoom = null;
+            var maxZoom = null;
+            var loadingZoom = null;
+
+            function load() {
+                var zoom = map.getZoom();
+
+                if ((minZoom !== null && zoom >= minZoom && (maxZoom === null || zoom <= maxZoom)) || zoom === loadingZoom) {
+                    return;
+                }
+
+                loadingZoom = zoom;
+                $http.get(url, {params: {zoom: zoom}, cache: true}).then(function(response) {
+                    // a response for an earlier zoom is dropped
+                    if (zoom !== loadingZoom) {
+                        return;
+                    }
+
+                    loadingZoom = null;
+                    minZoom = response.data.properties.min_zoom;
+                    maxZoom = response.data.properties.max_zoom;
+                    layer.clearLayers();
+                    layer.addData(response.data);
+                });
+            }
+
+            layer.on('add', function() {
+                map.on('zoomend', load);
+                load();
+            });
+
+            layer.on('remove', function() {
+                map.off('zoomend', load);
+            });
+
+            return layer;
+        };
   });
 
 
@@ -67,12 +67,43 @@ def abbreviatedintword(value):
 def url_replace(request, field, value):
     """
     Replaces or creates a GET parameter in a URL.
+
+    Keyset pagination cursors are dropped, they only apply to the page they were created on.
     """
     dict_ = request.GET.copy()
+    dict_.pop('after', None)
+    dict_.pop('before', None)
     dict_[field] = value
     return dict_.urlencode()
 
 
+@register.simple_tag
+def url_filter(request, field, *values):
+    """
+    Replaces or creates a GET filter parameter in a URL, starting over from the first page of results.
+
+    Several values are joined by commas, as the min and max values of range filters are.
+    """
+    dict_ = request.GET.copy()
+    for param in ['after', 'before', 'page']:
+        dict_.pop(param, None)
+    dict_[field] = ','.join(str(value) for value in values)
+    return dict_.urlencode()
+
+
+@register.simple_tag
+def url_seek(request, page, direction, cursor):
+    """
+    Creates the GET parameters of a page sought after (or before) a keyset pagination cursor.
+    """
+    dict_ = request.GET.copy()
+    dict_.pop('after', None)
+    dict_.pop('before', None)
+    dict_['page'] = page
+    dict_[direction] = cursor
+    return dict_.urlencode()
+
+
 @register.filter(is_safe=False)
 def risk_level(value):
     """
@@ -1,29 +1,49 @@
+import contextlib
+import csv
 import json
 import os
 import requests
 import string
+import tempfile
+import time
 from .forms import StaffingForm
-from .models import FireDepartment, FireStation, Staffing, PopulationClass9Quartile, IntersectingDepartmentLog
+from .models import (FireDepartment, FireStation, Staffing, PopulationClass9Quartile, IntersectingDepartmentLog,
+                     DepartmentReportCard, NationalQuartile, NFIRSStatistic, PopulationClassBreaks,
+                     QuartileViewRefresh, SearchIndexSync, SimplifiedGeometry, create_quartile_views,
+                     dirty_population_classes, population_class_breaks, refresh_quartile_views, search_departments,
+                     set_geometries_from_government_units, suggest_departments)
 from django.db import connections
 from django.test import TestCase, override_settings
 from django.test.client import Client
 from django.conf import settings
 from django.core import mail
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.core.management import call_command
+from django.core.management import call_command, load_command_class
 from django.core.urlresolvers import reverse, resolve
 from django.contrib.gis.geos import Point, Polygon, MultiPolygon
 from django.contrib.auth import get_user_model
+from django.utils import dateformat
 from firecares.usgs.models import UnincorporatedPlace, MinorCivilDivision
 from firecares.firecares_core.models import Address, Country
 from firecares.firestation.models import Document
 from firecares.firestation.templatetags.firecares import quartile_text, risk_level
 from firecares.firestation.managers import CalculationsQuerySet
+from firecares.firestation.peers import DepartmentFeaturesIndex, peer_statistics
+from firecares.firestation.tiles import (invalidate_vector_tiles, tile_range, tile_version_key, vector_tile_extents,
+                                         vector_tiles_version)
 from urlparse import urlsplit, urlunsplit
 from reversion.models import Revision
 from reversion import revisions as reversion
 from firecares.importers import GeoDjangoImport
+from firecares.utils import LRUCache, bulk_update
 from firecares.tasks.quality_control import test_all_departments_urls
+from firecares.tasks.update import (FIRE_SPREAD_CATEGORIES, QUARTILE_VIEWS_REFRESH_DEADLINE_KEY,
+                                    QUARTILE_VIEWS_REFRESH_DUE_KEY, refresh_nfirs_summary, residential_fire_spread,
+                                    sample_dist_scores, schedule_quartile_views_refresh, update_nfirs_counts,
+                                    update_nfirs_counts_batch, update_performance_score, update_performance_scores)
+from firecares.utils import dictfetchall
+from fire_risk.backends.queries import RESIDENTIAL_FIRES_BY_FDID_STATE
 from favit.models import Favorite
 
 User = get_user_model()
@@ -511,6 +531,209 @@ class FireStationTests(TestCase):
         response = c.get(fd_archived.get_absolute_url())
         self.assertEqual(response.status_code, 200)
 
+    def test_department_report_card(self):
+        """
+        Tests the department report card view is populated when the quartile views are refreshed.
+        """
+        departments = []
+
+        for n in range(8):
+            departments.append(FireDepartment.objects.create(name='Report card {0}'.format(n),
+                                                             population=0,
+                                                             population_class=9,
+                                                             dist_model_score=n * 10,
+                                                             department_type='test'))
+
+        create_quartile_views(None)
+
+        # without NFIRS statistics every department shares the same residential fires risk category
+        report_card = DepartmentReportCard.objects.get(id=departments[-1].id)
+        self.assertEqual(report_card.dist_model_residential_fires_quartile, 4)
+        self.assertEqual(report_card.dist_model_residential_fires_quartile_avg, 2.5)
+        self.assertEqual(report_card.dist_model_residential_fires_quartile_breaks, [10, 30, 50, 70])
+
+        c = Client()
+        c.login(**{'username': 'admin', 'password': 'admin'})
+        response = c.get(departments[0].get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['dist_model_residential_fires_quartile'], 1)
+        self.assertEqual(response.context['dist_model_residential_fires_quartile_breaks'], [10, 30, 50, 70])
+
+    def test_national_quartiles(self):
+        """
+        Tests the national risk band view is populated when the quartile views are refreshed.
+        """
+        departments = []
+
+        for n in range(16):
+            departments.append(FireDepartment.objects.create(name='National {0}'.format(n),
+                                                             population=0,
+                                                             population_class=9,
+                                                             dist_model_score=n,
+                                                             risk_model_deaths=n + 1,
+                                                             department_type='test'))
+
+        create_quartile_views(None)
+
+        national = NationalQuartile.objects.get(id=departments[-1].id)
+        self.assertEqual(national.national_risk_model_deaths_injuries_sum_quartile, 4)
+        self.assertIsNone(national.national_risk_model_size1_percent_size2_percent_sum_quartile)
+
+        c = Client()
+        c.login(**{'username': 'admin', 'password': 'admin'})
+        response = c.get(departments[0].get_absolute_url())
+        self.assertEqual(response.context['national_risk_model_deaths_injuries_sum_quartile'], 1)
+
+    def test_quartile_view_refresh(self):
+        """
+        Tests that only population classes with modified departments are refreshed.
+        """
+        fd = FireDepartment.objects.create(name='Refresh', population=0, population_class=9, department_type='test')
+        create_quartile_views(None)
+        self.assertEqual(dirty_population_classes(), [])
+        generation = QuartileViewRefresh.objects.get(population_class=9).generation
+
+        fd.dist_model_score = 10
+        fd.save()
+        self.assertEqual(dirty_population_classes(), [9])
+        self.assertEqual(refresh_quartile_views(), [9])
+        self.assertEqual(PopulationClass9Quartile.objects.get(id=fd.id).dist_model_score, 10)
+        self.assertEqual(QuartileViewRefresh.objects.get(population_class=9).generation, generation + 1)
+
+        # moving a department to another class dirties both classes
+        fd.population_class = 8
+        fd.save()
+        self.assertEqual(dirty_population_classes(), [8, 9])
+        refresh_quartile_views()
+        self.assertFalse(PopulationClass9Quartile.objects.filter(id=fd.id).exists())
+        self.assertEqual(dirty_population_classes(), [])
+
+        # a refresh pushed back by steady updates still runs by the deadline of the first update
+        fd.population_class = 9
+        fd.save()
+        deadline = time.time() + 10
+        cache.set(QUARTILE_VIEWS_REFRESH_DEADLINE_KEY, deadline)
+        schedule_quartile_views_refresh(countdown=60 * 5)
+        self.assertLessEqual(cache.get(QUARTILE_VIEWS_REFRESH_DUE_KEY), deadline)
+        self.assertIsNone(cache.get(QUARTILE_VIEWS_REFRESH_DEADLINE_KEY))
+        self.assertEqual(dirty_population_classes(), [])
+
+    def test_bulk_update(self):
+        """
+        Tests updating many departments with a single statement.
+        """
+        fd1 = FireDepartment.objects.create(name='Bulk 1', dist_model_score=1)
+        fd2 = FireDepartment.objects.create(name='Bulk 2', dist_model_score=2)
+        modified = FireDepartment.objects.get(id=fd1.id).modified
+
+        self.assertEqual(bulk_update(FireDepartment, [(fd1.id, 10), (fd2.id, None)], ['dist_model_score']), 2)
+        fd1 = FireDepartment.objects.get(id=fd1.id)
+        self.assertEqual(fd1.dist_model_score, 10)
+        self.assertGreater(fd1.modified, modified)
+        self.assertIsNone(FireDepartment.objects.get(id=fd2.id).dist_model_score)
+        self.assertEqual(bulk_update(FireDepartment, [], ['dist_model_score']), 0)
+
+    def test_peer_statistics(self):
+        """
+        Tests the in-memory peer statistics match the quartile views.
+        """
+        for n in range(10):
+            FireDepartment.objects.create(name='Peer {0}'.format(n), population=0, population_class=9,
+                                          dist_model_score=n * 10, state='CA' if n % 2 else 'TX',
+                                          region='West' if n % 2 else 'South')
+
+        refresh_quartile_views()
+        peers = peer_statistics()
+        self.assertIs(peers, peer_statistics())
+
+        for row in PopulationClass9Quartile.objects.all():
+            self.assertEqual(peers.ntile('dist_model_score', row.dist_model_score, population_class=9),
+                             row.dist_model_score_quartile)
+
+        self.assertEqual(peers.breaks('dist_model_score', population_class=9), [20, 50, 70, 90])
+        self.assertEqual(peers.breaks('dist_model_score', group_by='dist_model_score_quartile', population_class=9),
+                         [20, 50, 70, 90])
+        self.assertEqual(peers.breaks('dist_model_score', region='West'), [30, 50, 70, 90])
+        self.assertEqual(peers.percent_rank('dist_model_score', 45, population_class=9), 5 / 9.0)
+        self.assertEqual(peers.stats('dist_model_score', region='South'),
+                         {'dist_model_score__min': 0, 'dist_model_score__max': 80, 'dist_model_score__avg': 40})
+        self.assertEqual(sum(peers.histogram('dist_model_score', bins=5)[0]), 10)
+
+        # refreshing the quartile views reloads the statistics
+        FireDepartment.objects.create(name='Peer 10', population=0, population_class=9, dist_model_score=100)
+        refresh_quartile_views()
+        self.assertIsNot(peers, peer_statistics())
+        self.assertEqual(peer_statistics().stats('dist_model_score', population_class=9)['dist_model_score__max'], 100)
+
+    def test_department_page_cache(self):
+        """
+        Tests the department page's statistics are cached until the department or its statistics change.
+        """
+        fd = FireDepartment.objects.create(name='Cached', population=0, population_class=9, dist_model_score=10)
+        refresh_quartile_views()
+
+        c = Client()
+        c.login(**{'username': 'admin', 'password': 'admin'})
+        response = c.get(fd.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+
+        version = response.context['page_cache_version']
+        self.assertEqual(version, FireDepartment.objects.get(id=fd.id).page_cache_version)
+        self.assertIn('population_stats', cache.get('department_{0}_context_{1}'.format(fd.id, version)))
+
+        NFIRSStatistic.objects.create(fire_department=fd, metric='residential_structure_fires', year=2015, count=1)
+        nfirs_version = FireDepartment.objects.get(id=fd.id).page_cache_version
+        self.assertNotEqual(version, nfirs_version)
+
+        refresh_quartile_views()
+        self.assertNotEqual(nfirs_version, FireDepartment.objects.get(id=fd.id).page_cache_version)
+
+        fd = FireDepartment.objects.get(id=fd.id)
+        fd.save()
+        self.assertNotEqual(nfirs_version, FireDepartment.objects.get(id=fd.id).page_cache_version)
+
+        # moving the headquarters shows on the page without changing the department
+        us = Country.objects.create(iso_code='US', name='United States')
+        fd.headquarters_address = Address.objects.create(address_line1='Test', country=us, geom=Point(-77.1, 38.9))
+        fd.save()
+        c.get(fd.get_absolute_url())
+        Address.objects.filter(id=fd.headquarters_address.id).update(geom=Point(-77.5, 38.5))
+        response = c.get(fd.get_absolute_url())
+        self.assertContains(response, 'config.centroid = [38.5, -77.5];')
+
+    def test_population_class_breaks(self):
+        """
+        Tests the bullet chart breaks are computed for each population class when the quartile views are refreshed.
+        """
+        departments = []
+
+        for n in range(1, 9):
+            fd = FireDepartment.objects.create(name='Breaks {0}'.format(n), population=0, population_class=9,
+                                               risk_model_deaths=n)
+            NFIRSStatistic.objects.create(fire_department=fd, metric='residential_structure_fires', year=2015,
+                                          count=n)
+            departments.append(fd)
+
+        refresh_quartile_views()
+
+        breaks = PopulationClassBreaks.objects.get(population_class=9)
+        self.assertEqual(breaks.residential_fires_avg_3_years_breaks, [2, 4, 6, 8])
+        self.assertEqual(breaks.risk_model_deaths_injuries_sum_breaks, [2, 4, 6, 8])
+        self.assertIsNone(breaks.risk_model_size1_percent_size2_percent_sum_breaks)
+        self.assertEqual(population_class_breaks()[9].as_context(),
+                         {'residential_fires_avg_3_years_breaks': [2, 4, 6, 8],
+                          'risk_model_greater_than_size_2_breaks': [],
+                          'risk_model_deaths_injuries_breaks': [2, 4, 6, 8]})
+
+        c = Client()
+        c.login(**{'username': 'admin', 'password': 'admin'})
+        response = c.get(departments[0].get_absolute_url())
+        self.assertEqual(response.context['risk_model_deaths_injuries_breaks'], [2, 4, 6, 8])
+
+        response = c.get(reverse('api_dispatch_detail', args=[self.current_api_version, 'population-class-breaks', 9]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['residential_fires_avg_3_years_breaks'], [2, 4, 6, 8])
+
     def test_quartile_text(self):
         """
         Tests the quartile text template tag.
@@ -625,6 +848,43 @@ class FireStationTests(TestCase):
         self.assertTrue(lafd in results)
         self.assertTrue(rfd in results)
 
+    def test_ranked_department_search(self):
+        """
+        Tests ranked full text search and the department name search used by the autocomplete.
+        """
+        lafd = FireDepartment.objects.create(name='Los Angeles', population=0, population_class=9, state='CA')
+        lacfd = FireDepartment.objects.create(name='Los Angeles County Los Angeles', population=0,
+                                              population_class=9, state='CA')
+        FireDepartment.objects.create(name='Richmond', population=0, population_class=9, state='VA')
+        archived = FireDepartment.objects.create(name='Los Angeles', population=0, population_class=9, state='CA',
+                                                 archived=True)
+
+        results = list(FireDepartment.objects.all().ranked_full_text_search('Los Angeles'))
+        self.assertEqual(results[0], lacfd)
+        self.assertEqual(len(FireDepartment.objects.all().ranked_full_text_search('Los Angeles', limit=1)), 1)
+
+        cache.clear()
+        self.assertEqual(search_departments('Los Angeles'), [lacfd, lafd])
+        self.assertNotIn(archived, search_departments('Los Angeles'))
+
+        # non-ASCII terms are hashed the same way whether they are given as byte or unicode strings
+        self.assertEqual(search_departments('Pe\xc3\xb1asco'), [])
+        self.assertEqual(search_departments(u'Pe\xf1asco'), [])
+
+        results = list(FireDepartment.objects.filter(archived=False).name_search('angeles'))
+        self.assertEqual(results, [lafd, lacfd])
+        self.assertEqual(list(FireDepartment.objects.all().name_search('county')), [lacfd])
+        self.assertEqual(list(FireDepartment.objects.all().name_search('los%')), [])
+
+        hot_queries = LRUCache(maxsize=2)
+        hot_queries.set('a', 1)
+        hot_queries.set('b', 2)
+        hot_queries.get('a')
+        hot_queries.set('c', 3)
+        self.assertEqual(hot_queries.get('a'), 1)
+        self.assertIsNone(hot_queries.get('b'))
+        self.assertEqual(hot_queries.get('c'), 3)
+
     def test_sanitize_fts_term(self):
         """
         Tests the logic to sanitize full text search terms.
@@ -711,12 +971,93 @@ class FireStationTests(TestCase):
         response = c.get('/departments?fdid=&state=&name=adak&region=&population=wer0+%2C+9818605&q=&dist_model_score=we0+%2C+458&sortBy=&limit=0')
         self.assertTrue(fd in response.context['object_list'])
 
+    def test_department_list_keyset_pagination(self):
+        """
+        Tests seeking through the department list matches offset pagination and counts are cached.
+        """
+        for n, population in enumerate([500, None, 100, 300, None, 300, 200]):
+            FireDepartment.objects.create(name='Keyset {0}'.format(n), population=population, dist_model_score=n)
+
+        c = Client()
+        c.login(**{'username': 'admin', 'password': 'admin'})
+
+        for sort_by in ['', 'population', '-dist_model_score', 'name']:
+            params = {'name': 'keyset', 'limit': 2, 'sortBy': sort_by}
+            expected = []
+
+            for page in range(1, 5):
+                params['page'] = page
+                expected.extend(c.get(reverse('firedepartment_list'), params).context['object_list'])
+
+            self.assertEqual(len(expected), 7)
+            self.assertEqual(len(set(expected)), 7)
+
+            # page forwards with the next page cursors
+            params['page'] = 1
+            response = c.get(reverse('firedepartment_list'), params)
+            seen = list(response.context['object_list'])
+
+            while 'next_page_cursor' in response.context:
+                params.update(page=response.context['page_obj'].next_page_number(),
+                              after=response.context['next_page_cursor'])
+                response = c.get(reverse('firedepartment_list'), params)
+                seen.extend(response.context['object_list'])
+
+            self.assertEqual(seen, expected)
+            self.assertEqual(response.context['departments_total_count'], 7)
+
+            # and back with the previous page cursors
+            params.pop('after')
+            params.update(page=3, before=response.context['previous_page_cursor'])
+            response = c.get(reverse('firedepartment_list'), params)
+            self.assertEqual(list(response.context['object_list']), expected[4:6])
+            params.pop('before')
+
+        # the filtered count is cached for a short time
+        FireDepartment.objects.create(name='Keyset 7')
+        response = c.get(reverse('firedepartment_list'), {'name': 'keyset', 'sortBy': 'name'})
+        self.assertEqual(response.context['departments_total_count'], 7)
+
+        response = c.get(reverse('firedepartment_list'), {'name': 'keyset', 'page': 99})
+        self.assertEqual(response.status_code, 404)
+
+    def test_department_list_facets(self):
+        """
+        Tests facet counts of the filtered departments in the list view and API.
+        """
+        FireDepartment.objects.create(name='Facet 1', state='CA', region='West', population=0, population_class=9,
+                                      dist_model_score=10)
+        FireDepartment.objects.create(name='Facet 2', state='CA', region='West', population=0, population_class=9,
+                                      dist_model_score=60)
+        FireDepartment.objects.create(name='Facet 3', state='VA', region='South', population=0, population_class=1,
+                                      dist_model_score=75)
+        FireDepartment.objects.create(name='Facet 4', state='TX', region='South')
+
+        facets = FireDepartment.objects.filter(name__startswith='Facet').facet_counts()
+        self.assertEqual(facets['state'], [('CA', 2), ('TX', 1), ('VA', 1)])
+        self.assertEqual(facets['region'], [('South', 2), ('West', 2)])
+        self.assertEqual(facets['population_class'], [(1, 1), (9, 2), (None, 1)])
+        self.assertEqual(facets['dist_model_score'], [(0, 1), (50, 2), (None, 1)])
+
+        c = Client()
+        c.login(**{'username': 'admin', 'password': 'admin'})
+        response = c.get(reverse('firedepartment_list'), {'name': 'facet', 'state': 'CA', 'facets': 'true'})
+        self.assertEqual(response.context['facets']['dist_model_score'], [(0, 1), (50, 1)])
+        self.assertContains(response, 'dist_model_score=50%2C99')
+        self.assertContains(response, 'Class 9 (2)')
+        self.assertNotIn('facets', c.get(reverse('firedepartment_list'), {'name': 'facet'}).context)
+
+        response = c.get(reverse('api_dispatch_list', args=[self.current_api_version, 'fire-departments']),
+                         {'state': 'CA', 'facets': 'true'})
+        self.assertEqual(json.loads(response.content)['meta']['facets']['population_class'], [[9, 2]])
+
     def test_similar_list_view(self):
         """
         Tests the similar departments list view.
         """
         fd = FireDepartment.objects.create(name='Adak Volunteer Fire Department', population=5000)
         blueFD = FireDepartment.objects.create(name='Blue Volunteer Fire Department', population=5100)
+        farther = FireDepartment.objects.create(name='Farther Volunteer Fire Department', population=5400)
         unrelated = FireDepartment.objects.create(name='Unrelated Fire Department', population=15000000)
 
         c = Client()
@@ -728,9 +1069,190 @@ class FireStationTests(TestCase):
         self.assertTrue(unrelated not in response.context['object_list'])
         self.assertEqual(response.status_code, 200)
 
+        # departments nearest in population are listed first
+        self.assertEqual(list(response.context['object_list']), [blueFD, farther])
+
         response = c.get(reverse('similar_departments', args=[123]))
         self.assertEqual(response.status_code, 404)
 
+    def test_nearest_departments(self):
+        """
+        Tests looking up the departments nearest in population in the similar departments index.
+        """
+        fd = FireDepartment.objects.create(name='Test', population=30000, state='CA', region='West')
+        near = FireDepartment.objects.create(name='Near', population=31000, state='CA', region='West')
+        nearer = FireDepartment.objects.create(name='Nearer', population=29500, state='CA', region='West')
+        far = FireDepartment.objects.create(name='Far', population=45000, state='CA', region='West')
+        FireDepartment.objects.create(name='Other region', population=30000, state='TX', region='South')
+        FireDepartment.objects.create(name='Other class', population=60000, state='CA', region='West')
+        FireDepartment.objects.create(name='Archived', population=30000, state='CA', region='West', archived=True)
+
+        self.assertEqual(fd.get_population_class(), 4)
+        self.assertEqual(fd.nearest_departments(), [nearer, near, far])
+        self.assertEqual(fd.nearest_departments(limit=2), [nearer, near])
+        self.assertEqual(set(fd.similar_departments), set([nearer, near, far]))
+
+        # the index is rebuilt when a department's population changes
+        far.population = 29900
+        far.save()
+        self.assertEqual(fd.nearest_departments(), [far, nearer, near])
+
+        far.delete()
+        self.assertEqual(fd.nearest_departments(), [nearer, near])
+
+    def test_suggest_departments(self):
+        """
+        Tests suggesting departments for many stations at once.
+        """
+        us = Country.objects.create(iso_code='US', name='United States')
+
+        def create_department(name, x, y):
+            address = Address.objects.create(address_line1='Test', country=us, geom=Point(x, y))
+            return FireDepartment.objects.create(name=name, headquarters_address=address)
+
+        arlington = create_department('Arlington County Fire Department', -77.10, 38.88)
+        fairfax = create_department('Fairfax County Fire and Rescue', -77.20, 38.85)
+        create_department('Los Angeles Fire Department', -118.24, 34.05)
+
+        station = FireStation.objects.create(name='Arlington County Station 4', geom=Point(-77.11, 38.87))
+        other = FireStation.objects.create(name='Fairfax Station 10', geom=Point(-77.19, 38.86))
+        remote = FireStation.objects.create(name='Remote Station', geom=Point(-100, 45))
+
+        suggestions = suggest_departments([station, other, remote], limit=2)
+        self.assertEqual(suggestions[station.id], [arlington, fairfax])
+        self.assertEqual(suggestions[other.id][0], fairfax)
+        self.assertEqual(suggestions[remote.id], [])
+        self.assertTrue(suggestions[station.id][0].department_score > suggestions[station.id][1].department_score)
+
+        # every department within the radius is scored, not only the nearest ones
+        self.assertEqual(suggest_departments([station], candidates=1)[station.id], [arlington])
+        self.assertIn(fairfax, suggest_departments([station])[station.id])
+
+        # suggestions are memoized on the station
+        with self.assertNumQueries(0):
+            self.assertEqual(station.suggested_departments(), [arlington, fairfax])
+
+        # unattended mode only assigns confident matches
+        review_csv = os.path.join(tempfile.mkdtemp(), 'review.csv')
+        call_command('set_departments', auto=True, workers=1, limit=0, min_score=100, min_margin=5,
+                     review_csv=review_csv, stdout=open(os.devnull, 'w'))
+
+        self.assertEqual(FireStation.objects.get(id=station.id).department, arlington)
+        self.assertEqual(FireStation.objects.get(id=other.id).department, fairfax)
+        self.assertIsNone(FireStation.objects.get(id=remote.id).department)
+
+        with open(review_csv) as review:
+            rows = list(csv.DictReader(review))
+
+        self.assertEqual([(row['station_id'], row['reason']) for row in rows], [(str(remote.id), 'no suggestions')])
+
+    def test_match_districts(self):
+        """
+        Tests matching district polygons to the nearest station within them.
+        """
+        first = FireStation.objects.create(name='Station 1', state='VA', geom=Point(-77.01, 38.01))
+        second = FireStation.objects.create(name='Station 2', state='VA', geom=Point(-77.095, 38.095))
+        assigned = FireStation.objects.create(name='Station 3', state='VA', geom=Point(-76.5, 38.5),
+                                              district=MultiPolygon(Point(-76.5, 38.5).buffer(.1)))
+        other_state = FireStation.objects.create(name='Station 4', state='MD', geom=Point(-75.5, 38.5))
+
+        districts = [Polygon.from_bbox((-77.1, 38.0, -77.0, 38.1)), Polygon.from_bbox((-76.6, 38.4, -76.4, 38.6)),
+                     Polygon.from_bbox((-75.6, 38.4, -75.4, 38.6))]
+        path = os.path.join(tempfile.mkdtemp(), 'us-va-test-districts.geojson')
+
+        with open(path, 'w') as geojson:
+            json.dump({'type': 'FeatureCollection',
+                       'features': [{'type': 'Feature', 'properties': {}, 'geometry': json.loads(district.json)}
+                                    for district in districts]}, geojson)
+
+        call_command('match_districts', path)
+
+        # the first district's centroid is nearest the first station, the second station has no district of its own
+        self.assertEqual(FireStation.objects.get(id=first.id).district, MultiPolygon(districts[0], srid=4326))
+        self.assertIsNone(FireStation.objects.get(id=second.id).district)
+        self.assertEqual(FireStation.objects.get(id=assigned.id).district, assigned.district)
+        self.assertIsNone(FireStation.objects.get(id=other_state.id).district)
+
+    def test_load_districts(self):
+        """
+        Tests bulk loading districts from a stand-in for the MongoDB fire districts collection.
+        """
+        fd = FireDepartment.objects.create(name='Test')
+        inside = FireStation.objects.create(name='Inside', department=fd, geom=Point(-77.05, 38.05))
+        overlapping = FireStation.objects.create(name='Overlapping', department=fd, geom=Point(-77.15, 38.05))
+        outside = FireStation.objects.create(name='Outside', department=fd, geom=Point(-76, 38))
+        unassigned = FireStation.objects.create(name='Unassigned', geom=Point(-77.05, 38.05))
+
+        district = Polygon.from_bbox((-77.1, 38.0, -77.0, 38.1))
+        features = [{'feature': {'geometry': json.loads(geom.json)}}
+                    for geom in [district, Polygon.from_bbox((-77.2, 38.0, -77.12, 38.1)),
+                                 Polygon.from_bbox((-77.18, 38.0, -77.1, 38.1))]]
+
+        class FireDistrictsStandIn(object):
+            queries = []
+
+            def find(self, query, projection=None):
+                self.queries.append(query)
+                return features
+
+            def close(self):
+                pass
+
+        command = load_command_class('firecares.firestation', 'load-districts')
+        command.fire_districts = lambda **options: contextlib.closing(FireDistrictsStandIn())
+        command.stdout = open(os.devnull, 'w')
+        command.handle(department=[fd.id])
+
+        # one query per department
+        self.assertEqual(len(FireDistrictsStandIn.queries), 1)
+        self.assertEqual(FireStation.objects.get(id=inside.id).district, MultiPolygon(district, srid=4326))
+        self.assertIsNone(FireStation.objects.get(id=overlapping.id).district)
+        self.assertIsNone(FireStation.objects.get(id=outside.id).district)
+        self.assertIsNone(FireStation.objects.get(id=unassigned.id).district)
+
+    def test_similar_departments_by_features(self):
+        """
+        Tests the multi-metric similarity search over department feature vectors.
+        """
+        fd = FireDepartment.objects.create(name='Test', population=30000, risk_model_fires=20, dist_model_score=10,
+                                           department_type='Career')
+        twin = FireDepartment.objects.create(name='Twin', population=32000, risk_model_fires=21,
+                                             dist_model_score=11, department_type='Career')
+        volunteer = FireDepartment.objects.create(name='Volunteer', population=31000, risk_model_fires=20,
+                                                  dist_model_score=10, department_type='Volunteer')
+        large = FireDepartment.objects.create(name='Large', population=3000000, risk_model_fires=4000,
+                                              dist_model_score=40, department_type='Career')
+        FireDepartment.objects.create(name='Archived', population=30000, risk_model_fires=20, dist_model_score=10,
+                                      department_type='Career', archived=True)
+
+        index = DepartmentFeaturesIndex.load()
+        self.assertEqual(index.nearest(fd, k=3), [twin.id, volunteer.id, large.id])
+        self.assertEqual(index.nearest(fd, k=1), [twin.id])
+
+        # changed departments are applied without rebuilding the tree
+        volunteer.department_type = 'Career'
+        volunteer.population = 30000
+        volunteer.save()
+        index.refresh('changed')
+        self.assertEqual(index.nearest(fd, k=2), [volunteer.id, twin.id])
+        self.assertEqual(len(index.ids), 4)
+
+        self.assertIn(volunteer, fd.similar_departments_by_features(k=3))
+
+        c = Client()
+        c.login(**{'username': 'admin', 'password': 'admin'})
+        response = c.get(reverse('similar_departments', args=[fd.id]), {'similarity': 'features'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(twin, response.context['object_list'])
+        self.assertNotIn(fd, response.context['object_list'])
+
+        # departments are listed most similar first rather than by population
+        similar = fd.similar_departments_by_features(k=90)
+        self.assertEqual(list(response.context['object_list']), similar)
+        self.assertEqual(similar[-1], large)
+        positions = [response.content.index('href="{0}"'.format(department.get_absolute_url())) for department in similar]
+        self.assertEqual(positions, sorted(positions))
+
     def test_update_government_unit_associations(self):
         """
         Tests functionality associated with updating a FireDepartment's associated government units
@@ -775,6 +1297,205 @@ class FireStationTests(TestCase):
         response = c.post(reverse('firedepartment_update_government_units', args=[fd_null_geom.pk]), {'minor_civil_divisions': [div2.pk], 'update_geom': [1]})
         self.assertRedirects(response, reverse('firedepartment_detail_slug', args=[fd_null_geom.pk, fd_null_geom.slug]), fetch_redirect_response=False)
 
+    def test_set_geometries_from_government_units(self):
+        """
+        Tests building department geometries from government units in Python and in one statement.
+        """
+        call_command('loaddata', 'firecares/firestation/fixtures/test_government_unit_association.json')
+
+        fd = FireDepartment.objects.get(pk=96582)
+        other = FireDepartment.objects.create(name='No government units',
+                                              geom=MultiPolygon(Polygon.from_bbox((-77.1, 38.0, -77.0, 38.1))))
+        div = MinorCivilDivision.objects.get(pk=19336)
+        place = UnincorporatedPlace.objects.get(pk=9254)
+        fd.government_unit.connect(div)
+        fd.government_unit.connect(place)
+
+        fd.set_geometry_from_government_unit()
+        expected = div.geom.union(place.geom)
+        self.assertEqual(fd.geom.geom_type, 'MultiPolygon')
+        self.assertAlmostEqual(fd.geom.area, expected.area, places=6)
+
+        FireDepartment.objects.filter(pk=fd.pk).update(geom=None)
+        call_command('set_department_geometries', departments=[fd.pk], stdout=open(os.devnull, 'w'))
+
+        fd.refresh_from_db()
+        self.assertEqual(fd.geom.geom_type, 'MultiPolygon')
+        self.assertAlmostEqual(fd.geom.area, expected.area, places=6)
+
+        # departments without government units are left alone
+        self.assertEqual(set_geometries_from_government_units(department_ids=[other.pk]), 0)
+        self.assertEqual(FireDepartment.objects.get(pk=other.pk).geom, other.geom)
+
+    def test_geom_area(self):
+        """
+        Tests department and district areas are stored on save and bulk updates, and can be sorted and filtered on.
+        """
+        small = FireDepartment.objects.create(name='Area small', state='ZZ',
+                                              geom=MultiPolygon(Polygon.from_bbox((-77.1, 38.0, -77.0, 38.1))))
+        large = FireDepartment.objects.create(name='Area large', state='ZZ',
+                                              geom=MultiPolygon(Polygon.from_bbox((-77.5, 38.0, -77.0, 38.5))))
+        empty = FireDepartment.objects.create(name='Area empty', state='ZZ')
+
+        small.refresh_from_db()
+        large.refresh_from_db()
+        empty.refresh_from_db()
+
+        # a 0.1 degree square at 38 degrees north is roughly 6.9 by 5.45 miles
+        self.assertAlmostEqual(small.geom_area, 37.6, delta=1)
+        self.assertGreater(large.geom_area, 20 * small.geom_area)
+        self.assertIsNone(empty.geom_area)
+
+        # updates which bypass the model are kept in sync by the database
+        FireDepartment.objects.filter(pk=empty.pk).update(geom=small.geom)
+        self.assertAlmostEqual(FireDepartment.objects.get(pk=empty.pk).geom_area, small.geom_area, places=4)
+
+        FireDepartment.objects.filter(pk=empty.pk).update(geom=None)
+        self.assertIsNone(FireDepartment.objects.get(pk=empty.pk).geom_area)
+
+        station = FireStation.objects.create(station_number=25, name='Area station', department=small,
+                                             geom=Point(-77.05, 38.05), district=small.geom)
+        self.assertAlmostEqual(FireStation.objects.get(pk=station.pk).district_area, small.geom_area, places=4)
+
+        c = Client()
+        c.login(**{'username': 'admin', 'password': 'admin'})
+
+        response = c.get(reverse('firedepartment_list'), {'name': 'area', 'sortBy': '-geom_area'})
+        self.assertEqual(list(response.context['object_list']), [large, small, empty])
+
+        response = c.get(reverse('firedepartment_list'), {'name': 'area', 'geom_area': '100,5000'})
+        self.assertEqual(set(response.context['object_list']), {large})
+
+        # departments without an area only match ranges without a minimum
+        response = c.get(reverse('firedepartment_list'), {'name': 'area', 'geom_area': '0,100'})
+        self.assertEqual(set(response.context['object_list']), {small, empty})
+
+        url = '{0}?format=json&state=ZZ&order_by=geom_area'.format(
+            reverse('api_dispatch_list', args=[self.current_api_version, 'fire-departments']))
+        response = c.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([obj['id'] for obj in json.loads(response.content)['objects']][:2], [small.id, large.id])
+
+    def test_simplified_geometry(self):
+        """
+        Tests department boundaries and station districts are simplified by the database and served by zoom level.
+        """
+        # a circle has enough vertices to be simplified at every level
+        boundary = MultiPolygon(Point(-77.0, 38.0).buffer(0.5, quadsegs=256))
+        fd = FireDepartment.objects.create(name='Simplified', geom=boundary)
+        levels = SimplifiedGeometry.objects.filter(source='department', object_id=fd.id).order_by('max_zoom')
+
+        self.assertEqual([level.max_zoom for level in levels], [8, 11, 14])
+        self.assertEqual([level.precision for level in levels], [3, 4, 5])
+
+        counts = [level.geom.num_coords for level in levels]
+        self.assertEqual(counts, sorted(counts))
+        self.assertLess(counts[-1], boundary.num_coords)
+
+        c = Client()
+        c.login(**{'username': 'admin', 'password': 'admin'})
+        url = reverse('department_boundary_geojson', args=[fd.id])
+
+        response = c.get(url, {'zoom': 5})
+        feature = json.loads(response.content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(feature['properties'], {'min_zoom': 0, 'max_zoom': 8})
+        self.assertEqual(feature['geometry']['type'], 'MultiPolygon')
+        self.assertEqual(sum(len(ring) for polygon in feature['geometry']['coordinates'] for ring in polygon), counts[0])
+
+        self.assertEqual(json.loads(c.get(url, {'zoom': 10}).content)['properties'], {'min_zoom': 9, 'max_zoom': 11})
+        self.assertEqual(json.loads(c.get(url, {'zoom': 'bad'}).content)['properties']['max_zoom'], 8)
+
+        # past the most detailed level the full geometry is returned
+        feature = json.loads(c.get(url, {'zoom': 18}).content)
+        self.assertEqual(feature['properties'], {'min_zoom': 15, 'max_zoom': None})
+        self.assertEqual(sum(len(ring) for polygon in feature['geometry']['coordinates'] for ring in polygon),
+                         boundary.num_coords)
+
+        # levels follow geometry changes made outside of the model
+        FireDepartment.objects.filter(id=fd.id).update(geom=None)
+        self.assertFalse(levels.exists())
+        self.assertEqual(c.get(url, {'zoom': 5}).status_code, 404)
+
+        station = FireStation.objects.create(station_number=25, name='Simplified station', department=fd,
+                                             geom=Point(-77.0, 38.0), district=boundary)
+        self.assertEqual(SimplifiedGeometry.objects.filter(source='district', object_id=station.id).count(), 3)
+
+        response = c.get(reverse('firestation_district_geojson', args=[station.id]), {'zoom': 12})
+        self.assertEqual(json.loads(response.content)['properties'], {'min_zoom': 12, 'max_zoom': 14})
+
+        # the station detail page loads the district instead of embedding it
+        response = c.get(reverse('firestation_detail', args=[station.id]))
+        # the cached district responses are versioned by the station's modification time
+        self.assertContains(response, '{0}?v={1}'.format(reverse('firestation_district_geojson', args=[station.id]),
+                                                         dateformat.format(station.modified, 'U')))
+        self.assertNotContains(response, 'MultiPolygon')
+
+        station_id = station.id
+        station.delete()
+        self.assertFalse(SimplifiedGeometry.objects.filter(source='district', object_id=station_id).exists())
+
+    def test_vector_tiles(self):
+        """
+        Tests department, station and district vector tiles and their invalidation when a department changes.
+        """
+        self.assertEqual(tile_range((-180, -85.06, 180, 85.06), 2), (0, 0, 3, 3))
+        self.assertEqual(tile_range((-77.05, 38.85, -77.0, 38.9), 10), (292, 391, 292, 391))
+        self.assertEqual(tile_version_key(12, 4675, 6270), tile_version_key(8, 292, 391))
+
+        boundary = MultiPolygon(Polygon.from_bbox((-77.05, 38.85, -77.0, 38.9)))
+        fd = FireDepartment.objects.create(name='Tiled department', geom=boundary, population=1000)
+        station = FireStation.objects.create(station_number=25, name='Tiled station', department=fd,
+                                             geom=Point(-77.02, 38.87), district=boundary)
+
+        # bulk updates mark the tiles drawing the updated rows' geometries stale
+        extents = vector_tile_extents(FireStation, [station.id])
+        self.assertEqual(sorted(tuple(round(value, 4) for value in extent) for extent in extents),
+                         [(-77.05, 38.85, -77.0, 38.9), (-77.02, 38.87, -77.02, 38.87)])
+        self.assertEqual(vector_tile_extents(FireDepartment, []), [])
+
+        c = Client()
+        c.login(**{'username': 'admin', 'password': 'admin'})
+
+        def tile(layer, z, x, y):
+            return c.get(reverse('vector_tile', kwargs=dict(layer=layer, z=z, x=x, y=y)))
+
+        response = tile('departments', 10, 292, 391)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        self.assertIn('Tiled department', response.content)
+
+        self.assertIn('Tiled station', tile('stations', 10, 292, 391).content)
+        self.assertIn('Tiled station', tile('districts', 10, 292, 391).content)
+        self.assertNotIn('Tiled department', tile('departments', 10, 293, 391).content)
+
+        # stations and districts are not drawn on national maps
+        self.assertEqual(tile('stations', 3, 2, 3).content, '')
+        self.assertEqual(tile('districts', 3, 2, 3).content, '')
+        self.assertEqual(tile('departments', 10, 1024, 0).status_code, 404)
+
+        # tiles are cached until the department changes
+        FireDepartment.objects.filter(id=fd.id).update(name='Renamed department')
+        self.assertIn('Tiled department', tile('departments', 10, 292, 391).content)
+
+        fd = FireDepartment.objects.get(id=fd.id)
+        fd.geom = MultiPolygon(Polygon.from_bbox((-76.6, 38.85, -76.55, 38.9)))
+        fd.save()
+
+        response = tile('departments', 10, 292, 391)
+        self.assertNotIn('Tiled department', response.content)
+        self.assertNotIn('Renamed department', response.content)
+        self.assertIn('Renamed department', tile('departments', 10, 294, 391).content)
+
+        # tiles which draw a geometry in their buffer are marked stale along with the tiles it lies in
+        extent = (-75.95, 38.85, -75.94, 38.9)
+        xmin, ymin, xmax, ymax = tile_range(extent, 8)
+        self.assertEqual((xmin, xmax), (73, 73))
+        neighbour, distant = vector_tiles_version(8, 74, ymin), vector_tiles_version(8, 76, ymin)
+        invalidate_vector_tiles([extent])
+        self.assertNotEqual(vector_tiles_version(8, 74, ymin), neighbour)
+        self.assertEqual(vector_tiles_version(8, 76, ymin), distant)
+
     def test_robots(self):
         """
         Ensure robots.txt resolves.
@@ -846,7 +1567,7 @@ class FireStationTests(TestCase):
         c = Client()
         c.login(**{'username': 'admin', 'password': 'admin'})
 
-        for route in ['fire-departments', 'staffing', 'firestations']:
+        for route in ['fire-departments', 'staffing', 'firestations', 'population-class-breaks']:
             # Test to ensure that the default route returns JSON vs XML
             resp = c.get(reverse('api_dispatch_list', args=[self.current_api_version, route]))
             self.assertEqual(resp.get('Content-type'), 'application/json')
@@ -1278,3 +1999,212 @@ class FireStationTests(TestCase):
         data['text'] = 'test'
         response = c.post(reverse('slack'), data)
         self.assertEqual(response.status_code, 403)
+
+    def test_departments_to_es(self):
+        """
+        Tests bulk indexing departments against an in-memory Elasticsearch stand-in.
+        """
+        from firecares.firestation.management.commands.departments_to_es import Command
+
+        class ElasticsearchStandIn(object):
+            def __init__(self):
+                self.documents = {}
+                self.requests = 0
+
+            def bulk(self, body):
+                self.requests += 1
+                lines = body.splitlines()
+                items = []
+
+                for action, source in zip(lines[::2], lines[1::2]):
+                    action = json.loads(action)['index']
+                    self.documents[(action['_index'], action['_type'], str(action['_id']))] = json.loads(source)
+                    items.append({'index': {'_id': action['_id'], 'status': 201}})
+
+                return {'errors': False, 'items': items}
+
+        es = ElasticsearchStandIn()
+        command = Command()
+        command.get_client = lambda **options: es
+        options = dict(host='localhost:9200', index='firecares', batch_size=2, workers=2, incremental=True)
+
+        country = Country.objects.create(iso_code='US', name='United States')
+        address = Address.objects.create(address_line1='1 Main St', city='Richmond', state_province='VA',
+                                         postal_code='23220', country=country)
+        rfd = FireDepartment.objects.create(name='Richmond', population=0, state='VA', headquarters_address=address)
+
+        for n in range(4):
+            FireDepartment.objects.create(name='Department {0}'.format(n), population=0, state='VA')
+
+        command.handle(**options)
+        self.assertEqual(es.requests, 3)
+        self.assertEqual(len([key for key in es.documents if key[1] == 'department']), 5)
+        self.assertEqual(es.documents[('firecares', 'department', str(rfd.id))]['country'], 'US')
+        self.assertEqual(len(es.documents), 5)
+        self.assertEqual(SearchIndexSync.objects.get(host='localhost:9200', index='firecares').synced,
+                         Command.get_checkpoint('localhost:9200', 'firecares'))
+
+        # only departments modified since the last sync are reindexed
+        rfd.name = 'Richmond Fire Department'
+        rfd.save()
+        command.handle(**options)
+        self.assertEqual(es.requests, 4)
+        self.assertEqual(es.documents[('firecares', 'department', str(rfd.id))]['name'], 'Richmond Fire Department')
+
+
+class UpdateTaskTests(TestCase):
+    """
+    Tests the NFIRS statistics and performance score updates against incidents loaded into the nfirs database.
+    """
+    multi_db = True
+
+    def setUp(self):
+        cache.clear()
+        self.nfirs = connections['nfirs'].cursor()
+        self.nfirs.execute("""
+            create table buildingfires (state varchar(2), fdid varchar(5), inc_date date, inc_no varchar(7),
+                                        exp_no integer, fire_sprd varchar(1), prop_use varchar(3));
+            create table civiliancasualty (state varchar(2), fdid varchar(5), inc_date date, inc_no varchar(7));
+            create table ffcasualty (state varchar(2), fdid varchar(5), inc_date date, inc_no varchar(7));
+        """)
+
+    def add_building_fires(self, state, fdid, year, fires):
+        """
+        Loads (fire spread, property use, count) building fires of a department and year.
+        """
+        for fire_sprd, prop_use, count in fires:
+            for n in range(count):
+                self.nfirs.execute("insert into buildingfires values (%s, %s, %s, %s, 0, %s, %s)",
+                                   (state, fdid, '{0}-06-01'.format(year), '{0}{1}'.format(fire_sprd, n), fire_sprd,
+                                    prop_use))
+
+    def test_summary_matches_fire_risk(self):
+        """
+        Tests the summarized fire spread counts are the residential fires fire_risk counts.
+        """
+        self.add_building_fires('VA', '11111', 2014, [('1', '419', 5), ('2', '429', 3), ('3', '500', 4),
+                                                      ('5', '400', 2), ('4', '161', 1)])
+        self.add_building_fires('VA', '11111', 2015, [('1', '419', 2), ('2', '900', 6)])
+        self.add_building_fires('VA', '22222', 2015, [('1', '419', 7)])
+
+        # until the summary is built the counts are read from the incident tables
+        unsummarized = residential_fire_spread(self.nfirs, 'VA', ['11111'])['11111']
+        fd = FireDepartment.objects.create(name='Unsummarized', fdid='11111', state='VA')
+        update_nfirs_counts(fd.id)
+        statistics = NFIRSStatistic.objects.filter(fire_department=fd, metric='residential_structure_fires')
+        self.assertEqual(dict(statistics.values_list('year', 'count')), {2014: 15, 2015: 8})
+
+        self.assertEqual(refresh_nfirs_summary(years=[2014, 2015]), [2014, 2015])
+
+        self.nfirs.execute(RESIDENTIAL_FIRES_BY_FDID_STATE, ('11111', 'VA'))
+        expected = dict((category, 0) for category in FIRE_SPREAD_CATEGORIES.values())
+
+        for result in dictfetchall(self.nfirs):
+            if result['fire_sprd'] in FIRE_SPREAD_CATEGORIES:
+                expected[FIRE_SPREAD_CATEGORIES[result['fire_sprd']]] += result['count']
+
+        summary = residential_fire_spread(self.nfirs, 'VA', ['11111'])['11111']
+        self.assertEqual(dict((category, summary[category]) for category in expected), expected)
+        self.assertEqual(expected['object_of_origin'], 7)
+        self.assertEqual(dict((category, unsummarized.get(category, 0)) for category in expected), expected)
+
+        # the residential structure fire statistic counts every building fire
+        self.nfirs.execute("select year, residential_structure_fires from firecares_department_summary "
+                           "where fdid='11111' order by year")
+        self.assertEqual(self.nfirs.fetchall(), [(2014, 15), (2015, 8)])
+
+    def test_batched_scores_match_single_department_scores(self):
+        """
+        Tests batched and single department performance score updates write the same scores.
+        """
+        fires = [('1', '419', 60), ('2', '419', 25), ('3', '429', 10), ('4', '400', 6), ('5', '419', 4),
+                 ('5', '500', 30)]
+        self.add_building_fires('VA', '11111', 2014, fires)
+        self.add_building_fires('VA', '22222', 2014, fires[1:])
+        refresh_nfirs_summary(years=[2014])
+
+        departments = [FireDepartment.objects.create(name='Scored {0}'.format(fdid), fdid=fdid, state='VA')
+                       for fdid in ['11111', '22222']]
+
+        for fd in departments:
+            update_performance_score(fd.id, force=True)
+
+        single = dict(FireDepartment.objects.filter(id__in=[fd.id for fd in departments])
+                      .values_list('id', 'dist_model_score'))
+        FireDepartment.objects.filter(id__in=single.keys()).update(dist_model_score=None, dist_model_inputs_hash=None)
+
+        update_performance_scores('VA', ids=single.keys(), force=True)
+        batched = dict(FireDepartment.objects.filter(id__in=single.keys()).values_list('id', 'dist_model_score'))
+
+        self.assertIsNotNone(single[departments[0].id])
+        self.assertEqual(batched, single)
+
+    def test_sample_dist_scores(self):
+        """
+        Tests seeded DIST sampling gives the same scores in a process pool and in process.
+        """
+        counts = dict(object_of_origin=60, room_of_origin=25, floor_of_origin=10, building_of_origin=6, beyond=4)
+        inputs = [(1, counts), (2, dict(counts, beyond=20)), (3, counts)]
+
+        in_process = sample_dist_scores(inputs, processes=1)
+        pooled = sample_dist_scores(inputs, processes=2)
+
+        self.assertIsNotNone(in_process[1][0])
+        self.assertEqual(dict((id, score) for id, (score, _) in pooled.items()),
+                         dict((id, score) for id, (score, _) in in_process.items()))
+
+    def test_unchanged_departments_are_not_rescored(self):
+        """
+        Tests departments are only rescored when their DIST inputs change.
+        """
+        fires = [('1', '419', 60), ('2', '419', 25), ('3', '429', 10), ('4', '400', 6), ('5', '419', 4)]
+        self.add_building_fires('VA', '11111', 2014, fires)
+        refresh_nfirs_summary(years=[2014])
+
+        fd = FireDepartment.objects.create(name='Fingerprinted', fdid='11111', state='VA')
+        update_performance_score(fd.id)
+        fingerprint = FireDepartment.objects.get(id=fd.id).dist_model_inputs_hash
+        self.assertIsNotNone(fingerprint)
+
+        # the stored score is kept when the inputs are unchanged
+        FireDepartment.objects.filter(id=fd.id).update(dist_model_score=-1)
+        update_performance_score(fd.id)
+        update_performance_scores('VA', ids=[fd.id])
+        self.assertEqual(FireDepartment.objects.get(id=fd.id).dist_model_score, -1)
+
+        self.add_building_fires('VA', '11111', 2015, [('5', '419', 20)])
+        refresh_nfirs_summary(years=[2015])
+        update_performance_score(fd.id)
+
+        fd = FireDepartment.objects.get(id=fd.id)
+        self.assertNotEqual(fd.dist_model_score, -1)
+        self.assertNotEqual(fd.dist_model_inputs_hash, fingerprint)
+
+    def test_nfirs_counts_without_nfirs_years(self):
+        """
+        Tests updating NFIRS statistics is a no-op when no NFIRS years are loaded.
+        """
+        refresh_nfirs_summary()
+        fd = FireDepartment.objects.create(name='No years', fdid='11111', state='VA')
+
+        update_nfirs_counts(fd.id)
+        update_nfirs_counts_batch([fd.id])
+        self.assertFalse(NFIRSStatistic.objects.filter(fire_department=fd).exists())
+
+    def test_nfirs_counts_batch_upsert(self):
+        """
+        Tests updating the NFIRS statistics of departments twice updates the statistics instead of duplicating them.
+        """
+        self.add_building_fires('VA', '11111', 2014, [('1', '419', 3), ('2', '429', 2)])
+        refresh_nfirs_summary(years=[2014])
+        fd = FireDepartment.objects.create(name='Upserted', fdid='11111', state='VA')
+
+        update_nfirs_counts_batch([fd.id], year=2014)
+        self.add_building_fires('VA', '11111', 2014, [('3', '419', 1)])
+        refresh_nfirs_summary(years=[2014])
+        update_nfirs_counts_batch([fd.id], year=2014)
+
+        statistics = NFIRSStatistic.objects.filter(fire_department=fd, year=2014)
+        self.assertEqual(statistics.count(), 3)
+        self.assertEqual(statistics.get(metric='residential_structure_fires').count, 6)
+        self.assertIsNone(statistics.get(metric='civilian_casualties').count)
@@ -0,0 +1,201 @@
+import math
+import uuid
+from collections import namedtuple
+from django.core.cache import cache
+from django.db import connections
+
+# half the width of the web mercator projection, in meters
+MERCATOR_EXTENT = 20037508.342789244
+
+# the latitude web mercator is clipped at
+MERCATOR_MAX_LATITUDE = 85.0511287798
+
+TILE_EXTENT = 4096
+
+# geometries are clipped this far (in tile units) outside of a tile so strokes do not end at its edges
+TILE_BUFFER = 64
+
+TILE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# tiles up to this zoom have a version of their own, deeper tiles share the version of their ancestor at this zoom
+TILE_VERSION_ZOOM = 8
+
+VECTOR_TILES_VERSION_KEY = 'vector_tiles_version'
+
+VectorTileLayer = namedtuple('VectorTileLayer', ['min_zoom', 'query'])
+
+# department and district geometries are read from the simplified geometry level rendered at the tile's zoom
+SIMPLIFIED_GEOMETRY_JOIN = """
+LEFT JOIN LATERAL (
+    SELECT simplified.geom FROM firestation_simplifiedgeometry simplified
+    WHERE simplified.source = '{source}' AND simplified.object_id = {object_id} AND simplified.max_zoom >= %(zoom)s
+    ORDER BY simplified.max_zoom
+    LIMIT 1
+) level ON TRUE
+"""
+
+# the attributes of each layer are the fields of the department cards and station tables
+VECTOR_TILE_LAYERS = {
+    'departments': VectorTileLayer(0, """
+SELECT ST_AsMVTGeom(ST_Transform(COALESCE(level.geom, fd.geom), 3857), bounds.tile, {extent}, {buffer}, true) AS geom,
+       fd.id, fd.name, fd.state, fd.population, fd.dist_model_score,
+       CASE WHEN COALESCE(fd.risk_model_fires_size0, fd.risk_model_fires_size1, fd.risk_model_fires_size2) IS NOT NULL
+            THEN COALESCE(fd.risk_model_fires_size0, 0) + COALESCE(fd.risk_model_fires_size1, 0) +
+                 COALESCE(fd.risk_model_fires_size2, 0) END AS predicted_fires
+FROM bounds, firestation_firedepartment fd
+""" + SIMPLIFIED_GEOMETRY_JOIN.format(source='department', object_id='fd.id') + """
+WHERE fd.geom && bounds.geom AND NOT fd.archived
+"""),
+
+    'stations': VectorTileLayer(6, """
+SELECT ST_AsMVTGeom(ST_Transform(structure.geom, 3857), bounds.tile, {extent}, {buffer}, true) AS geom,
+       station.usgsstructuredata_ptr_id AS id, structure.name, station.station_number, structure.address,
+       structure.city, structure.state, station.department_id
+FROM bounds, firestation_usgsstructuredata structure
+JOIN firestation_firestation station ON station.usgsstructuredata_ptr_id = structure.id
+WHERE structure.geom && bounds.geom AND NOT station.archived
+"""),
+
+    'districts': VectorTileLayer(8, """
+SELECT ST_AsMVTGeom(ST_Transform(COALESCE(level.geom, station.district), 3857), bounds.tile, {extent}, {buffer},
+                    true) AS geom,
+       station.usgsstructuredata_ptr_id AS id, structure.name, station.station_number, station.department_id,
+       station.district_area
+FROM bounds, firestation_firestation station
+JOIN firestation_usgsstructuredata structure ON structure.id = station.usgsstructuredata_ptr_id
+""" + SIMPLIFIED_GEOMETRY_JOIN.format(source='district', object_id='station.usgsstructuredata_ptr_id') + """
+WHERE station.district && bounds.geom AND NOT station.archived
+"""),
+}
+
+VECTOR_TILE_QUERY = """
+WITH bounds AS (
+    SELECT tile, ST_Transform(ST_Expand(tile, %(margin)s), 4326) AS geom
+    FROM (SELECT ST_MakeEnvelope(%(xmin)s, %(ymin)s, %(xmax)s, %(ymax)s, 3857) AS tile) envelope
+)
+SELECT ST_AsMVT(features, %(layer)s, {extent}, 'geom')
+FROM ({features}) features
+WHERE features.geom IS NOT NULL
+"""
+
+
+def tile_bounds(z, x, y):
+    """
+    Returns the (xmin, ymin, xmax, ymax) web mercator bounds of a tile.
+    """
+    size = 2 * MERCATOR_EXTENT / 2 ** z
+    return (-MERCATOR_EXTENT + x * size, MERCATOR_EXTENT - (y + 1) * size,
+            -MERCATOR_EXTENT + (x + 1) * size, MERCATOR_EXTENT - y * size)
+
+
+def tile_range(extent, z):
+    """
+    Returns the (xmin, ymin, xmax, ymax) tile coordinates of the tiles covering a WGS84 extent at a zoom.
+    """
+    def tile(lon, lat):
+        lat = math.radians(max(-MERCATOR_MAX_LATITUDE, min(MERCATOR_MAX_LATITUDE, lat)))
+        x = int((lon + 180.0) / 360.0 * 2 ** z)
+        y = int((1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2 * 2 ** z)
+        return min(max(x, 0), 2 ** z - 1), min(max(y, 0), 2 ** z - 1)
+
+    xmin, ymax = tile(extent[0], extent[1])
+    xmax, ymin = tile(extent[2], extent[3])
+    return xmin, ymin, xmax, ymax
+
+
+def tile_version_key(z, x, y):
+    """
+    Returns the cache key of the version shared by a tile and the tiles below it.
+    """
+    if z > TILE_VERSION_ZOOM:
+        x, y, z = x >> (z - TILE_VERSION_ZOOM), y >> (z - TILE_VERSION_ZOOM), TILE_VERSION_ZOOM
+
+    return 'vector_tiles_version_{0}_{1}_{2}'.format(z, x, y)
+
+
+def vector_tiles_version(z, x, y):
+    """
+    Returns a token which changes whenever a department, station or district in the tile changes.
+    """
+    keys = [VECTOR_TILES_VERSION_KEY, tile_version_key(z, x, y)]
+    versions = cache.get_many(keys)
+
+    for key in keys:
+        if key not in versions:
+            version = uuid.uuid4().hex
+            cache.add(key, version, timeout=None)
+            versions[key] = cache.get(key, version)
+
+    return '{0}.{1}'.format(*[versions[key] for key in keys])
+
+
+def invalidate_vector_tiles(extents=None):
+    """
+    Marks the cached tiles covering WGS84 extents stale, or every cached tile when no extents are given.
+    """
+    if extents is None:
+        cache.delete(VECTOR_TILES_VERSION_KEY)
+        return
+
+    keys = set()
+
+    for extent in extents:
+        for z in range(TILE_VERSION_ZOOM + 1):
+            # tiles are built from the geometries within a buffer around them, a tile spans at most as many degrees
+            # of latitude as of longitude so the longitude buffer covers both
+            margin = 360.0 / 2 ** z * TILE_BUFFER / TILE_EXTENT
+            xmin, ymin, xmax, ymax = tile_range((extent[0] - margin, extent[1] - margin,
+                                                 extent[2] + margin, extent[3] + margin), z)
+            keys.update(tile_version_key(z, x, y) for x in range(xmin, xmax + 1) for y in range(ymin, ymax + 1))
+
+    cache.delete_many(list(keys))
+
+
+def vector_tile_extents(model, ids):
+    """
+    Returns the WGS84 extents of the geometries rows of a department or station model are drawn with in the tiles.
+    """
+    ids = list(ids)
+
+    if not ids:
+        return []
+
+    boxes = []
+
+    for name in model.vector_tile_fields:
+        # inherited geometries are stored in the parent's table, which shares the primary key values
+        field = model._meta.get_field(name)
+        boxes.append('SELECT Box2D({column}) AS box FROM {table} WHERE {pk} = ANY(%s) AND {column} IS NOT NULL'.format(
+            column=field.column, table=field.model._meta.db_table, pk=field.model._meta.pk.column))
+
+    cursor = connections['default'].cursor()
+    cursor.execute('SELECT ST_XMin(box), ST_YMin(box), ST_XMax(box), ST_YMax(box) FROM ({0}) boxes'.format(
+        ' UNION ALL '.join(boxes)), [ids] * len(boxes))
+    return cursor.fetchall()
+
+
+def vector_tile(layer, z, x, y):
+    """
+    Returns a layer's Mapbox Vector Tile, tiles are cached until a department, station or district in them changes.
+    """
+    definition = VECTOR_TILE_LAYERS[layer]
+
+    if z < definition.min_zoom:
+        return ''
+
+    cache_key = 'vector_tile_{0}_{1}_{2}_{3}_{4}'.format(layer, z, x, y, vector_tiles_version(z, x, y))
+    tile = cache.get(cache_key)
+
+    if tile is None:
+        xmin, ymin, xmax, ymax = tile_bounds(z, x, y)
+        params = dict(layer=layer, zoom=z, xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax,
+                      margin=(xmax - xmin) * TILE_BUFFER / TILE_EXTENT)
+        query = VECTOR_TILE_QUERY.format(extent=TILE_EXTENT,
+                                         features=definition.query.format(extent=TILE_EXTENT, buffer=TILE_BUFFER))
+
+        cursor = connections['default'].cursor()
+        cursor.execute(query, params)
+        tile = bytes(cursor.fetchone()[0] or '')
+        cache.set(cache_key, tile, timeout=TILE_CACHE_TIMEOUT)
+
+    return tile
@@ -1,6 +1,7 @@
 from .views import (DepartmentDetailView, Stats, FireDepartmentListView, FireStationFavoriteListView,
                     SimilarDepartmentsListView, DepartmentUpdateGovernmentUnits, FireStationDetailView,
-                    DownloadShapefile, DocumentsView, DocumentsFileView, DocumentsDeleteView, RemoveIntersectingDepartments)
+                    DownloadShapefile, DocumentsView, DocumentsFileView, DocumentsDeleteView, RemoveIntersectingDepartments,
+                    SimplifiedGeometryView, VectorTileView)
 from .slack import FireCARESSlack
 from django.contrib.auth.decorators import permission_required
 from django.views.generic import TemplateView
@@ -14,6 +15,9 @@ urlpatterns = patterns('',
                        url(r'^departments/(?P<pk>\d+)/(?P<slug>[\w-]+)/boundary.shp$', DownloadShapefile.as_view(), name='department_boundary_shapefile', kwargs=dict(feature_type='department_boundary')),
                        url(r'^departments/(?P<pk>\d+)/(?P<slug>[\w-]+)/fire-stations.shp$', DownloadShapefile.as_view(), name='department_stations_shapefile'),
                        url(r'^departments/(?P<pk>\d+)/(?P<slug>[\w-]+)/fire-districts.shp$', DownloadShapefile.as_view(), kwargs=dict(geometry_field='district'), name='department_districts_shapefile'),
+                       url(r'^departments/(?P<pk>\d+)/boundary.geojson$', SimplifiedGeometryView.as_view(), kwargs=dict(source='department'), name='department_boundary_geojson'),
+                       url(r'^stations/(?P<pk>\d+)/district.geojson$', SimplifiedGeometryView.as_view(), kwargs=dict(source='district'), name='firestation_district_geojson'),
+                       url(r'^tiles/(?P<layer>departments|stations|districts)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+).mvt$', VectorTileView.as_view(), name='vector_tile'),
                        url(r'^departments/(?P<pk>\d+)/similar-departments/?$', SimilarDepartmentsListView.as_view(template_name='firestation/firedepartment_list.html'), name='similar_departments'),
                        url(r'^departments/(?P<pk>\d+)/settings/government-units/?$', permission_required('firestation.change_firedepartment')(DepartmentUpdateGovernmentUnits.as_view()), name='firedepartment_update_government_units'),
                        url(r'^departments/(?P<pk>\d+)/settings/intersecting-departments/?$', permission_required('firestation.change_firedepartment')(RemoveIntersectingDepartments.as_view()), name='remove_intersecting_departments'),
@@ -1,8 +1,9 @@
+import base64
+import hashlib
 import json
 import ogr
 import os
 import osr
-import pandas as pd
 import shutil
 import urllib
 import uuid
@@ -13,24 +14,28 @@ from django.contrib.auth.decorators import permission_required
 from django.contrib.contenttypes.models import ContentType
 from django.core.urlresolvers import reverse
 from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
 from django.http.response import HttpResponseRedirect, HttpResponse, JsonResponse
 from django.db import connection
-from django.db import connections
+from django.db.models import Case, IntegerField, Value, When
 from django.db.models.fields import FieldDoesNotExist
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db.models import IntegerField
+from django.core.paginator import Paginator, EmptyPage, InvalidPage, Page, PageNotAnInteger
 from django.utils.decorators import method_decorator
+from django.utils.cache import patch_cache_control
 from django.utils.encoding import smart_str
 from firecares.firecares_core.mixins import LoginRequiredMixin
-from firecares.firestation.managers import Ntile, Case, When
 from firecares.usgs.models import (StateorTerritoryHigh, CountyorEquivalent,
                                    Reserve, NativeAmericanArea, IncorporatedPlace,
                                    UnincorporatedPlace, MinorCivilDivision)
 from tempfile import mkdtemp
 from firecares.tasks.cleanup import remove_file
 from .forms import DocumentUploadForm
+from .peers import similar_departments_index
+from .tiles import vector_tile
 from django.views.generic.edit import FormView
-from .models import Document, FireStation, FireDepartment, Staffing, create_quartile_views
+from .models import (Document, DepartmentReportCard, FireStation, FireDepartment, NationalQuartile, Staffing,
+                     population_class_breaks, refresh_quartile_views, simplified_geometry)
 from favit.models import Favorite
 
 
@@ -64,6 +69,28 @@ class PaginationMixin(object):
         return context
 
 
+class CachedCountPaginator(Paginator):
+    """
+    Paginator which caches the count of its object list for a short time.
+    """
+
+    def __init__(self, object_list, per_page, cache_key=None, cache_timeout=60 * 5, **kwargs):
+        super(CachedCountPaginator, self).__init__(object_list, per_page, **kwargs)
+        self.cache_key = cache_key
+        self.cache_timeout = cache_timeout
+
+    def _get_count(self):
+        if self._count is None and self.cache_key:
+            self._count = cache.get(self.cache_key)
+
+            if self._count is None:
+                self._count = super(CachedCountPaginator, self)._get_count()
+                cache.set(self.cache_key, self._count, timeout=self.cache_timeout)
+
+        return super(CachedCountPaginator, self)._get_count()
+    count = property(_get_count)
+
+
 class DepartmentDetailView(LoginRequiredMixin, DetailView):
     model = FireDepartment
     template_name = 'firestation/department_detail.html'
@@ -90,114 +117,48 @@ class DepartmentDetailView(LoginRequiredMixin, DetailView):
             page = 1
         PaginationMixin.populate_context_data(context, paginator, int(page))
 
+        # the department's statistics are the same for every user, they are cached until the department, its NFIRS
+        # statistics or the quartile views change
+        context['page_cache_version'] = self.object.page_cache_version
+        cache_key = 'department_{0}_context_{1}'.format(self.object.id, context['page_cache_version'])
+        department_context = cache.get(cache_key)
+
+        if department_context is None:
+            department_context = self.get_department_context()
+            cache.set(cache_key, department_context, timeout=60 * 60 * 24)
+
+        context.update(department_context)
+        return context
+
+    def get_department_context(self):
+        """
+        Returns the population class statistics and report card context of the department.
+        """
+        context = {}
+
         # population stats provide summary statistics for fields within the current objects population class
         context['population_stats'] = self.object.population_class_stats
         population_quartiles = self.object.population_metrics_table
 
         if population_quartiles:
-            # risk model fire count breaks for the bullet chart
-            vals = population_quartiles.objects.get_field_stats('residential_fires_avg_3_years',
-                                                                group_by='residential_fires_avg_3_years_quartile')
-            context['residential_fires_avg_3_years_breaks'] = [n['max'] for n in vals]
-
-            # size 2 or above fire breaks for the bullet chart
-            vals = population_quartiles.objects.get_field_stats('risk_model_size1_percent_size2_percent_sum',
-                                                                group_by='risk_model_size1_percent_size2_percent_sum_quartile')
-            context['risk_model_greater_than_size_2_breaks'] = [n['max'] for n in vals]
-
-            # deaths and injuries for the bullet chart
-            vals = population_quartiles.objects.get_field_stats('risk_model_deaths_injuries_sum',
-                                                                group_by='risk_model_deaths_injuries_sum_quartile')
-            context['risk_model_deaths_injuries_breaks'] = [n['max'] for n in vals]
-
-            # This should be a table with risk quartiles already identified
-            report_card_peers = population_quartiles.objects.all()
-
-            # this should be an object that has the current department quartile values
-            object_values = self.object.population_metrics_row
-
-            report_card_peers = report_card_peers.annotate(dist_model_residential_fires_quartile=Case(When(
-                **{'dist_model_score__isnull': False,
-                   'residential_fires_avg_3_years_quartile': object_values.residential_fires_avg_3_years_quartile,
-                   'then': Ntile(4, output_field=IntegerField(),
-                                 partition_by='dist_model_score is not null, residential_fires_avg_3_years_quartile',
-                                 order_by='dist_model_score')}), output_field=IntegerField(), default=None))
-            report_card_peers = report_card_peers.annotate(dist_model_risk_model_greater_than_size_2_quartile=Case(When(
-                **{'dist_model_score__isnull': False,
-                   'risk_model_size1_percent_size2_percent_sum_quartile': object_values.risk_model_size1_percent_size2_percent_sum_quartile,
-                   'then': Ntile(4, output_field=IntegerField(),
-                                 partition_by='dist_model_score is not null, risk_model_size1_percent_size2_percent_sum_quartile',
-                                 order_by='dist_model_score')}), output_field=IntegerField(), default=None))
-            report_card_peers = report_card_peers.annotate(dist_model_risk_model_deaths_injuries_quartile=Case(When(
-                **{'dist_model_score__isnull': False,
-                   'risk_model_deaths_injuries_sum_quartile': object_values.risk_model_deaths_injuries_sum_quartile,
-                   'then': Ntile(4, output_field=IntegerField(),
-                                 partition_by='dist_model_score is not null, risk_model_deaths_injuries_sum_quartile',
-                                 order_by='dist_model_score')}), output_field=IntegerField(), default=None))
-
-            df = pd.DataFrame(list(report_card_peers.values('id',
-                                                            'dist_model_score',
-                                                            'dist_model_residential_fires_quartile',
-                                                            'dist_model_risk_model_greater_than_size_2_quartile',
-                                                            'dist_model_risk_model_deaths_injuries_quartile')))
-
-            context[
-                'dist_model_risk_model_greater_than_size_2_quartile_avg'] = df.dist_model_risk_model_greater_than_size_2_quartile.mean()
-            context[
-                'dist_model_risk_model_deaths_injuries_quartile_avg'] = df.dist_model_risk_model_deaths_injuries_quartile.mean()
-            context['dist_model_residential_fires_quartile_avg'] = df.dist_model_residential_fires_quartile.mean()
-
-            context['dist_model_risk_model_greater_than_size_2_quartile_breaks'] = \
-                df.groupby(['dist_model_risk_model_greater_than_size_2_quartile']).max()['dist_model_score'].tolist()
-            context['dist_model_risk_model_deaths_injuries_quartile_breaks'] = \
-                df.groupby(['dist_model_risk_model_deaths_injuries_quartile']).max()['dist_model_score'].tolist()
-            context['dist_model_residential_fires_quartile_breaks'] = \
-                df.groupby(['dist_model_residential_fires_quartile']).max()['dist_model_score'].tolist()
-
-            context['dist_model_residential_fires_quartile'] = \
-                df.loc[df['id'] == self.object.id].dist_model_residential_fires_quartile.values[0]
-            context['dist_model_risk_model_greater_than_size_2_quartile'] = \
-                df.loc[df['id'] == self.object.id].dist_model_risk_model_greater_than_size_2_quartile.values[0]
-            context['dist_model_risk_model_deaths_injuries_quartile'] = \
-                df.loc[df['id'] == self.object.id].dist_model_risk_model_deaths_injuries_quartile.values[0]
+            # bullet chart breaks are shared by every department in the population class
+            breaks = population_class_breaks().get(self.object.population_class)
 
-            # national_risk_band
-            cursor = connections['default'].cursor()
-            query = FireDepartment.objects.filter(dist_model_score__isnull=False, archived=False).as_quartiles()\
-                .values('id', 'risk_model_size1_percent_size2_percent_sum_quartile', 'risk_model_deaths_injuries_sum_quartile').query.__str__()
-
-            qu = """
-            WITH results as (
-            SELECT "firestation_firedepartment"."id",
-             "firestation_firedepartment"."dist_model_score",
-            CASE WHEN ("firestation_firedepartment"."risk_model_fires_size1_percentage" IS NOT NULL OR "firestation_firedepartment"."risk_model_fires_size2_percentage" IS NOT NULL) THEN ntile(4) over (partition by COALESCE(risk_model_fires_size1_percentage,0)+COALESCE(risk_model_fires_size2_percentage,0) != 0 order by COALESCE(risk_model_fires_size1_percentage,0)+COALESCE(risk_model_fires_size2_percentage,0)) ELSE NULL END AS "risk_model_size1_percent_size2_percent_sum_quartile", CASE WHEN ("firestation_firedepartment"."risk_model_deaths" IS NOT NULL OR "firestation_firedepartment"."risk_model_injuries" IS NOT NULL) THEN ntile(4) over (partition by COALESCE(risk_model_deaths,0)+COALESCE(risk_model_injuries,0) != 0 order by COALESCE(risk_model_deaths,0)+COALESCE(risk_model_injuries,0)) ELSE NULL END AS "risk_model_deaths_injuries_sum_quartile" FROM "firestation_firedepartment" WHERE "firestation_firedepartment"."dist_model_score" IS NOT NULL ORDER BY "firestation_firedepartment"."name" ASC
-            ),
-              row as (
-            SELECT * from results where results.id={id}
-            )
-
-            select ntile_results.ntile
-            from
-            (select results.id, ntile(4) over (order by results.dist_model_score asc)
-            from results
-            inner join row on results.{field}=row.{field}) as ntile_results
-            where ntile_results.id={id};
-
-            """
-            cursor.execute(qu.format(query=query.strip(), id=self.object.id,
-                                     field='risk_model_size1_percent_size2_percent_sum_quartile'))
-            try:
-                context['national_risk_model_size1_percent_size2_percent_sum_quartile'] = cursor.fetchone()[0]
-            except (KeyError, TypeError):
-                context['national_risk_model_size1_percent_size2_percent_sum_quartile'] = None
+            if breaks:
+                context.update(breaks.as_context())
 
-            cursor.execute(
-                qu.format(query=query.strip(), id=self.object.id, field='risk_model_deaths_injuries_sum_quartile'))
+            # performance score quartiles within the department's population class and risk categories
+            report_card = DepartmentReportCard.objects.filter(id=self.object.id).first()
 
-            try:
-                context['national_risk_model_deaths_injuries_sum_quartile'] = cursor.fetchone()[0]
-            except (KeyError, TypeError):
-                context['national_risk_model_deaths_injuries_sum_quartile'] = None
+            if report_card:
+                context.update(report_card.as_context())
+
+            # national_risk_band
+            national_quartiles = NationalQuartile.objects.filter(id=self.object.id).first()
+
+            for field in ['national_risk_model_size1_percent_size2_percent_sum_quartile',
+                          'national_risk_model_deaths_injuries_sum_quartile']:
+                context[field] = getattr(national_quartiles, field, None)
 
         return context
 
@@ -265,7 +226,7 @@ class DepartmentUpdateGovernmentUnits(LoginRequiredMixin, DetailView):
         messages.add_message(request, messages.SUCCESS, 'Government unit associations updated')
 
         if self.get_object().get_population_class() != population_class:
-            create_quartile_views(None)
+            refresh_quartile_views()
 
         return redirect(self.object)
 
@@ -302,7 +263,7 @@ class RemoveIntersectingDepartments(LoginRequiredMixin, DetailView):
             self.object.remove_from_department(FireDepartment.objects.get(id=i))
 
         if self.get_object().get_population_class() != population_class:
-            create_quartile_views(None)
+            refresh_quartile_views()
 
         messages.add_message(request, messages.SUCCESS, 'Removed intersecting departments.')
 
@@ -427,13 +388,126 @@ class FireDepartmentListView(LoginRequiredMixin, PaginationMixin, ListView, Safe
         ('dist_model_score', 'Lowest DIST Score'),
         ('-dist_model_score', 'Highest DIST Score'),
         ('population', 'Smallest Population'),
-        ('-population', 'Largest Population')
+        ('-population', 'Largest Population'),
+        ('geom_area', 'Smallest Area'),
+        ('-geom_area', 'Largest Area')
     ]
 
     search_fields = ['fdid', 'state', 'region', 'name']
-    range_fields = ['population', 'dist_model_score']
+    range_fields = ['population', 'dist_model_score', 'geom_area']
+
+    # GET parameters which do not change the filtered set of departments
+    pagination_params = ['page', 'limit', 'sortBy', 'after', 'before', 'facets']
+
+    # the keyset the departments are sorted by, pages of departments listed in another order are offset
+    keyset = None
+
+    def sort_queryset(self, queryset, order_by):
+        """
+        Sorts departments by a (nulls last, value, id) keyset so pages can be sought instead of offset, defaults to
+        the largest population first.
+        """
+        if not self.model_field_valid(order_by, choices=[name for name, verbose_name in self.sort_by_fields]):
+            order_by = '-population'
+
+        field = self.model._meta.get_field(order_by.lstrip('-'))
+        column = '{0}.{1}'.format(self.model._meta.db_table, field.column)
+        descending = order_by.startswith('-')
+        default = "''" if field.get_internal_type() == 'CharField' else '0'
+
+        # the null flag sorts in the same direction as the value so the keyset can be compared as one row
+        self.keyset = ('{0} IS {1}NULL'.format(column, 'NOT ' if descending else ''),
+                       'COALESCE({0}, {1})'.format(column, default),
+                       '{0}.id'.format(self.model._meta.db_table))
+        self.keyset_descending = descending
+
+        prefix = '-' if descending else ''
+        return queryset.extra(select={'keyset_null': self.keyset[0], 'keyset_value': self.keyset[1]})\
+            .order_by(prefix + 'keyset_null', prefix + 'keyset_value', prefix + 'id')
+
+    def seek_queryset(self, queryset, cursor, after=True):
+        """
+        Returns the departments after (or before, in reverse order) the keyset cursor of a department.
+        """
+        operator = '>' if after != self.keyset_descending else '<'
+        queryset = queryset.extra(where=['({0}, {1}, {2}) {3} (%s, %s, %s)'.format(*(self.keyset + (operator,)))],
+                                  params=cursor)
+        return queryset if after else queryset.reverse()
+
+    @staticmethod
+    def encode_cursor(department):
+        return base64.urlsafe_b64encode(json.dumps([department.keyset_null, department.keyset_value, department.id]))
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(str(cursor)))
+        except (TypeError, ValueError):
+            return
+
+        if isinstance(cursor, list) and len(cursor) == 3:
+            return cursor
+
+    def get_filter_signature(self):
+        """
+        Returns a hash of the normalized filters, departments matching the same filters share the signature.
+        """
+        filters = sorted((key, value) for key, value in self.request.GET.items()
+                         if key not in self.pagination_params and value)
+
+        if self.request.GET.get('favorites') == 'true':
+            filters.append(('user', self.request.user.id))
+
+        signature = json.dumps([self.__class__.__name__, self.kwargs, filters], sort_keys=True)
+        return hashlib.md5(signature).hexdigest()
+
+    def get_facets(self, queryset):
+        """
+        Returns the facet counts of the filtered departments, cached by filter signature for a short time.
+        """
+        cache_key = 'department_list_facets_{0}'.format(self.get_filter_signature())
+        facets = cache.get(cache_key)
+
+        if facets is None:
+            facets = queryset.facet_counts()
+            cache.set(cache_key, facets, timeout=60 * 5)
 
-    def handle_search(self, queryset):
+        return facets
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        cache_key = 'department_list_count_{0}'.format(self.get_filter_signature())
+        return CachedCountPaginator(queryset, per_page, orphans=orphans, cache_key=cache_key,
+                                    allow_empty_first_page=allow_empty_first_page, **kwargs)
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Seeks to the page after (or before) a keyset cursor when one is given, otherwise falls back to offsets.
+        """
+        paginator = self.get_paginator(queryset, page_size)
+        cursor = self.keyset and self.decode_cursor(self.request.GET.get('after') or self.request.GET.get('before'))
+
+        page_number = self.request.GET.get('page') or 1
+
+        try:
+            number = paginator.validate_number(paginator.num_pages if page_number == 'last' else page_number)
+        except InvalidPage as e:
+            raise Http404('Invalid page ({0}): {1}'.format(page_number, e))
+
+        if cursor:
+            after = bool(self.request.GET.get('after'))
+            object_list = list(self.seek_queryset(queryset, cursor, after=after)[:page_size])
+
+            if not after:
+                object_list.reverse()
+
+            page = Page(object_list, number, paginator)
+        else:
+            page = paginator.page(number)
+            page.object_list = list(page.object_list)
+
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def handle_search(self, queryset, sort=True):
 
         # search in favorite departments only
         if self.request.GET.get('favorites', 'false') == 'true':
@@ -445,7 +519,9 @@ class FireDepartmentListView(LoginRequiredMixin, PaginationMixin, ListView, Safe
         if self.request.GET.get('q'):
             queryset = queryset.full_text_search(self.request.GET.get('q'))
 
-        queryset = self.sort_queryset(queryset, self.request.GET.get('sortBy'))
+        if sort:
+            queryset = self.sort_queryset(queryset, self.request.GET.get('sortBy'))
+
         self.limit_queryset(self.request.GET.get('limit'))
 
         for field, value in self.request.GET.items():
@@ -486,7 +562,25 @@ class FireDepartmentListView(LoginRequiredMixin, PaginationMixin, ListView, Safe
         context['featured_departments'] = featured_departments[:5]
         context['featured_departments_short'] = featured_departments[:3]
 
-        context['departments_total_count'] = self.get_queryset().count()
+        context['departments_total_count'] = context['paginator'].count
+
+        # faceted search mode, counts per state, region, population class and DIST score bucket
+        if self.request.GET.get('facets') == 'true':
+            context['facets'] = self.get_facets(self.object_list)
+
+            # the (lower, upper, count) bounds of the DIST score buckets
+            bucket = self.object_list.dist_model_score_facet_bucket
+            context['dist_model_score_facets'] = [(value, None if value is None else value + bucket - 1, count)
+                                                  for value, count in context['facets']['dist_model_score']]
+
+        page = context['page_obj']
+
+        if page.object_list and self.keyset:
+            if page.has_next():
+                context['next_page_cursor'] = self.encode_cursor(page.object_list[-1])
+
+            if page.has_previous():
+                context['previous_page_cursor'] = self.encode_cursor(page.object_list[0])
 
         context['dist_min'] = 0
 
@@ -498,11 +592,32 @@ class SimilarDepartmentsListView(FireDepartmentListView):
     Implements the Similar Department list view.
     """
 
+    # number of departments listed in the multi-metric similarity mode
+    similar_by_features_count = 90
+
+    # number of departments nearest in population listed in the default similarity mode
+    similar_by_population_count = 90
+
+    def ranked_queryset(self, ids):
+        """
+        Returns the departments with ids, in the order of the ids unless another order is asked for.
+        """
+        rank = Case(*[When(id=pk, then=Value(n)) for n, pk in enumerate(ids)], output_field=IntegerField())
+        queryset = FireDepartment.objects.filter(id__in=ids).annotate(similarity_rank=rank)\
+            .order_by('similarity_rank', 'id')
+        return self.handle_search(queryset, sort=bool(self.request.GET.get('sortBy')))
+
     def get_queryset(self):
         department = get_object_or_404(FireDepartment, pk=self.kwargs.get('pk'))
-        queryset = department.similar_departments
-        queryset = self.handle_search(queryset)
-        return queryset
+
+        if self.request.GET.get('similarity') == 'features':
+            similar = department.similar_departments_by_features(k=self.similar_by_features_count)
+            return self.ranked_queryset([fd.id for fd in similar])
+
+        # the departments in the population class (and region) nearest in population are looked up in the in-memory
+        # index, nearest first
+        return self.ranked_queryset(similar_departments_index().nearest(department,
+                                                                        limit=self.similar_by_population_count))
 
 
 class FireStationFavoriteListView(LoginRequiredMixin, PaginationMixin, ListView, SafeSortMixin, LimitMixin):
@@ -552,6 +667,52 @@ class FireStationDetailView(LoginRequiredMixin, DetailView):
     model = FireStation
 
 
+class SimplifiedGeometryView(LoginRequiredMixin, View):
+    """
+    Returns a department boundary or station district simplified for the map zoom in the zoom parameter.
+
+    The GeoJSON feature's min_zoom and max_zoom properties are the zoom levels the geometry is rendered at.
+    """
+    max_age = 60 * 60
+
+    def get(self, request, *args, **kwargs):
+        try:
+            zoom = int(request.GET.get('zoom', 0))
+        except ValueError:
+            zoom = 0
+
+        geometry = simplified_geometry(kwargs.get('source'), int(kwargs.get('pk')), zoom)
+
+        if geometry is None:
+            raise Http404
+
+        geojson, min_zoom, max_zoom = geometry
+        # the geometry is already serialized by the database, it is not parsed again
+        response = HttpResponse('{{"type": "Feature", "properties": {0}, "geometry": {1}}}'.format(
+            json.dumps(dict(min_zoom=min_zoom, max_zoom=max_zoom)), geojson), content_type='application/json')
+        patch_cache_control(response, private=True, max_age=self.max_age)
+        return response
+
+
+class VectorTileView(LoginRequiredMixin, View):
+    """
+    Returns a Mapbox Vector Tile of departments, stations or districts.
+    """
+    content_type = 'application/vnd.mapbox-vector-tile'
+    max_age = 60 * 60
+    max_zoom = 22
+
+    def get(self, request, *args, **kwargs):
+        z, x, y = int(kwargs.get('z')), int(kwargs.get('x')), int(kwargs.get('y'))
+
+        if z > self.max_zoom or x >= 2 ** z or y >= 2 ** z:
+            raise Http404
+
+        response = HttpResponse(vector_tile(kwargs.get('layer'), z, x, y), content_type=self.content_type)
+        patch_cache_control(response, private=True, max_age=self.max_age)
+        return response
+
+
 class SpatialIntersectView(ListView):
     model = FireStation
     template_name = 'firestation/department_detail.html'
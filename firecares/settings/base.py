@@ -271,6 +271,10 @@ CELERY_QUEUES = [
     Queue('slack', routing_key='slack'),
 ]
 
+# DIST performance score sampling, the number of processes defaults to the number of CPUs.
+DIST_SAMPLING_PROCESSES = int(os.getenv('DIST_SAMPLING_PROCESSES', 0)) or None
+DIST_SAMPLING_SEED = int(os.getenv('DIST_SAMPLING_SEED', 0))
+
 ACCOUNT_ACTIVATION_DAYS = 7
 REGISTRATION_OPEN = False
 
@@ -53,6 +53,11 @@ CELERYBEAT_SCHEDULE = {
     'ensure_valid_data_every_midnight': {
         'task': 'firecares.tasks.email.ensure_valid_data',
         'schedule': crontab(minute=0, hour=0),
+    },
+    # Summarizes newly loaded NFIRS years nightly.
+    'refresh_nfirs_summary_every_midnight': {
+        'task': 'firecares.tasks.update.refresh_nfirs_summary',
+        'schedule': crontab(minute=0, hour=0),
     }
 }
 
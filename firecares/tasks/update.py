@@ -1,53 +1,212 @@
+import hashlib
+import json
+import numpy
+import random
+import re
+import time
+from billiard import Pool, cpu_count
+from collections import defaultdict
 from firecares.celery import app
-from django.db import connections
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
 from django.db.utils import ConnectionDoesNotExist
-from firecares.firestation.models import FireDepartment, create_quartile_views
+from firecares.firestation.models import FireDepartment, refresh_quartile_views
 from firecares.firestation.models import NFIRSStatistic as nfirs
+from firecares.firestation.tiles import invalidate_vector_tiles, vector_tile_extents
+from fire_risk.backends.queries import RESIDENTIAL_FIRES_BY_FDID_STATE
 from fire_risk.models import DIST, NotEnoughRecords
 from fire_risk.models.DIST.providers.ahs import ahs_building_areas
 from fire_risk.models.DIST.providers.iaff import response_time_distributions
-from fire_risk.backends.queries import RESIDENTIAL_FIRES_BY_FDID_STATE
 from fire_risk.utils import LogNormalDraw
-from firecares.utils import dictfetchall
+from firecares.utils import bulk_update, dictfetchall
 
+QUARTILE_VIEWS_REFRESH_KEY = 'quartile_views_refresh_scheduled'
+QUARTILE_VIEWS_REFRESH_DUE_KEY = 'quartile_views_refresh_due'
+QUARTILE_VIEWS_REFRESH_DEADLINE_KEY = 'quartile_views_refresh_deadline'
+# a scheduled refresh which was lost (e.g. a worker restart) stops blocking new refreshes after this long
+QUARTILE_VIEWS_REFRESH_TIMEOUT = 60 * 60 * 24
+NFIRS_YEARS_KEY = 'nfirs_years'
 
-def update_scores():
-    for fd in FireDepartment.objects.filter(archived=False):
-        update_performance_score.delay(fd.id)
+NFIRS_SUMMARY_TABLE = 'firecares_department_summary'
 
+NFIRS_COUNT_TABLES = [
+    ('civilian_casualties', 'civiliancasualty'),
+    ('residential_structure_fires', 'buildingfires'),
+    ('firefighter_casualties', 'ffcasualty'),
+]
 
-@app.task(queue='update')
-def update_performance_score(id, dry_run=False):
+# attribute types of draw objects included in DIST input fingerprints
+PRIMITIVE_TYPES = (bool, int, long, float, basestring, type(None))
+
+FIRE_SPREAD_CATEGORIES = {
+    '1': 'object_of_origin',
+    '2': 'room_of_origin',
+    '3': 'floor_of_origin',
+    '4': 'building_of_origin',
+    '5': 'beyond',
+}
+
+
+def residential_property_uses(query):
     """
-    Updates department performance scores.
+    Returns the property use codes of the residential predicate (prop_use in (...)) of a fire_risk query.
+    """
+    match = re.search(r"prop_use\s+in\s*\(([^)]*)\)", query, re.IGNORECASE)
+
+    if match is None:
+        raise ImproperlyConfigured('The residential predicate of the fire_risk query was not found.')
+
+    return tuple(re.findall(r"'([^']*)'", match.group(1)))
+
+
+# the residential property uses fire_risk's RESIDENTIAL_FIRES_BY_FDID_STATE counts the fire spread of
+RESIDENTIAL_PROPERTY_USES = residential_property_uses(RESIDENTIAL_FIRES_BY_FDID_STATE)
+
+# Per department and year counts of the NFIRS tables, maintained by refresh_nfirs_summary so statistics and DIST
+# inputs are read without scanning the incident tables.  The fire spread columns only count residential fires, like
+# the DIST inputs fire_risk reads, residential_structure_fires counts every building fire like the NFIRS statistics.
+CREATE_NFIRS_SUMMARY = """
+    create table if not exists {table} (
+        state varchar(2) not null,
+        fdid varchar(5) not null,
+        year integer not null,
+        civilian_casualties integer,
+        residential_structure_fires integer,
+        firefighter_casualties integer,
+        {fire_spread},
+        primary key (state, fdid, year)
+    );
+    create index if not exists {table}_year on {table} (year);
+""".format(table=NFIRS_SUMMARY_TABLE,
+           fire_spread=',\n        '.join('{0} integer not null default 0'.format(category)
+                                          for _, category in sorted(FIRE_SPREAD_CATEGORIES.items())))
+
+SUMMARIZE_BUILDING_FIRES = """
+    insert into {table} (state, fdid, year, residential_structure_fires, {categories})
+    select state, fdid, %(year)s, count(*), {fire_spread}
+    from buildingfires
+    where inc_date >= %(start)s and inc_date < %(end)s
+    group by state, fdid;
+""".format(table=NFIRS_SUMMARY_TABLE,
+           categories=', '.join(category for _, category in sorted(FIRE_SPREAD_CATEGORIES.items())),
+           fire_spread=', '.join("count(*) filter (where fire_sprd='{0}' and prop_use in ({1}))".format(
+               code, ', '.join("'{0}'".format(use) for use in RESIDENTIAL_PROPERTY_USES))
+               for code, _ in sorted(FIRE_SPREAD_CATEGORIES.items())))
+
+SUMMARIZE_COUNTS = """
+    insert into {table} (state, fdid, year, {metric})
+    select state, fdid, %(year)s, count(*)
+    from {source}
+    where inc_date >= %(start)s and inc_date < %(end)s
+    group by state, fdid
+    on conflict (state, fdid, year) do update set {metric}=EXCLUDED.{metric};
+"""
+
+NFIRS_COUNTS_BY_DEPARTMENT = """
+    select fdid, state, year, {metrics} from {table}
+    where (fdid, state) in %(departments)s and year in %(years)s;
+""".format(table=NFIRS_SUMMARY_TABLE, metrics=', '.join(metric for metric, _ in NFIRS_COUNT_TABLES))
+
+# the same counts read from the incident tables, until the summary table is built
+COUNT_INCIDENTS = """
+        select fdid, state, extract(year from inc_date)::integer as year, {columns} from {table}
+        where (fdid, state) in %(departments)s and extract(year from inc_date) in %(years)s
+        group by fdid, state, year"""
+
+NFIRS_COUNTS_FROM_INCIDENTS = """
+    select fdid, state, year, {metrics} from ({counts}
+    ) counts
+    group by fdid, state, year;
+""".format(
+    metrics=', '.join('sum({0})::integer as {0}'.format(metric) for metric, _ in NFIRS_COUNT_TABLES),
+    counts='\n        union all'.join(
+        COUNT_INCIDENTS.format(table=table, columns=', '.join(
+            '{0}::bigint as {1}'.format('count(*)' if other == metric else 'null', other)
+            for other, _ in NFIRS_COUNT_TABLES))
+        for metric, table in NFIRS_COUNT_TABLES))
+
+RESIDENTIAL_FIRE_SPREAD_BY_STATE = """
+    select fdid, state, {fire_spread} from {table}
+    where state=%s and fdid in %s
+    group by fdid, state;
+""".format(table=NFIRS_SUMMARY_TABLE,
+           fire_spread=', '.join('sum({0})::integer as {0}'.format(category)
+                                 for _, category in sorted(FIRE_SPREAD_CATEGORIES.items())))
+
+
+def update_scores(batch=False, chunk_size=500):
     """
+    Queues performance score updates for all non-archived departments.
 
-    try:
-        cursor = connections['nfirs'].cursor()
-        fd = FireDepartment.objects.get(id=id)
-    except (ConnectionDoesNotExist, FireDepartment.DoesNotExist):
+    In batch mode departments are scored in per-state chunks that share a single NFIRS query.
+    """
+    departments = FireDepartment.objects.filter(archived=False)
+
+    if not batch:
+        for fd in departments:
+            update_performance_score.delay(fd.id)
         return
 
-    cursor.execute(RESIDENTIAL_FIRES_BY_FDID_STATE, (fd.fdid, fd.state))
-    results = dictfetchall(cursor)
-    old_score = fd.dist_model_score
-    counts = dict(object_of_origin=0, room_of_origin=0, floor_of_origin=0, building_of_origin=0, beyond=0)
+    for state in departments.order_by('state').values_list('state', flat=True).distinct():
+        ids = list(departments.filter(state=state).values_list('id', flat=True))
+
+        for start in range(0, len(ids), chunk_size):
+            update_performance_scores.delay(state, ids[start:start + chunk_size])
+
+
+def nfirs_summary_exists(cursor):
+    """
+    Returns True once refresh_nfirs_summary has built the summary table.
+    """
+    cursor.execute("select to_regclass(%s) is not null;", [NFIRS_SUMMARY_TABLE])
+    return cursor.fetchone()[0]
+
+
+def residential_fire_spread(cursor, state, fdids):
+    """
+    Returns a dict of fdid to the residential fire spread counts of a state's departments.
+
+    Single department and batched score updates both read their inputs here, so they score departments alike.  Until
+    the summary table is built the counts are read with fire_risk's query, one department at a time.
+    """
+    if nfirs_summary_exists(cursor):
+        cursor.execute(RESIDENTIAL_FIRE_SPREAD_BY_STATE, (state, tuple(set(fdids))))
+        return dict((result['fdid'], result) for result in dictfetchall(cursor))
+
+    fire_spread = {}
+
+    for fdid in set(fdids):
+        cursor.execute(RESIDENTIAL_FIRES_BY_FDID_STATE, (fdid, state))
+        counts = fire_spread.setdefault(fdid, {})
+
+        for result in dictfetchall(cursor):
+            category = FIRE_SPREAD_CATEGORIES.get(result['fire_sprd'])
 
-    for result in results:
-        if result['fire_sprd'] == '1':
-            counts['object_of_origin'] += result['count']
+            if category:
+                counts[category] = counts.get(category, 0) + result['count']
 
-        if result['fire_sprd'] == '2':
-            counts['room_of_origin'] += result['count']
+    return fire_spread
 
-        if result['fire_sprd'] == '3':
-            counts['floor_of_origin'] += result['count']
 
-        if result['fire_sprd'] == '4':
-            counts['building_of_origin'] += result['count']
+def nfirs_counts(cursor, departments, years):
+    """
+    Returns the per year NFIRS statistics of (fdid, state) departments, read from the summary table or, until it is
+    built, counted from the incident tables.
+    """
+    query = NFIRS_COUNTS_BY_DEPARTMENT if nfirs_summary_exists(cursor) else NFIRS_COUNTS_FROM_INCIDENTS
+    cursor.execute(query, dict(departments=tuple(departments), years=tuple(years)))
+    return dictfetchall(cursor)
+
+
+def dist_inputs(fd, fire_spread):
+    """
+    Builds the DIST model inputs for a department from its residential fire spread counts.
 
-        if result['fire_sprd'] == '5':
-            counts['beyond'] += result['count']
+    fire_spread is a dict of fire spread category to count, missing categories count as zero.
+    """
+    counts = dict((category, fire_spread.get(category) or 0) for category in FIRE_SPREAD_CATEGORIES.values())
 
     ahs_building_size = ahs_building_areas(fd.fdid, fd.state)
 
@@ -59,12 +218,130 @@ def update_performance_score(id, dry_run=False):
     if response_times:
         counts['arrival_time_draw'] = LogNormalDraw(*response_times, multiplier=60)
 
+    return counts
+
+
+def draw_parameters(draw):
+    """
+    Returns the primitive attributes (numbers, strings and arrays of them) which parametrize a draw object.
+    """
+    if draw is None:
+        return None
+
+    parameters = {}
+
+    for name, value in getattr(draw, '__dict__', {}).items():
+        if isinstance(value, (numpy.ndarray, numpy.generic)):
+            parameters[name] = value.tolist()
+        elif isinstance(value, PRIMITIVE_TYPES) or \
+                (isinstance(value, (list, tuple)) and all(isinstance(v, PRIMITIVE_TYPES) for v in value)):
+            parameters[name] = value
+
+    return [type(draw).__name__, parameters]
+
+
+def dist_inputs_fingerprint(fd, counts):
+    """
+    Hashes a department's primitive DIST inputs (fire spread counts, response time distribution, AHS building area
+    parameters and sampling seed), matching fingerprints produce the same score.
+    """
+    response_times = response_time_distributions.get('{0}-{1}'.format(fd.fdid, fd.state))
+    inputs = dict(fire_spread=[counts.get(category) for category in sorted(FIRE_SPREAD_CATEGORIES.values())],
+                  response_times=[float(value) for value in response_times] if response_times else None,
+                  building_areas=draw_parameters(counts.get('building_area_draw')),
+                  seed=department_seed(fd.id))
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True)).hexdigest()
+
+
+def department_seed(id):
+    """
+    Returns the random seed used when sampling a department's DIST score, so reruns reproduce scores exactly.
+    """
+    return (getattr(settings, 'DIST_SAMPLING_SEED', 0) + int(id)) % (2 ** 32)
+
+
+def dist_score(counts, seed=None):
+    """
+    Runs the DIST model, returns None when there is not enough data to score the department.
+    """
+    if seed is not None:
+        random.seed(seed)
+        numpy.random.seed(seed)
+
     try:
         dist = DIST(floor_extent=False, **counts)
-        fd.dist_model_score = dist.gibbs_sample()
+        return dist.gibbs_sample()
 
     except (NotEnoughRecords, ZeroDivisionError):
-        fd.dist_model_score = None
+        return None
+
+
+def _sample_department(job):
+    """
+    Process pool worker, samples a single department's DIST score.
+    """
+    id, counts, seed = job
+    start = time.time()
+    score = dist_score(counts, seed=seed)
+    return id, score, time.time() - start
+
+
+def sample_dist_scores(inputs, processes=None):
+    """
+    Samples DIST scores for many departments across a process pool.
+
+    inputs is a list of (department id, DIST inputs) tuples.  Returns a dict of department id to a (score, seconds
+    spent sampling) tuple.
+    """
+    jobs = [(id, counts, department_seed(id)) for id, counts in inputs]
+    processes = processes or getattr(settings, 'DIST_SAMPLING_PROCESSES', None) or cpu_count()
+
+    if processes == 1 or len(jobs) < 2:
+        results = map(_sample_department, jobs)
+    else:
+        # billiard pools can be started from within (daemonic) celery worker processes
+        pool = Pool(min(processes, len(jobs)))
+
+        try:
+            results = pool.map(_sample_department, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    scores = {}
+
+    for id, score, elapsed in results:
+        print 'sampled fdid: {0} in {1:.2f}s.'.format(id, elapsed)
+        scores[id] = (score, elapsed)
+
+    return scores
+
+
+@app.task(queue='update')
+def update_performance_score(id, dry_run=False, force=False):
+    """
+    Updates department performance scores.
+
+    Sampling is skipped when the department's DIST inputs have not changed since the last update, unless forced.
+    """
+
+    try:
+        cursor = connections['nfirs'].cursor()
+        fd = FireDepartment.objects.get(id=id)
+    except (ConnectionDoesNotExist, FireDepartment.DoesNotExist):
+        return
+
+    fire_spread = residential_fire_spread(cursor, fd.state, [fd.fdid])
+    old_score = fd.dist_model_score
+    counts = dist_inputs(fd, fire_spread.get(fd.fdid, {}))
+    fingerprint = dist_inputs_fingerprint(fd, counts)
+
+    if not force and fingerprint == fd.dist_model_inputs_hash:
+        print 'skipping fdid: {0}, inputs unchanged.'.format(fd.id)
+        return
+
+    fd.dist_model_score = dist_score(counts, seed=department_seed(fd.id))
+    fd.dist_model_inputs_hash = fingerprint
 
     print 'updating fdid: {2} from: {0} to {1}.'.format(old_score, fd.dist_model_score, fd.id)
 
@@ -72,6 +349,63 @@ def update_performance_score(id, dry_run=False):
         return
 
     fd.save()
+    schedule_quartile_views_refresh()
+
+
+@app.task(queue='update')
+def update_performance_scores(state, ids=None, dry_run=False, force=False):
+    """
+    Updates the performance scores of a state's departments (or a chunk of them) from one grouped NFIRS query and
+    writes the changed scores with a single bulk update.
+
+    Departments whose DIST inputs have not changed since the last update are not resampled, unless forced.
+    """
+
+    try:
+        cursor = connections['nfirs'].cursor()
+    except ConnectionDoesNotExist:
+        return
+
+    departments = FireDepartment.objects.filter(archived=False, state=state)\
+        .only('id', 'fdid', 'state', 'dist_model_score', 'dist_model_inputs_hash')
+
+    if ids:
+        departments = departments.filter(id__in=ids)
+
+    departments = list(departments)
+
+    if not departments:
+        return
+
+    fire_spread = residential_fire_spread(cursor, state, [fd.fdid for fd in departments])
+
+    inputs, fingerprints = [], {}
+
+    for fd in departments:
+        counts = dist_inputs(fd, fire_spread.get(fd.fdid, {}))
+        fingerprint = dist_inputs_fingerprint(fd, counts)
+
+        if force or fingerprint != fd.dist_model_inputs_hash:
+            inputs.append((fd.id, counts))
+            fingerprints[fd.id] = fingerprint
+
+    scores = sample_dist_scores(inputs)
+    updated = []
+
+    for fd in departments:
+        if fd.id not in scores:
+            continue
+
+        score, _ = scores[fd.id]
+        print 'updating fdid: {2} from: {0} to {1}.'.format(fd.dist_model_score, score, fd.id)
+        updated.append((fd.id, score, fingerprints[fd.id]))
+
+    if dry_run or not updated:
+        return
+
+    bulk_update(FireDepartment, updated, ['dist_model_score', 'dist_model_inputs_hash'])
+    schedule_quartile_views_refresh()
+    invalidate_vector_tiles(vector_tile_extents(FireDepartment, [row[0] for row in updated]))
 
 
 @app.task(queue='update')
@@ -92,41 +426,180 @@ def update_nfirs_counts(id, year=None):
 
     years = {}
     if not year:
-        # get a list of years populated in the NFIRS database
-        years_query = "select distinct(extract(year from inc_date)) as year from buildingfires;"
-        cursor.execute(years_query)
         # default years to None
-        map(years.setdefault, [int(n[0]) for n in cursor.fetchall()])
+        map(years.setdefault, nfirs_years(cursor))
     else:
         years[year] = None
 
-    queries = (
-        ('civilian_casualties', "select extract(year from inc_date) as year, count(*) from civiliancasualty where"
-            " fdid=%s and state=%s and extract(year from inc_date) in %s group by year order by year desc;", (fd.fdid, fd.state, tuple(years.keys()))),
-        ('residential_structure_fires', "select extract(year from inc_date) as year, count(*) from buildingfires"
-                                        " where fdid=%s and state=%s and extract(year from inc_date) in %s group by year order by year desc;",
-         (fd.fdid, fd.state, tuple(years.keys()))),
-        ('firefighter_casualties', "select extract(year from inc_date) as year, count(*) from ffcasualty where"
-            " fdid=%s and state=%s and extract(year from inc_date) in %s group by year order by year desc;", (fd.fdid, fd.state, tuple(years.keys()))),
-    )
-
-    for statistic, query, params in queries:
+    if not years:
+        return
+
+    results = nfirs_counts(cursor, [(fd.fdid, fd.state)], years.keys())
+
+    for statistic, _ in NFIRS_COUNT_TABLES:
         counts = years.copy()
-        cursor.execute(query, params)
 
-        for year, count in cursor.fetchall():
-            counts[year] = count
+        for result in results:
+            counts[result['year']] = result[statistic]
 
         for year, count in counts.items():
             nfirs.objects.update_or_create(year=year, defaults={'count': count}, fire_department=fd, metric=statistic)
 
+    schedule_quartile_views_refresh()
+
+
+def nfirs_years(cursor):
+    """
+    Returns the years populated in the NFIRS database, the list is cached for a day.
+    """
+    years = cache.get(NFIRS_YEARS_KEY)
+
+    if years is None:
+        if nfirs_summary_exists(cursor):
+            cursor.execute("select distinct(year) from {0};".format(NFIRS_SUMMARY_TABLE))
+        else:
+            cursor.execute("select distinct(extract(year from inc_date)) from buildingfires;")
+
+        years = sorted([int(n[0]) for n in cursor.fetchall()])
+        cache.set(NFIRS_YEARS_KEY, years, timeout=60 * 60 * 24)
+
+    return years
+
+
+@app.task(queue='update')
+def update_nfirs_counts_batch(ids, year=None):
+    """
+    Queries the NFIRS database for statistics of many departments at once.
+
+    Each metric is counted for all departments with one grouped query and the statistics are written with a single
+    INSERT ... ON CONFLICT statement (which requires PostgreSQL 9.5 or later).  Unchanged statistics are left
+    untouched.
+    """
+
+    try:
+        cursor = connections['nfirs'].cursor()
+    except ConnectionDoesNotExist:
+        return
+
+    departments = defaultdict(list)
+    for id, fdid, state in FireDepartment.objects.filter(id__in=ids).values_list('id', 'fdid', 'state'):
+        departments[(fdid, state)].append(id)
+
+    if not departments:
+        return
+
+    years = [year] if year else nfirs_years(cursor)
+
+    if not years:
+        return
+
+    rows = []
+
+    results = nfirs_counts(cursor, departments.keys(), years)
+
+    for statistic, _ in NFIRS_COUNT_TABLES:
+        # default counts to None
+        counts = dict(((key, y), None) for key in departments for y in years)
+
+        for result in results:
+            counts[((result['fdid'], result['state']), result['year'])] = result[statistic]
+
+        for (key, y), count in counts.items():
+            for id in departments[key]:
+                rows.append((id, statistic, y, count))
+
+    if not rows:
+        return
+
+    sql = """
+        INSERT INTO firestation_nfirsstatistic (created, modified, fire_department_id, metric, year, count)
+        VALUES {values}
+        ON CONFLICT (fire_department_id, year, metric)
+        DO UPDATE SET count=EXCLUDED.count, modified=EXCLUDED.modified
+        WHERE firestation_nfirsstatistic.count IS DISTINCT FROM EXCLUDED.count;
+    """.format(values=', '.join(['(now(), now(), %s, %s, %s, %s::smallint)'] * len(rows)))
+
+    connections['default'].cursor().execute(sql, [value for row in rows for value in row])
+    schedule_quartile_views_refresh()
+
 
 @app.task(queue='update')
-def create_quartile_views_task():
+def refresh_nfirs_summary(years=None, all_years=False):
+    """
+    Summarizes the NFIRS incident tables into the per department and year summary table.
+
+    Only years loaded since the last refresh are summarized unless years are given (or all years are requested), each
+    year is replaced in a single transaction.  Returns the summarized years.
+    """
+
+    try:
+        cursor = connections['nfirs'].cursor()
+    except ConnectionDoesNotExist:
+        return
+
+    cursor.execute(CREATE_NFIRS_SUMMARY)
+
+    if not years:
+        cursor.execute("select distinct(extract(year from inc_date)) as year from buildingfires;")
+        loaded = set(int(n[0]) for n in cursor.fetchall())
+        cursor.execute("select distinct(year) from {0};".format(NFIRS_SUMMARY_TABLE))
+        years = loaded if all_years else loaded - set(n[0] for n in cursor.fetchall())
+
+    years = sorted(int(year) for year in years)
+
+    for year in years:
+        params = dict(year=year, start='{0}-01-01'.format(year), end='{0}-01-01'.format(year + 1))
+
+        with transaction.atomic(using='nfirs'):
+            cursor.execute("delete from {0} where year=%(year)s;".format(NFIRS_SUMMARY_TABLE), params)
+            cursor.execute(SUMMARIZE_BUILDING_FIRES, params)
+
+            for statistic, table in NFIRS_COUNT_TABLES:
+                if table == 'buildingfires':
+                    continue
+
+                cursor.execute(SUMMARIZE_COUNTS.format(table=NFIRS_SUMMARY_TABLE, metric=statistic, source=table),
+                               params)
+
+        print 'summarized nfirs year: {0}.'.format(year)
+
+    cache.delete(NFIRS_YEARS_KEY)
+    return years
+
+
+@app.task(queue='update', bind=True)
+def create_quartile_views_task(self, debounced=False):
+    """
+    Updates the Quartile Materialized Views of population classes with modified departments.
+
+    A debounced refresh is pushed back until no update has been made for the scheduled countdown, or until its
+    deadline.
+    """
+    due = cache.get(QUARTILE_VIEWS_REFRESH_DUE_KEY)
+
+    if debounced and not self.request.is_eager and due is not None and due > time.time():
+        # the scheduled key is kept, so updates made meanwhile do not queue another refresh
+        self.apply_async(kwargs=dict(debounced=True), countdown=due - time.time())
+        return
+
+    # updates made while refreshing schedule another refresh
+    cache.delete_many([QUARTILE_VIEWS_REFRESH_KEY, QUARTILE_VIEWS_REFRESH_DEADLINE_KEY])
+    return refresh_quartile_views()
+
+
+def schedule_quartile_views_refresh(countdown=60 * 5, max_delay=60 * 30):
     """
-    Updates the Quartile Materialized Views.
+    Schedules a quartile view refresh once no update has been made for countdown seconds, every call pushes the
+    refresh back but never past max_delay seconds from the first call, so steady updates can't starve it.
     """
-    return create_quartile_views(None)
+    now = time.time()
+    cache.add(QUARTILE_VIEWS_REFRESH_DEADLINE_KEY, now + max_delay, timeout=QUARTILE_VIEWS_REFRESH_TIMEOUT)
+    deadline = cache.get(QUARTILE_VIEWS_REFRESH_DEADLINE_KEY, now + max_delay)
+    countdown = max(min(now + countdown, deadline) - now, 0)
+    cache.set(QUARTILE_VIEWS_REFRESH_DUE_KEY, now + countdown, timeout=QUARTILE_VIEWS_REFRESH_TIMEOUT)
+
+    if cache.add(QUARTILE_VIEWS_REFRESH_KEY, True, timeout=QUARTILE_VIEWS_REFRESH_TIMEOUT):
+        create_quartile_views_task.apply_async(kwargs=dict(debounced=True), countdown=countdown)
 
 
 @app.task(queue='update')
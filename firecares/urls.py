@@ -5,7 +5,8 @@ from django.views.defaults import page_not_found
 from django.views.generic import TemplateView
 from .firecares_core.forms import FirecaresPasswordResetForm
 from .firecares_core.views import ForgotUsername, ContactUs, AccountRequestView, ShowMessage, TruncatedFileAddView
-from .firestation.api import StaffingResource, FireStationResource, FireDepartmentResource
+from .firestation.api import (StaffingResource, FireStationResource, FireDepartmentResource,
+                              PopulationClassBreaksResource)
 from tastypie.api import Api
 from firestation.views import Home
 from osgeo_importer.urls import importer_api
@@ -19,6 +20,7 @@ v1_api = Api(api_name='v1')
 v1_api.register(StaffingResource())
 v1_api.register(FireStationResource())
 v1_api.register(FireDepartmentResource())
+v1_api.register(PopulationClassBreaksResource())
 
 sitemaps = {
     'base': BaseSitemap,
@@ -1,3 +1,6 @@
+import threading
+import time
+from collections import OrderedDict
 from django.core.files.storage import get_storage_class
 from storages.backends.s3boto import S3BotoStorage
 
@@ -26,3 +29,73 @@ def dictfetchall(cursor):
         dict(zip([col[0] for col in desc], row))
         for row in cursor.fetchall()
     ]
+
+
+def bulk_update(model, rows, fields, using='default', batch_size=1000):
+    """
+    Updates many rows with one UPDATE ... FROM (VALUES ...) statement per batch.
+
+    Rows are tuples of (primary key, value for each field). Like Model.save(), auto_now fields are set to the
+    current time. Returns the number of updated rows.
+    """
+    from django.db import connections
+
+    connection = connections[using]
+    meta = model._meta
+    table = connection.ops.quote_name(meta.db_table)
+    pk = meta.pk.column
+    columns = [meta.get_field(field).column for field in fields]
+    casts = ['%s::{0}'.format(meta.get_field(field).db_type(connection)) for field in fields]
+    auto_now = [f.column for f in meta.local_concrete_fields if getattr(f, 'auto_now', False) and f.name not in fields]
+
+    assignments = ['{0}=v.{0}'.format(column) for column in columns]
+    assignments += ['{0}=now()'.format(column) for column in auto_now]
+
+    sql = 'UPDATE {table} SET {assignments} FROM (VALUES {{values}}) AS v({columns}) WHERE {table}.{pk}=v.{pk};'.format(
+        table=table, assignments=', '.join(assignments), columns=', '.join([pk] + columns), pk=pk)
+    value = '(%s, {0})'.format(', '.join(casts))
+
+    cursor = connection.cursor()
+    updated = 0
+
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        cursor.execute(sql.format(values=', '.join([value] * len(batch))), [v for row in batch for v in row])
+        updated += cursor.rowcount
+
+    return updated
+
+
+class LRUCache(object):
+    """
+    A small in-process least recently used cache, entries expire after timeout seconds.
+    """
+
+    def __init__(self, maxsize=256, timeout=60 * 5):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+            if entry is None or entry[0] < time.time():
+                return default
+
+            # re-insert as the most recently used entry
+            self._entries[key] = entry
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.timeout, value)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -7,14 +7,15 @@ sys.path.append(os.pardir)
 from firecares.firestation.management.commands.match_districts import Command  # noqa
 from firecares.firestation.models import FireDepartment  # noqa
 from django.contrib.gis.geos import GeometryCollection as GC  # noqa
+from django.db import connections  # noqa
+from multiprocessing import Pool, cpu_count  # noqa
 import django  # noqa
 
 django.setup()
-files = glob.glob(sys.argv[1] + '*districts*.geojson')
 
-parsed_files = [(n.split('-')[1].upper(), n.split('-')[2], n) for n in files]
 
-for state, name, path in parsed_files:
+def process(parsed_file):
+    state, name, path = parsed_file
     department = None
 
     try:
@@ -30,3 +31,23 @@ for state, name, path in parsed_files:
 
     with open(os.path.join(sys.argv[1], 'processed', 'us-{0}-{1}-disticts_processed.geojson'.format(state.lower(), name, department.name.replace(' ', '_').lower())), 'w') as output:
         output.write(geometry_collection.json)
+
+    return path
+
+
+if __name__ == '__main__':
+    files = glob.glob(sys.argv[1] + '*districts*.geojson')
+
+    parsed_files = [(n.split('-')[1].upper(), n.split('-')[2], n) for n in files]
+
+    # forked workers must open their own database connections
+    for connection in connections.all():
+        connection.close()
+
+    pool = Pool(int(sys.argv[2]) if len(sys.argv) > 2 else cpu_count())
+
+    for path in pool.imap_unordered(process, parsed_files):
+        print 'Processed {0}'.format(path)
+
+    pool.close()
+    pool.join()